@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 """Admin section"""
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, g
 
-from pw.blueprints import setup_blueprint
+from pw.blueprints import setup_blueprint, before_write
 from pw.authentication import admin_required
-from pw.models import WikiPage, WikiFile, WikiUser, WikiLoginRecord
-from pw.utils import flash_errors, paginate
+from pw.models import (WikiPage, WikiFile, WikiUser, WikiLoginRecord, WikiLink,
+                       sidebar_cache)
+from pw.utils import flash_errors
+from pw.pagination import paginate
 from pw.admin.forms import KeyPageEditForm, NewUserForm, ManageUserForm
 
 blueprint = Blueprint('admin', __name__, static_folder='../static', url_prefix='/<wiki_group>')
@@ -25,6 +27,7 @@ def keypage_edit():
     form = KeyPageEditForm(textArea='\n'.join(keypage_titles))
 
     if form.validate_on_submit():
+        before_write()
         (WikiPage
          .objects(keypage__exists=True)
          .update(unset__keypage=1))
@@ -34,6 +37,7 @@ def keypage_edit():
             (WikiPage
              .objects(title=new_title)
              .update_one(set__keypage=i+1))
+        sidebar_cache.pop(g.wiki_group)
 
         return redirect(url_for('wiki.home'))
     else:
@@ -84,6 +88,34 @@ def all_files():
     )
 
 
+@blueprint.route('/link-report')
+@admin_required
+def link_report():
+    """Pages no other page links to, and links to missing pages or files."""
+    linked_pages = set(WikiLink.objects(page__exists=True).distinct('page'))
+    orphan_pages = (WikiPage
+                    .objects(id__nin=list(linked_pages), title__ne='Home',
+                             keypage__exists=False)
+                    .only('title')
+                    .order_by('+title'))
+
+    missing_pages = linked_pages - set(WikiPage.objects.distinct('id'))
+    linked_files = set(WikiLink.objects(file__exists=True).distinct('file'))
+    missing_files = linked_files - set(WikiFile.objects.distinct('id'))
+    broken_links = list(WikiLink.objects(page__in=list(missing_pages))) + \
+        list(WikiLink.objects(file__in=list(missing_files)))
+    titles = {wiki_page.id: wiki_page.title for wiki_page in WikiPage
+              .objects(id__in=list(set(link.source for link in broken_links)))
+              .only('title')}
+
+    return render_template(
+        'admin/link_report.html',
+        orphan_pages=orphan_pages,
+        broken_links=broken_links,
+        titles=titles
+    )
+
+
 @blueprint.route('/all-users', methods=['GET', 'POST'])
 @admin_required
 def all_users():
@@ -92,6 +124,7 @@ def all_users():
     if form.validate_on_submit():
         user = WikiUser.objects(name=form.username.data).first()
         if not user:
+            before_write()
             new_user = WikiUser(
                 name=form.username.data,
                 email=form.email.data,
@@ -128,6 +161,7 @@ def manage_user(wiki_user_id):
     )
 
     if form.validate_on_submit():
+        before_write()
         if form.remove.data:
             user.delete()
             flash('User removed.', 'warning')
@@ -154,7 +188,7 @@ def manage_user(wiki_user_id):
 @admin_required
 def login_record():
     query_set = WikiLoginRecord.objects
-    kwargs = paginate(query_set)
+    kwargs = paginate(query_set, 'timestamp', descending=True)
     return render_template(
         'admin/login_records.html',
         **kwargs
@@ -5,8 +5,9 @@ from werkzeug.contrib.fixers import ProxyFix
 from datetime import timedelta
 
 from pw import commands, wiki, super_admin, admin, auth
-from pw.extensions import csrf_protect, bcrypt, db, login_manager, mail
-from pw.models import WikiGroup, WikiPage
+from pw.extensions import (csrf_protect, bcrypt, db, login_manager, mail, mongo_pool,
+                           wiki_groups)
+from pw.models import WikiPage
 
 
 def create_app(config_object='pw.settings'):
@@ -16,6 +17,8 @@ def create_app(config_object='pw.settings'):
     """
     app = Flask(__name__.split('.')[0])
     app.config.from_object(config_object)
+    # for the worker processes of commands, which create their own app
+    app.config['CONFIG_OBJECT'] = config_object
     # TODO: check if this can be put in settings.py
     app.permanent_session_lifetime = timedelta(days=1)
     app.wsgi_app = ProxyFix(app.wsgi_app)
@@ -32,6 +35,7 @@ def register_extensions(app):
     """Register Flask extensions."""
     csrf_protect.init_app(app)
     bcrypt.init_app(app)
+    mongo_pool.init_app(app)
     db.init_app(app)
     login_manager.init_app(app)
     mail.init_app(app)
@@ -54,7 +58,7 @@ def register_errorhandlers(app):
         # If a HTTPException, pull the `code` attribute; default to 500
         error_code = getattr(error, 'code', 500)
         return render_template('{0}.html'.format(error_code)), error_code
-    for errcode in [401, 404, 500]:
+    for errcode in [401, 404, 500, 503]:
         app.errorhandler(errcode)(render_error)
     return None
 
@@ -76,13 +80,17 @@ def register_commands(app):
     app.cli.add_command(commands.lint)
     app.cli.add_command(commands.clean)
     app.cli.add_command(commands.urls)
+    app.cli.add_command(commands.rerender)
+    app.cli.add_command(commands.snapshot_history)
+    app.cli.add_command(commands.migrate_versions)
+    app.cli.add_command(commands.migrate_links)
+    app.cli.add_command(commands.compact_history)
+    app.cli.add_command(commands.move_group)
+    app.cli.add_command(commands.rebuild_search_index)
+    app.cli.add_command(commands.index_history)
+    app.cli.add_command(commands.bench_diff)
 
 
 def register_database(app):
-    for wiki_group in WikiGroup.objects(active=True).all():
-        db.register_connection(
-            alias=wiki_group.db_name, 
-            name=wiki_group.db_name,
-            host=app.config['MONGODB_SETTINGS']['host'],
-            port=app.config['MONGODB_SETTINGS']['port']
-        )
\ No newline at end of file
+    """Load the active wiki groups and register their databases."""
+    wiki_groups.init_app(app)
@@ -5,12 +5,12 @@ from flask import (Blueprint, redirect, url_for, g, session, request,
 from flask_login import current_user, login_user, logout_user
 from werkzeug.urls import url_parse
 
-from pw.blueprints import setup_blueprint
+from pw.blueprints import setup_blueprint, before_write
 from pw.authentication import login_required
 from pw.auth.forms import LoginForm, ChangePwdForm
 from pw.models import WikiUser, WikiLoginRecord
 from pw.utils import flash_errors, convert_user_ids_to_dict, convert_dict_to_user_ids
-from pw.extensions import login_manager
+from pw.extensions import login_manager, wiki_groups
 
 blueprint = Blueprint('auth', __name__, static_folder='../static', url_prefix='/<wiki_group>')
 setup_blueprint(blueprint)
@@ -29,13 +29,15 @@ def login():
             user_id_dict[g.wiki_group] = user.id
             user.id = convert_dict_to_user_ids(user_id_dict)
             login_user(user, form.remember_me.data)
-            WikiLoginRecord(
-                username=form.username.data,
-                browser=request.user_agent.browser, 
-                platform=request.user_agent.platform, 
-                details=request.user_agent.string, 
-                ip=request.remote_addr
-            ).save()
+            # users may still log in while the group is moved, unrecorded
+            if not wiki_groups.is_frozen(g.wiki_group):
+                WikiLoginRecord(
+                    username=form.username.data,
+                    browser=request.user_agent.browser,
+                    platform=request.user_agent.platform,
+                    details=request.user_agent.string,
+                    ip=request.remote_addr
+                ).save()
 
             # details on `url_parse` and `netloc`:
             # https://blog.miguelgrinberg.com/post/the-flask-mega-tutorial-part-v-user-logins
@@ -74,6 +76,7 @@ def change_password():
         elif form.new_password.data != form.confirm_password.data:
             flash('Please confirm new password again.', 'danger')
         else:
+            before_write()
             current_user.set_password(form.new_password.data)
             (WikiUser
              .objects(name=current_user.name)
@@ -1,13 +1,61 @@
 # -*- coding: utf-8 -*-
-from flask import g, request, abort
-import sys
-import inspect
-from mongoengine.connection import DEFAULT_CONNECTION_NAME
+from flask import g, request, abort, session, current_app
+import time
 from datetime import date
+from functools import wraps
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
 
-from pw.extensions import db
+from pw.extensions import wiki_groups
 from pw.wiki.forms import SearchForm
-from pw.models import WikiPage
+from pw.models import WikiPage, db_alias, use_db_alias, using_read_preference
+
+
+def secondary_reads(f):
+    """Let GET requests to the view read from the secondaries of a replica
+    set, with the read preference set for its endpoint in READ_PREFERENCES
+    or else READ_PREFERENCE.
+
+    Users who have written within READ_YOUR_WRITES_SECONDS read from the
+    primary, so that they see their own changes whatever the lag of the
+    secondaries.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        preference = _read_preference(request.endpoint)
+        if preference is None or request.method != 'GET' or _wrote_recently():
+            return f(*args, **kwargs)
+        with using_read_preference(preference):
+            return f(*args, **kwargs)
+    return decorated_function
+
+
+def _read_preference(endpoint):
+    config = current_app.config
+    mode = config.get('READ_PREFERENCES', {}).get(endpoint, config.get('READ_PREFERENCE'))
+    if not mode or mode == 'primary':
+        return None
+    max_staleness = config.get('READ_MAX_STALENESS_SECONDS') or -1
+    return make_read_preference(read_pref_mode_from_name(mode), None, max_staleness)
+
+
+def before_write():
+    """Called by the views right before they change the group database,
+    whatever the method of the request.
+
+    Writes to a group being moved to another host are refused, as they
+    could land after its collections were copied. Otherwise remembers the
+    time, so that `secondary_reads` sends the user to the primary for a
+    while.
+    """
+    if wiki_groups.is_frozen(g.wiki_group):
+        abort(503)
+    session['last_write'] = time.time()
+
+
+def _wrote_recently():
+    last_write = session.get('last_write')
+    window = current_app.config.get('READ_YOUR_WRITES_SECONDS', 30)
+    return last_write is not None and time.time() - last_write < window
 
 
 def setup_blueprint(blueprint):
@@ -21,30 +69,23 @@ def setup_blueprint(blueprint):
     @blueprint.url_value_preprocessor
     def pull_wiki_group_code(endpoint, values):
         g.wiki_group = values.pop('wiki_group')
-        if g.wiki_group not in db.connection.database_names():
+        if g.wiki_group not in wiki_groups:
             abort(404)
 
     @blueprint.before_request
     def open_database_connection():
-        for name, obj in inspect.getmembers(sys.modules['pw.models']):
-            if inspect.isclass(obj) and inspect.getmro(obj)[1] == db.Document:
-                if not obj._meta.get('db_alias'):
-                    obj._get_collection()
-                obj._meta['db_alias'] = g.wiki_group
-                obj._collection = None
-
-    @blueprint.after_request
-    def close_database_connection(response):
-        for name, obj in inspect.getmembers(sys.modules['pw.models']):
-            if inspect.isclass(obj) and inspect.getmro(obj)[1] == db.Document:
-                obj._meta['db_alias'] = DEFAULT_CONNECTION_NAME
-                obj._collection = None
-        return response
+        g.db_alias_token = use_db_alias(g.wiki_group)
+
+    @blueprint.teardown_request
+    def close_database_connection(exc):
+        token = g.pop('db_alias_token', None)
+        if token is not None:
+            db_alias.reset(token)
 
     # Docs: http://flask.pocoo.org/docs/1.0/templating/#context-processors
     @blueprint.context_processor
     def inject_wiki_group_data():
-        if g.wiki_group not in db.connection.database_names():
+        if g.wiki_group not in wiki_groups:
             return dict()
 
         if request.endpoint in [
@@ -55,17 +96,7 @@ def setup_blueprint(blueprint):
 
         search_form = SearchForm()
 
-        wiki_keypages = (WikiPage
-                         .objects(keypage__exists=True)
-                         .only('title')
-                         .order_by('+keypage')
-                         .all())
-
-        # TODO: enhancement - this might be a performance bottleneck in the future.
-        wiki_changes = (WikiPage
-                        .objects
-                        .only('title', 'modified_on')
-                        .order_by('-modified_on')[:5])
+        wiki_keypages, wiki_changes = WikiPage.sidebar()
 
         latest_change_time = wiki_changes[0].modified_on
         if latest_change_time.date() == date.today():
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""In-process caches."""
+import time
+from collections import OrderedDict
+from threading import RLock
+
+from flask import current_app
+
+
+class LRUCache:
+    """A bounded mapping which evicts the least recently used entry.
+
+    All operations are guarded by a lock, so an instance can be shared
+    between threads.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self._data),
+            maxsize=self.maxsize
+        )
+
+
+class GroupCache:
+    """An `LRUCache` for each wiki group, whose size is read from the app
+    config setting `size_key` when the group is first used."""
+
+    def __init__(self, size_key, default_size=128):
+        self.size_key = size_key
+        self.default_size = default_size
+        self._caches = dict()
+        self._lock = RLock()
+
+    def _cache(self, wiki_group):
+        with self._lock:
+            if wiki_group not in self._caches:
+                self._caches[wiki_group] = LRUCache(
+                    current_app.config.get(self.size_key, self.default_size))
+            return self._caches[wiki_group]
+
+    def get(self, wiki_group, key, default=None):
+        return self._cache(wiki_group).get(key, default)
+
+    def set(self, wiki_group, key, value):
+        self._cache(wiki_group).set(key, value)
+
+    def clear(self, wiki_group):
+        self._cache(wiki_group).clear()
+
+    def stats(self, wiki_group):
+        return self._cache(wiki_group).stats()
+
+    def all_stats(self):
+        """The stats of the groups used so far, by group."""
+        with self._lock:
+            caches = sorted(self._caches.items())
+        return [(wiki_group, cache.stats()) for wiki_group, cache in caches]
+
+
+class ExpiringGroupCache:
+    """A single value for each wiki group, kept for the number of seconds
+    read from the app config setting `ttl_key`, or until it is popped."""
+
+    def __init__(self, ttl_key, default_ttl=10):
+        self.ttl_key = ttl_key
+        self.default_ttl = default_ttl
+        self._values = dict()
+        # bumped by `pop`, so that a value loaded meanwhile is not kept
+        self._generations = dict()
+        self._lock = RLock()
+
+    def get(self, wiki_group, load):
+        """The value of `wiki_group`, from `load()` if missing or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._values.get(wiki_group)
+            generation = self._generations.get(wiki_group, 0)
+        if entry is not None and now < entry[0]:
+            return entry[1]
+
+        value = load()
+        ttl = current_app.config.get(self.ttl_key, self.default_ttl)
+        with self._lock:
+            if self._generations.get(wiki_group, 0) == generation:
+                self._values[wiki_group] = (now + ttl, value)
+        return value
+
+    def pop(self, wiki_group):
+        with self._lock:
+            self._values.pop(wiki_group, None)
+            self._generations[wiki_group] = self._generations.get(wiki_group, 0) + 1
@@ -1,13 +1,30 @@
 # -*- coding: utf-8 -*-
 """Click commands."""
 import os
+import json
+import time
+import random
+import shutil
+import multiprocessing
+from datetime import datetime, timedelta
 from glob import glob
+from itertools import islice
 from subprocess import call
 
 import click
 from flask import current_app
 from flask.cli import with_appcontext
 from werkzeug.exceptions import MethodNotAllowed, NotFound
+from mongoengine.errors import NotUniqueError
+from pymongo import DeleteMany, InsertOne, ReplaceOne, UpdateOne, UpdateMany
+
+from pw.extensions import markdown, mongo_pool, wiki_groups
+from pw.models import (WikiGroup, WikiPage, WikiPageVersion, WikiLink, diff_codec,
+                       snapshot_codec, linked_files, use_db_alias, using_db_alias)
+from pw.diff import BACKENDS, apply_hunks, apply_patch, make_patch, parse_patch
+from pw.markdown import replace_links
+from pw.search import search_index, tokenize
+from pw.utils import compress_text, decompress_text
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.join(HERE, os.pardir)
@@ -124,3 +141,775 @@ def urls(url, order):
 
     for row in rows:
         click.echo(str_template.format(*row[:column_length]))
+
+
+def _wiki_groups(groups):
+    """Check the groups given on the command line, or return all active ones."""
+    active = [wiki_group.db_name for wiki_group in WikiGroup.objects(active=True)]
+    for wiki_group in groups:
+        if wiki_group not in active:
+            raise click.BadParameter(
+                '{} is not an active wiki group'.format(wiki_group),
+                param_hint='--group')
+    return groups or active
+
+
+_rerender_app = None
+
+
+def _init_rerender_worker(config_object, wiki_group):
+    global _rerender_app
+    from pw.app import create_app
+    _rerender_app = create_app(config_object)
+    # the worker only ever works on this group
+    use_db_alias(wiki_group)
+
+
+def _rerender_page(args):
+    """Render the markdown of a page and its comments in a worker process."""
+    wiki_group, wiki_page_id, md, comments = args
+    with _rerender_app.app_context():
+        for attempt in range(2):
+            try:
+                wiki_page = WikiPage(id=wiki_page_id)
+                rendered = markdown(wiki_page, md, wiki_group=wiki_group)
+                # references from comments are not stored on the page
+                comments_html = list()
+                for comment_id, comment_md in comments:
+                    commented_page = WikiPage(id=wiki_page_id)
+                    comment_html = markdown(commented_page, comment_md,
+                                            wiki_group=wiki_group).html
+                    comments_html.append((
+                        comment_id,
+                        comment_html,
+                        [ref.id for ref in commented_page.refs],
+                        list(linked_files(comment_md))
+                    ))
+                break
+            except NotUniqueError:
+                # another worker created a page referenced here first
+                if attempt:
+                    raise
+    return dict(
+        id=wiki_page_id,
+        toc=rendered.toc,
+        html=rendered.html,
+        refs=[ref.id for ref in wiki_page.refs],
+        files=list(linked_files(md)),
+        blocks=(None if rendered.blocks is None
+                else [block.to_mongo() for block in rendered.blocks]),
+        comments=comments_html
+    )
+
+
+@click.command()
+@click.option('-g', '--group', 'groups', multiple=True,
+              help='Database name of a wiki group to re-render (default: all active groups)')
+@click.option('-w', '--workers', default=None, type=int,
+              help='Number of worker processes (default: number of CPUs)')
+@click.option('-b', '--batch-size', default=200,
+              help='Number of pages written back at once (default: 200)')
+@click.option('--restart', default=False, is_flag=True,
+              help='Ignore the checkpoint of a previous run')
+@with_appcontext
+def rerender(groups, workers, batch_size, restart):
+    """Re-render the stored html of wiki pages and their comments.
+
+    The link graph of the pages is rebuilt along the way. Progress is
+    checkpointed after every batch, so an interrupted run continues where
+    it stopped.
+    """
+    groups = _wiki_groups(groups)
+    checkpoint_path = os.path.join(current_app.config['DATA_PATH'], 'rerender')
+    os.makedirs(checkpoint_path, exist_ok=True)
+    # pymongo clients must not be shared with forked processes
+    context = multiprocessing.get_context('spawn')
+
+    for wiki_group in groups:
+        checkpoint_file = os.path.join(checkpoint_path, '{}.json'.format(wiki_group))
+        checkpoint = dict(last_id=None, done=0)
+        if os.path.exists(checkpoint_file) and not restart:
+            with open(checkpoint_file) as f:
+                checkpoint = json.load(f)
+            click.echo('{}: resuming after {} pages'.format(wiki_group, checkpoint['done']))
+
+        with using_db_alias(wiki_group):
+            pages = WikiPage.objects
+            if checkpoint['last_id']:
+                pages = pages(id__gt=checkpoint['last_id'])
+            total = checkpoint['done'] + pages.count()
+            pages = (pages
+                     .only('md', 'comments')
+                     .order_by('id')
+                     .no_cache()
+                     .batch_size(batch_size))
+            collection = WikiPage._get_collection()
+
+            start = time.time()
+            rendered_count = 0
+            with context.Pool(workers, _init_rerender_worker,
+                              (current_app.config['CONFIG_OBJECT'], wiki_group)) as pool:
+                batch = list()
+                for wiki_page in pages:
+                    batch.append((
+                        wiki_group,
+                        wiki_page.id,
+                        wiki_page.md,
+                        [(c.id, c.md) for c in wiki_page.comments]
+                    ))
+                    if len(batch) == batch_size:
+                        rendered_count += _rerender_batch(pool, collection, batch)
+                        _save_checkpoint(checkpoint_file, checkpoint, batch)
+                        _echo_progress(wiki_group, checkpoint['done'], total,
+                                       rendered_count, start)
+                        batch = list()
+                if batch:
+                    rendered_count += _rerender_batch(pool, collection, batch)
+                    _save_checkpoint(checkpoint_file, checkpoint, batch)
+            _echo_progress(wiki_group, checkpoint['done'], total, rendered_count, start)
+
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+
+
+def _rerender_batch(pool, collection, batch):
+    requests = list()
+    # the links of the pages are rebuilt from scratch
+    links = [DeleteMany({'source': {'$in': [wiki_page_id for _, wiki_page_id, _, _ in batch]}})]
+    for result in pool.imap_unordered(_rerender_page, batch, chunksize=8):
+        updates = {
+            'toc': result['toc'],
+            'html': result['html'],
+            'refs': result['refs'],
+        }
+        if result['blocks'] is None:
+            page_update = {'$set': updates, '$unset': {'blocks': 1}}
+        else:
+            updates['blocks'] = result['blocks']
+            page_update = {'$set': updates}
+        requests.append(UpdateOne({'_id': result['id']}, page_update))
+        links += _link_requests(result['id'], None, result['refs'], result['files'])
+        for comment_id, comment_html, refs, files in result['comments']:
+            requests.append(UpdateOne(
+                {'_id': result['id'], 'comments.id': comment_id},
+                {'$set': {'comments.$.html': comment_html}}
+            ))
+            links += _link_requests(result['id'], comment_id, refs, files)
+    if requests:
+        collection.bulk_write(requests, ordered=False)
+    # deletes have to run first
+    WikiLink._get_collection().bulk_write(links, ordered=True)
+    return len(batch)
+
+
+def _link_requests(source, comment, pages, files):
+    edges = [{'page': _id} for _id in set(pages)] + [{'file': _id} for _id in set(files)]
+    for edge in edges:
+        edge['source'] = source
+        if comment is not None:
+            edge['comment'] = comment
+    return [InsertOne(edge) for edge in edges]
+
+
+def _save_checkpoint(checkpoint_file, checkpoint, batch):
+    checkpoint['last_id'] = str(batch[-1][1])
+    checkpoint['done'] += len(batch)
+    with open(checkpoint_file, 'w') as f:
+        json.dump(checkpoint, f)
+
+
+def _echo_progress(wiki_group, done, total, rendered_count, start):
+    elapsed = time.time() - start
+    click.echo('{}: {}/{} pages, {:.1f} pages/s'.format(
+        wiki_group, done, total,
+        rendered_count / elapsed if elapsed else 0))
+
+
+@click.command('snapshot-history')
+@click.option('-g', '--group', 'groups', multiple=True,
+              help='Database name of a wiki group (default: all active groups)')
+@with_appcontext
+def snapshot_history(groups):
+    """Back-fill the snapshots of existing page versions.
+
+    Snapshots are stored every HISTORY_SNAPSHOT_INTERVAL versions, and
+    existing ones are kept.
+    """
+    interval = current_app.config.get('HISTORY_SNAPSHOT_INTERVAL')
+    if not interval:
+        raise click.UsageError('HISTORY_SNAPSHOT_INTERVAL is not set.')
+    codec = snapshot_codec()
+
+    for wiki_group in _wiki_groups(groups):
+        with using_db_alias(wiki_group):
+            collection = WikiPageVersion._get_collection()
+            pages = (WikiPage
+                     .objects(current_version__gt=interval)
+                     .only('md', 'current_version')
+                     .no_cache())
+            snapshot_count = 0
+            for wiki_page in pages:
+                versions = (WikiPageVersion
+                            .objects(page=wiki_page, version__gte=interval)
+                            .only('version', 'diff')
+                            .order_by('-version'))
+                has_snapshot = set(
+                    WikiPageVersion
+                    .objects(page=wiki_page, version__gte=interval,
+                             snapshot__exists=True)
+                    .scalar('version'))
+
+                # walk back from the current markdown
+                requests = list()
+                lines = wiki_page.md.splitlines(True)
+                for pv in versions:
+                    lines = apply_hunks(lines, parse_patch(pv.diff), revert=True)
+                    if pv.version % interval == 0 and pv.version not in has_snapshot:
+                        requests.append(UpdateOne({'_id': pv.id}, {'$set': {
+                            'snapshot': compress_text(''.join(lines), codec),
+                            'snapshot_codec': codec
+                        }}))
+                if requests:
+                    collection.bulk_write(requests, ordered=False)
+                    snapshot_count += len(requests)
+            click.echo('{}: {} snapshots stored'.format(wiki_group, snapshot_count))
+
+
+@click.command('migrate-versions')
+@click.option('-g', '--group', 'groups', multiple=True,
+              help='Database name of a wiki group (default: all active groups)')
+@click.option('-b', '--batch-size', default=200,
+              help='Number of pages migrated at once (default: 200)')
+@with_appcontext
+def migrate_versions(groups, batch_size):
+    """Move the version list of wiki pages into the versions themselves.
+
+    Every WikiPageVersion gets a reference to its page, and the `versions`
+    list is removed from the page. Pages already migrated are skipped, so
+    the command can be run again after an interruption.
+    """
+    for wiki_group in _wiki_groups(groups):
+        with using_db_alias(wiki_group):
+            pages = WikiPage._get_collection()
+            versions = WikiPageVersion._get_collection()
+            migrated = 0
+            cursor = pages.find({'versions': {'$exists': True}}, {'versions': 1})
+            while True:
+                batch = list(islice(cursor, batch_size))
+                if not batch:
+                    break
+                requests = [
+                    UpdateMany(
+                        # references may be stored as DBRef
+                        {'_id': {'$in': [getattr(v, 'id', v) for v in page['versions']]}},
+                        {'$set': {'page': page['_id']}})
+                    for page in batch if page['versions']
+                ]
+                if requests:
+                    versions.bulk_write(requests, ordered=False)
+                pages.update_many(
+                    {'_id': {'$in': [page['_id'] for page in batch]}},
+                    {'$unset': {'versions': 1}})
+                migrated += len(batch)
+                click.echo('{}: {} pages migrated'.format(wiki_group, migrated))
+
+
+@click.command('migrate-links')
+@click.option('-g', '--group', 'groups', multiple=True,
+              help='Database name of a wiki group (default: all active groups)')
+@click.option('-b', '--batch-size', default=200,
+              help='Number of pages or versions updated at once (default: 200)')
+@with_appcontext
+def migrate_links(groups, batch_size):
+    """Store the page links in pages, comments and history by page id.
+
+    Links to pages which do not exist are left as they are. Links already
+    stored by id are skipped, so the command can be run again.
+    """
+    diff_field = WikiPageVersion._fields['diff']
+
+    for wiki_group in _wiki_groups(groups):
+        with using_db_alias(wiki_group):
+            pages = WikiPage._get_collection()
+            ids = {page['title']: page['_id'] for page in pages.find({}, {'title': 1})}
+
+            updated = 0
+            cursor = pages.find({}, {'md': 1, 'comments.md': 1})
+            while True:
+                batch = list(islice(cursor, batch_size))
+                if not batch:
+                    break
+                requests = list()
+                for page in batch:
+                    updates = dict()
+                    md = replace_links(page.get('md') or '', ids)
+                    if md != page.get('md', ''):
+                        updates['md'] = md
+                    for i, comment in enumerate(page.get('comments', [])):
+                        md = replace_links(comment.get('md') or '', ids)
+                        if md != comment.get('md', ''):
+                            updates['comments.{}.md'.format(i)] = md
+                    if updates:
+                        requests.append(UpdateOne({'_id': page['_id']}, {'$set': updates}))
+                if requests:
+                    pages.bulk_write(requests, ordered=False)
+                    updated += len(requests)
+            click.echo('{}: {} pages updated'.format(wiki_group, updated))
+
+            versions = WikiPageVersion._get_collection()
+            updated = 0
+            cursor = versions.find({}, {'diff': 1, 'snapshot': 1, 'snapshot_codec': 1})
+            while True:
+                batch = list(islice(cursor, batch_size))
+                if not batch:
+                    break
+                requests = list()
+                for pv in batch:
+                    updates = dict()
+                    diff = diff_field.to_python(pv.get('diff')) or ''
+                    new_diff = replace_links(diff, ids)
+                    if new_diff != diff:
+                        updates['diff'] = diff_field.to_mongo(new_diff)
+                    if pv.get('snapshot') is not None:
+                        codec = pv.get('snapshot_codec')
+                        snapshot = decompress_text(pv['snapshot'], codec)
+                        new_snapshot = replace_links(snapshot, ids)
+                        if new_snapshot != snapshot:
+                            updates['snapshot'] = compress_text(new_snapshot, codec)
+                    if updates:
+                        requests.append(UpdateOne({'_id': pv['_id']}, {'$set': updates}))
+                if requests:
+                    versions.bulk_write(requests, ordered=False)
+                    updated += len(requests)
+            click.echo('{}: {} versions updated'.format(wiki_group, updated))
+
+
+@click.command('compact-history')
+@click.option('-g', '--group', 'groups', multiple=True,
+              help='Database name of a wiki group (default: all active groups)')
+@click.option('-d', '--days', type=int, default=None,
+              help='Keep the versions of this many days (default: HISTORY_RETENTION_DAYS)')
+@click.option('-b', '--batch-size', default=200,
+              help='Number of pages or versions updated at once (default: 200)')
+@click.option('--reindex', default=False, is_flag=True,
+              help='Create the missing indexes of the versions and drop the obsolete ones')
+@with_appcontext
+def compact_history(groups, days, batch_size, reindex):
+    """Drop old page versions and compress the diffs of the others.
+
+    The versions of a page older than the retention window are squashed
+    into a snapshot of the oldest version kept. Diffs stored as plain text
+    are then compressed with HISTORY_DIFF_CODEC.
+    """
+    if days is None:
+        days = current_app.config.get('HISTORY_RETENTION_DAYS', 365)
+    cutoff = datetime.now() - timedelta(days=days)
+    diff_field = WikiPageVersion._fields['diff']
+    codec = snapshot_codec()
+
+    for wiki_group in _wiki_groups(groups):
+        with using_db_alias(wiki_group):
+            collection = WikiPageVersion._get_collection()
+            # the last version of each page older than the cutoff, at once
+            last_old = {result['_id']: result['version'] for result in collection.aggregate([
+                {'$match': {'modified_on': {'$lt': cutoff}}},
+                {'$group': {'_id': '$page', 'version': {'$max': '$version'}}}
+            ])}
+            pages = (WikiPage
+                     .objects(id__in=list(last_old), current_version__gt=1)
+                     .only('md', 'current_version', 'first_version')
+                     .no_cache())
+            dropped = 0
+            batch = list()
+            for wiki_page in pages:
+                last_old_version = last_old[wiki_page.id]
+                if last_old_version >= wiki_page.first_version:
+                    batch.append((wiki_page, last_old_version + 1))
+                    dropped += last_old_version + 1 - wiki_page.first_version
+                if len(batch) == batch_size:
+                    _squash_versions(batch, codec)
+                    batch = list()
+            if batch:
+                _squash_versions(batch, codec)
+            click.echo('{}: {} versions dropped'.format(wiki_group, dropped))
+
+            compressed = 0
+            if diff_codec():
+                cursor = collection.find({'diff': {'$type': 'string'}}, {'diff': 1})
+                while True:
+                    batch = list(islice(cursor, batch_size))
+                    if not batch:
+                        break
+                    requests = list()
+                    for pv in batch:
+                        data = diff_field.to_mongo(pv['diff'])
+                        if data is not pv['diff']:
+                            requests.append(UpdateOne(
+                                {'_id': pv['_id']}, {'$set': {'diff': data}}))
+                    if requests:
+                        collection.bulk_write(requests, ordered=False)
+                        compressed += len(requests)
+                click.echo('{}: {} diffs compressed'.format(wiki_group, compressed))
+
+            if reindex:
+                obsolete = _sync_indexes(WikiPageVersion)
+                click.echo('{}: indexes created, {} obsolete ones dropped'.format(
+                    wiki_group, len(obsolete)))
+
+
+def _sync_indexes(document):
+    """Create the missing indexes of `document`, then drop the indexes it
+    no longer declares, by name, and return their names. The collection
+    stays indexed throughout."""
+    document.ensure_indexes()
+    declared = [spec['fields'] for spec in document._meta['index_specs']]
+    collection = document._get_collection()
+    obsolete = list()
+    for name, index in collection.index_information().items():
+        if name == '_id_':
+            continue
+        key = [(field, direction) for field, direction in index['key']]
+        if ('_fts', 'text') in key:
+            # text indexes are stored under the fields _fts and _ftsx
+            weights = index.get('weights', {})
+            if any(sorted(weights) == sorted(field for field, _ in fields)
+                   for fields in declared):
+                continue
+        elif key in declared:
+            continue
+        collection.drop_index(name)
+        obsolete.append(name)
+    return obsolete
+
+
+def _squash_versions(batch, codec):
+    """Drop the versions of each `(wiki_page, first_version)` before
+    `first_version`, keeping a snapshot of the markdown of `first_version`."""
+    snapshots, pages, deletes = list(), list(), list()
+    for wiki_page, first_version in batch:
+        if first_version < wiki_page.current_version:
+            md = wiki_page.get_md(first_version)
+            snapshots.append(UpdateOne(
+                {'page': wiki_page.id, 'version': first_version},
+                {'$set': {'snapshot': compress_text(md, codec), 'snapshot_codec': codec}}))
+        pages.append(UpdateOne(
+            {'_id': wiki_page.id}, {'$set': {'first_version': first_version}}))
+        deletes.append(DeleteMany(
+            {'page': wiki_page.id, 'version': {'$lt': first_version}}))
+
+    # versions are only deleted once nothing needs them
+    collection = WikiPageVersion._get_collection()
+    if snapshots:
+        collection.bulk_write(snapshots, ordered=False)
+    WikiPage._get_collection().bulk_write(pages, ordered=False)
+    collection.bulk_write(deletes, ordered=False)
+
+
+@click.command('index-history')
+@click.option('-g', '--group', 'groups', multiple=True,
+              help='Database name of a wiki group (default: all active groups)')
+@click.option('-b', '--batch-size', default=200,
+              help='Number of pages updated at once (default: 200)')
+@with_appcontext
+def index_history(groups, batch_size):
+    """Back-fill what the changes of existing page versions added and
+    removed, who made them and when, and the words of existing comments,
+    for history search.
+
+    The text index the versions used to have is dropped. Versions and
+    comments already indexed are skipped, so the command can be run again.
+    """
+    for wiki_group in _wiki_groups(groups):
+        with using_db_alias(wiki_group):
+            collection = WikiPageVersion._get_collection()
+            # the text index the versions had
+            _sync_indexes(WikiPageVersion)
+
+            pages = (WikiPage
+                     .objects(current_version__gt=1)
+                     .only('current_version', 'modified_on', 'modified_by')
+                     .no_cache())
+            indexed = 0
+            requests = list()
+            for wiki_page in pages:
+                versions = list(collection
+                                .find({'page': wiki_page.id},
+                                      {'version': 1, 'diff': 1, 'changed_on': 1,
+                                       'modified_on': 1, 'modified_by': 1})
+                                .sort('version', -1))
+                # the next version was made by its own author
+                changed_on, changed_by = wiki_page.modified_on, wiki_page.modified_by
+                for pv in versions:
+                    if 'changed_on' not in pv:
+                        version = WikiPageVersion(diff=WikiPageVersion._fields['diff']
+                                                  .to_python(pv.get('diff')) or '')
+                        version.set_changes(version.diff)
+                        requests.append(UpdateOne({'_id': pv['_id']}, {'$set': {
+                            'changed_on': changed_on,
+                            'changed_by': changed_by,
+                            'added': version.added,
+                            'removed': version.removed
+                        }}))
+                    changed_on, changed_by = pv.get('modified_on'), pv.get('modified_by')
+                if len(requests) >= batch_size:
+                    collection.bulk_write(requests, ordered=False)
+                    indexed += len(requests)
+                    requests = list()
+            if requests:
+                collection.bulk_write(requests, ordered=False)
+                indexed += len(requests)
+            click.echo('{}: {} versions indexed'.format(wiki_group, indexed))
+
+            pages = WikiPage._get_collection()
+            cursor = pages.find({'comments': {'$elemMatch': {'words': {'$exists': False}}}},
+                                {'comments.id': 1, 'comments.md': 1, 'comments.words': 1})
+            indexed = 0
+            while True:
+                batch = list(islice(cursor, batch_size))
+                if not batch:
+                    break
+                requests = list()
+                for page in batch:
+                    # by comment id, comments may be added or deleted meanwhile
+                    requests.extend(
+                        UpdateOne({'_id': page['_id'], 'comments.id': comment['id']},
+                                  {'$set': {'comments.$.words':
+                                            sorted(set(tokenize(comment.get('md'))))}})
+                        for comment in page['comments'] if 'words' not in comment)
+                if requests:
+                    pages.bulk_write(requests, ordered=False)
+                    indexed += len(requests)
+            click.echo('{}: {} comments indexed'.format(wiki_group, indexed))
+
+
+@click.command('rebuild-search-index')
+@click.option('-g', '--group', 'groups', multiple=True,
+              help='Database name of a wiki group (default: all active groups)')
+@with_appcontext
+def rebuild_search_index(groups):
+    """Index every page and write the search index file of each group.
+
+    Running servers keep their own index in memory, the file is read by
+    the processes started afterwards.
+    """
+    for wiki_group in _wiki_groups(groups):
+        with using_db_alias(wiki_group):
+            start = time.time()
+            count = search_index.rebuild(wiki_group)
+            click.echo('{}: {} pages indexed in {:.1f}s'.format(
+                wiki_group, count, time.time() - start))
+
+
+@click.command('move-group')
+@click.argument('wiki_group')
+@click.argument('host')
+@click.option('-b', '--batch-size', default=1000,
+              help='Number of documents copied at once (default: 1000)')
+@click.option('-u', '--upload-path', default=None,
+              help='Upload directory used with the new host, '
+                   'the files of the group are copied there')
+@with_appcontext
+def move_group(wiki_group, host, batch_size, upload_path):
+    """Move the database of WIKI_GROUP to HOST, a host name or mongodb:// URI.
+
+    The collections are copied while the group is in use. Writes to the group
+    are then frozen, and once every process has seen it, the documents which
+    changed in the meantime are copied again before the group is switched to
+    HOST. The database on the old host is left in place.
+    """
+    wg = WikiGroup.objects(db_name=wiki_group, active=True).first()
+    if wg is None:
+        raise click.BadParameter(
+            '{} is not an active wiki group'.format(wiki_group),
+            param_hint='WIKI_GROUP')
+    if (wg.host or None) == (host or None):
+        raise click.BadParameter(
+            '{} is already on {}'.format(wiki_group, host), param_hint='HOST')
+    source = mongo_pool.client(wg.host)[wiki_group]
+    target = mongo_pool.client(host)[wiki_group]
+    upload_source = os.path.join(current_app.config['UPLOAD_PATH'], wiki_group)
+    upload_target = os.path.join(upload_path, wiki_group) if upload_path else None
+    if upload_target and os.path.abspath(upload_target) == os.path.abspath(upload_source):
+        upload_target = None
+
+    def copy():
+        names = [name for name in source.list_collection_names()
+                 if not name.startswith('system.')]
+        for name in names:
+            written, deleted = _sync_collection(source[name], target[name], batch_size)
+            click.echo('{}: {} documents copied, {} deleted'.format(name, written, deleted))
+        for name in target.list_collection_names():
+            if name not in names and not name.startswith('system.'):
+                target.drop_collection(name)
+        if upload_target:
+            click.echo('{} files copied'.format(_sync_directory(upload_source, upload_target)))
+        return names
+
+    start = time.time()
+    for name in copy():
+        _copy_indexes(source[name], target[name])
+    click.echo('Copied in {:.1f}s'.format(time.time() - start))
+
+    wait = current_app.config.get('WIKI_GROUP_TTL', 30) + 1
+    click.echo('Freezing writes, waiting {}s for every process to see it'.format(wait))
+    wg.update(set__frozen=True)
+    wiki_groups.invalidate()
+    start = time.time()
+    try:
+        time.sleep(wait)
+        copy()
+        wg.update(set__host=host, set__frozen=False)
+    except BaseException:
+        wg.update(set__frozen=False)
+        raise
+    finally:
+        wiki_groups.invalidate()
+    click.echo('{} moved to {}, writes frozen for {:.1f}s'.format(
+        wiki_group, host, time.time() - start))
+
+
+def _sync_collection(source, target, batch_size):
+    """Make `target` hold the documents of `source`, only writing the ones
+    which differ. Returns the numbers of documents written and deleted."""
+    written, deleted = 0, 0
+    last_id = None
+    cursor = source.find({}, sort=[('_id', 1)], batch_size=batch_size)
+    while True:
+        batch = list(islice(cursor, batch_size))
+        if not batch:
+            break
+        ids = [doc['_id'] for doc in batch]
+        existing = {doc['_id']: doc for doc in target.find({'_id': {'$in': ids}})}
+        requests = [ReplaceOne({'_id': doc['_id']}, doc, upsert=True)
+                    for doc in batch if existing.get(doc['_id']) != doc]
+        if requests:
+            target.bulk_write(requests, ordered=False)
+            written += len(requests)
+        # documents deleted from the source since the last copy
+        removed = {'$lte': ids[-1], '$nin': ids}
+        if last_id is not None:
+            removed['$gt'] = last_id
+        deleted += target.delete_many({'_id': removed}).deleted_count
+        last_id = ids[-1]
+    rest = {} if last_id is None else {'_id': {'$gt': last_id}}
+    deleted += target.delete_many(rest).deleted_count
+    return written, deleted
+
+
+def _copy_indexes(source, target):
+    for name, index in source.index_information().items():
+        if name == '_id_':
+            continue
+        keys = index.pop('key')
+        index.pop('v', None)
+        index.pop('ns', None)
+        target.create_index(keys, name=name, **index)
+
+
+def _sync_directory(source, target):
+    """Copy the files of `source` which are missing or older in `target`.
+    Returns the number of files copied."""
+    copied = 0
+    for root, dirs, files in os.walk(source):
+        target_root = os.path.join(target, os.path.relpath(root, source))
+        os.makedirs(target_root, exist_ok=True)
+        for name in files:
+            source_file = os.path.join(root, name)
+            target_file = os.path.join(target_root, name)
+            source_stat = os.stat(source_file)
+            if (not os.path.exists(target_file)
+                    or os.path.getsize(target_file) != source_stat.st_size
+                    or os.path.getmtime(target_file) < source_stat.st_mtime):
+                shutil.copy2(source_file, target_file)
+                copied += 1
+    return copied
+
+
+def _synthetic_histories(lines, edits, seed=0):
+    """Pairs of page versions with a few edited lines, by kind of page."""
+    r = random.Random(seed)
+
+    def edit(text):
+        new_lines = text.splitlines(True)
+        for _ in range(edits):
+            i = r.randrange(len(new_lines))
+            op = r.random()
+            if op < 0.4:
+                new_lines[i] = 'changed line {}\n'.format(r.randrange(100))
+            elif op < 0.7:
+                new_lines.insert(i, 'new line {}\n'.format(r.randrange(100)))
+            else:
+                del new_lines[i]
+        return ''.join(new_lines)
+
+    texts = [
+        ('log dump', ''.join(
+            '2019-01-01 00:00:{:02d} INFO worker {} started\n'.format(i % 60, i % 7)
+            for i in range(lines))),
+        ('generated table', ''.join(
+            '| {} | {} | ok |\n'.format(i % 10, i % 3) for i in range(lines))),
+        ('prose', ''.join(
+            'Paragraph {} of the page, with some text in it.\n\n'.format(i)
+            for i in range(lines // 2))),
+    ]
+    return [(name, [(text, edit(text))]) for name, text in texts]
+
+
+def _page_histories(wiki_group, pages, versions):
+    """Pairs of consecutive versions of the most edited pages of a group."""
+    with using_db_alias(wiki_group):
+        histories = list()
+        for wiki_page in (WikiPage
+                          .objects(current_version__gt=1)
+                          .only('title', 'md', 'current_version')
+                          .order_by('-current_version')
+                          .limit(pages)):
+            pairs = list()
+            lines = wiki_page.md.splitlines(True)
+            for pv in (WikiPageVersion
+                       .objects(page=wiki_page)
+                       .only('diff')
+                       .order_by('-version')
+                       .limit(versions)):
+                new = ''.join(lines)
+                lines = apply_hunks(lines, parse_patch(pv.diff), revert=True)
+                pairs.append((''.join(lines), new))
+            histories.append((wiki_page.title, pairs))
+        return histories
+
+
+@click.command('bench-diff')
+@click.option('-g', '--group', default=None,
+              help='Also benchmark the history of the pages of this wiki group')
+@click.option('--pages', default=10,
+              help='Number of most edited pages to use (default: 10)')
+@click.option('--versions', default=20,
+              help='Number of latest versions of each page (default: 20)')
+@click.option('--lines', default=20000,
+              help='Number of lines of the synthetic pages (default: 20000)')
+@click.option('--edits', default=20,
+              help='Number of lines edited in the synthetic pages (default: 20)')
+@with_appcontext
+def bench_diff(group, pages, versions, lines, edits):
+    """Compare the diff backends on synthetic pages and page histories."""
+    histories = _synthetic_histories(lines, edits)
+    if group:
+        histories += _page_histories(_wiki_groups((group,))[0], pages, versions)
+
+    backends = sorted(BACKENDS)
+    row = '{:30}' + '  {:>10}  {:>10}' * len(backends)
+    click.echo(row.format('', *[h for b in backends for h in (b, 'bytes')]))
+    for name, pairs in histories:
+        cells = list()
+        for backend in backends:
+            elapsed = size = 0
+            for old, new in pairs:
+                start = time.time()
+                patch = make_patch(old, new, backend)
+                elapsed += time.time() - start
+                size += len(patch)
+                if apply_patch(old, patch) != new:
+                    raise click.ClickException(
+                        '{} produced a wrong patch for {}'.format(backend, name))
+            cells += ['{:.1f} ms'.format(elapsed * 1000), size]
+        click.echo(row.format(name[:30], *cells))
@@ -3,9 +3,16 @@
 
 import re
 import difflib
+from bisect import bisect_left
+from collections import namedtuple
 
 _hdr_pat = re.compile("^@@ -(\d+),?(\d+)? \+(\d+),?(\d+)? @@$")
 _no_eol = "\ No newline at end of file"
+# line breaks recognised by str.splitlines
+_eol_pat = re.compile('(?:\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029])$')
+
+# See `parse_patch`.
+Hunk = namedtuple('Hunk', ['old_start', 'old_lines', 'new_start', 'new_lines'])
 
 
 def apply_patch(s, patch, revert=False):
@@ -17,11 +24,84 @@ def apply_patch(s, patch, revert=False):
         str_after = apply_patch(str_before, patch)
         str_before = apply_patch(str_after, patch, revert=True)
     """
-    s = s.splitlines(True)
+    return ''.join(apply_hunks(s.splitlines(True), parse_patch(patch), revert))
+
+
+def parse_patch(patch):
+    """
+    Parse a patch made by `make_patch` into a list of hunks.
+
+    Each hunk is `(old_start, old_lines, new_start, new_lines)`, where the
+    starts are 0-based line indexes, `old_lines` are the removed lines, and
+    `new_lines` the added lines, as the patches have no context lines.
+    """
+    return [Hunk(old_start-1 + (not old_count), removed,
+                 new_start-1 + (not new_count), added)
+            for old_start, old_count, new_start, new_count, removed, added
+            in parse_hunks(patch)]
+
+
+def apply_hunks(lines, hunks, revert=False):
+    """
+    Apply parsed hunks to a list of lines in place and return it.
+    Hunks are applied from the end, so the line indexes of the ones
+    before stay valid, and lines are only moved when a hunk changes
+    the number of lines.
+    """
+    split = False
+    for hunk in reversed(hunks):
+        if revert:
+            l, src, dst = hunk.new_start, hunk.new_lines, hunk.old_lines
+        else:
+            l, src, dst = hunk.old_start, hunk.old_lines, hunk.new_lines
+        lines[l:l+len(src)] = dst
+        # the last line of a text may have no line break, and must not be
+        # followed by another one
+        end = l + len(dst)
+        if 0 < l < len(lines) and not _eol_pat.search(lines[l-1]):
+            split = True
+        if 0 < end < len(lines) and not _eol_pat.search(lines[end-1]):
+            split = True
+    if split:
+        lines[:] = ''.join(lines).splitlines(True)
+    return lines
+
+
+def make_patch(a, b, backend=None):
+    """
+    Get unified string diff between two strings. Trims top two lines.
+    Returns empty string if strings are identical.
+    `backend` is one of `BACKENDS`, chosen by `choose_backend` if not given.
+
+    Usage:
+        diff = make_patch(str_before, str_after)
+    """
+    a, b = a.splitlines(True), b.splitlines(True)
+    backend = backend or choose_backend(a, b)
+    if backend == 'difflib':
+        diffs = difflib.unified_diff(a, b, n=0)
+        try:
+            _, _ = next(diffs), next(diffs)
+        except StopIteration:
+            pass
+    else:
+        diffs = _unified_diff(a, b, BACKENDS[backend](a, b))
+    return ''.join([d if d[-1] == '\n' else d+'\n'+_no_eol+'\n' for d in diffs])
+
+
+###############################################################################
+
+
+def parse_hunks(patch):
+    """
+    Parse a patch made by `make_patch` into a list of hunks
+    `(old_start, old_count, new_start, new_count, removed, added)`,
+    where the starts are 1-based line numbers as in the hunk header,
+    and `removed`/`added` are the lines without their +/- sign.
+    """
+    hunks = []
     p = patch.splitlines(True)
-    t = ''
-    i = sl = 0
-    (midx, sign) = (1, '+') if not revert else (3, '-')
+    i = 0
     while i < len(p) and p[i].startswith(("---", "+++")):
         i += 1  # skip header lines
     while i < len(p):
@@ -29,9 +109,7 @@ def apply_patch(s, patch, revert=False):
         if not m:
             raise Exception("Cannot process diff")
         i += 1
-        l = int(m.group(midx))-1 + (m.group(midx+1) == '0')
-        t += ''.join(s[sl:l])
-        sl = l
+        removed, added = [], []
         while i < len(p) and p[i][0] != '@':
             if i+1 < len(p) and p[i+1][0] == '\\':
                 line = p[i][:-1]
@@ -40,33 +118,224 @@ def apply_patch(s, patch, revert=False):
                 line = p[i]
                 i += 1
             if len(line) > 0:
-                if line[0] == sign or line[0] == ' ':
-                    t += line[1:]
-                sl += (line[0] != sign)
-    t += ''.join(s[sl:])
-    return t
+                if line[0] == '-':
+                    removed.append(line[1:])
+                elif line[0] == '+':
+                    added.append(line[1:])
+        hunks.append((
+            int(m.group(1)), int(m.group(2) or 1),
+            int(m.group(3)), int(m.group(4) or 1),
+            removed, added
+        ))
+    return hunks
 
 
-def make_patch(a, b):
+def apply_patches(s, patches, revert=False):
     """
-    Get unified string diff between two strings. Trims top two lines.
-    Returns empty string if strings are identical.
-
-    Usage:
-        diff = make_patch(str_before, str_after)
+    Apply a chain of patches, working on one list of lines throughout
+    and joining it into a string only at the end.
     """
-    diffs = difflib.unified_diff(a.splitlines(True), b.splitlines(True), n=0)
-    try:
-        _, _ = next(diffs), next(diffs)
-    except StopIteration: 
-        pass
-    return ''.join([d if d[-1] == '\n' else d+'\n'+_no_eol+'\n' for d in diffs])
-    
+    lines = s.splitlines(True)
+    for patch in patches:
+        lines = apply_hunks(lines, parse_patch(patch), revert)
+    return ''.join(lines)
+
+
 ###############################################################################
+# Diff backends
+#
+# Each backend returns the changed regions `(alo, ahi, blo, bhi)` of two
+# lists of lines, in order, where `a[alo:ahi]` is replaced by `b[blo:bhi]`.
+# difflib's SequenceMatcher is kept for ordinary pages, as it is fast
+# enough there and its patches are already stored. It slows down badly on
+# long, repetitive texts, which are diffed with Myers' O(ND) algorithm
+# instead, anchored on unique lines first (patience diff).
 
+# Pages with fewer lines than this, in both versions together, use difflib.
+DIFFLIB_MAX_LINES = 2000
+# Give up looking for a shortest edit script longer than this, and replace
+# the whole region instead.
+MYERS_MAX_D = 500
+
+
+def choose_backend(a, b):
+    return 'difflib' if len(a) + len(b) < DIFFLIB_MAX_LINES else 'patience'
+
+
+def myers_diff(a, b):
+    changes = []
+    alo, ahi, blo, bhi = _trim(a, b, 0, len(a), 0, len(b))
+    _myers(a, b, alo, ahi, blo, bhi, changes)
+    return changes
+
+
+def patience_diff(a, b):
+    changes = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = _trim(a, b, *stack.pop())
+        if alo == ahi or blo == bhi:
+            if alo < ahi or blo < bhi:
+                changes.append((alo, ahi, blo, bhi))
+            continue
+        anchors = _unique_lcs(a, b, alo, ahi, blo, bhi)
+        if not anchors:
+            _myers(a, b, alo, ahi, blo, bhi, changes)
+            continue
+        # the regions between anchors, handled from the first one on
+        for i, j in reversed(anchors):
+            stack.append((i + 1, ahi, j + 1, bhi))
+            ahi, bhi = i, j
+        stack.append((alo, ahi, blo, bhi))
+    return _merge(sorted(changes))
+
+
+BACKENDS = {
+    'difflib': None,
+    'myers': myers_diff,
+    'patience': patience_diff,
+}
+
+
+def _trim(a, b, alo, ahi, blo, bhi):
+    """Narrow a region down by its common first and last lines."""
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        alo += 1
+        blo += 1
+    while alo < ahi and blo < bhi and a[ahi-1] == b[bhi-1]:
+        ahi -= 1
+        bhi -= 1
+    return alo, ahi, blo, bhi
+
+
+def _unique_lcs(a, b, alo, ahi, blo, bhi):
+    """
+    Longest common subsequence of the lines occurring exactly once in both
+    regions, as a list of `(i, j)`.
+    """
+    counts = {}
+    for i in range(alo, ahi):
+        line = a[i]
+        count = counts.get(line)
+        counts[line] = (i, None, 1) if count is None else (i, None, 2)
+    for j in range(blo, bhi):
+        line = b[j]
+        count = counts.get(line)
+        if count is not None:
+            i, other, n = count
+            counts[line] = (i, j if other is None else -1, n)
+    pairs = sorted((i, j) for i, j, n in counts.values()
+                   if n == 1 and j is not None and j >= 0)
+
+    # patience sorting: longest increasing subsequence of j
+    tails, tail_js, back = [], [], {}
+    for i, j in pairs:
+        k = bisect_left(tail_js, j)
+        back[(i, j)] = tails[k-1] if k else None
+        if k == len(tails):
+            tails.append((i, j))
+            tail_js.append(j)
+        else:
+            tails[k] = (i, j)
+            tail_js[k] = j
+    result = []
+    node = tails[-1] if tails else None
+    while node is not None:
+        result.append(node)
+        node = back[node]
+    result.reverse()
+    return result
+
+
+def _myers(a, b, alo, ahi, blo, bhi, changes, max_d=MYERS_MAX_D):
+    """Append the changes of a shortest edit script between two regions."""
+    n, m = ahi - alo, bhi - blo
+    if not n or not m:
+        if n or m:
+            changes.append((alo, ahi, blo, bhi))
+        return
+
+    # furthest x reached on each diagonal k = x - y, for each d
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, max_d) + 1):
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k-1] < v[k+1]):
+                x = v[k+1]
+            else:
+                x = v[k-1] + 1
+            y = x - k
+            while x < n and y < m and a[alo+x] == b[blo+y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                break
+        else:
+            continue
+        break
+    else:
+        changes.append((alo, ahi, blo, bhi))
+        return
+
+    # walk back, collecting the regions between diagonal moves
+    found = []
+    x, y = n, m
+    end = (n, m)
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k-1] < v[k+1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        snake = x
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+        if x < snake:
+            # lines x..snake are equal; anything after them up to `end` changed
+            if (snake, snake - k) != end:
+                found.append((snake, end[0], snake - k, end[1]))
+            end = (x, y)
+        x, y = max(prev_x, 0), max(prev_y, 0)
+    if end != (0, 0):
+        found.append((0, end[0], 0, end[1]))
+    for i1, i2, j1, j2 in reversed(found):
+        changes.append((alo + i1, alo + i2, blo + j1, blo + j2))
+
+
+def _merge(changes):
+    """Join changed regions which touch each other."""
+    merged = []
+    for change in changes:
+        if merged and merged[-1][1] == change[0] and merged[-1][3] == change[2]:
+            merged[-1] = (merged[-1][0], change[1], merged[-1][2], change[3])
+        else:
+            merged.append(change)
+    return merged
+
+
+def _format_range(start, stop):
+    # same as difflib
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return '{}'.format(beginning)
+    if not length:
+        beginning -= 1
+    return '{},{}'.format(beginning, length)
 
-def apply_patches(s, patches, revert=False):
-    for patch in patches:
-        s = apply_patch(s, patch, revert)
-    return s
 
+def _unified_diff(a, b, changes):
+    """Lines of a unified diff without context, as `difflib.unified_diff`
+    with `n=0` writes them, leaving out the file header."""
+    for alo, ahi, blo, bhi in changes:
+        yield '@@ -{} +{} @@\n'.format(_format_range(alo, ahi), _format_range(blo, bhi))
+        for line in a[alo:ahi]:
+            yield '-' + line
+        for line in b[blo:bhi]:
+            yield '+' + line
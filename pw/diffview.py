@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Side by side view of the changes between two versions of a wiki page.
+
+Only the changed lines and a few lines of context around them are
+rendered. Longer runs of unchanged lines are collapsed into a row which
+loads them when clicked. Versions never change once saved, so rendered
+views are cached per wiki group.
+"""
+from html import escape
+
+from pw.cache import GroupCache
+from pw.diff import parse_patch
+
+diff_cache = GroupCache('HISTORY_DIFF_CACHE_SIZE', 128)
+
+_row = ('<tr><td class="diff_header">{0}</td><td{1}>{2}</td>'
+        '<td class="diff_header">{3}</td><td{4}>{5}</td></tr>\n')
+_expand_row = ('<tr class="diff_next diff-expand" data-url="{0}">'
+               '<td colspan="4">{1} unchanged lines</td></tr>\n')
+
+
+def render_diff(old_md, patch, context=3, expand_url=None):
+    """Render the rows of a table showing `patch`, made by `make_patch`
+    without context lines, applied to `old_md`.
+
+    `expand_url(start, end, offset)` gives the url loading the unchanged old
+    lines `start` to `end`, whose new line numbers are `offset` further on.
+    """
+    lines = old_md.splitlines()
+    rows = []
+    # first old line not shown yet, and the offset of its new line number
+    shown, offset = 0, 0
+    for hunk in parse_patch(patch):
+        start = hunk.old_start
+        rows.append(_unchanged(lines, shown, start, offset, context,
+                               first=not rows, expand_url=expand_url))
+        removed, added = hunk.old_lines, hunk.new_lines
+        for i in range(max(len(removed), len(added))):
+            old = (start + i + 1, removed[i]) if i < len(removed) else None
+            new = (hunk.new_start + i + 1, added[i]) if i < len(added) else None
+            rows.append(_changed(old, new))
+        shown = start + len(removed)
+        offset = hunk.new_start + len(added) - shown
+    rows.append(_unchanged(lines, shown, len(lines), offset, context,
+                           first=not rows, last=True, expand_url=expand_url))
+    return ''.join(rows)
+
+
+def render_lines(old_md, start, end, offset):
+    """Render the rows of unchanged old lines `start` to `end`."""
+    lines = old_md.splitlines()
+    return ''.join(_line(lines, i, offset) for i in range(start, min(end, len(lines))))
+
+
+def _line(lines, i, offset):
+    text = escape(lines[i].rstrip('\r\n'))
+    return _row.format(i + 1, '', text, i + 1 + offset, '', text)
+
+
+def _changed(old, new):
+    if old and new:
+        cls = ' class="diff_chg"'
+        return _row.format(old[0], cls, escape(old[1].rstrip('\r\n')),
+                           new[0], cls, escape(new[1].rstrip('\r\n')))
+    if old:
+        return _row.format(old[0], ' class="diff_sub"', escape(old[1].rstrip('\r\n')),
+                           '', '', '')
+    return _row.format('', '', '', new[0], ' class="diff_add"',
+                       escape(new[1].rstrip('\r\n')))
+
+
+def _unchanged(lines, start, end, offset, context, first=False, last=False,
+               expand_url=None):
+    """Rows of the unchanged lines between two hunks, collapsing the middle."""
+    # context is only shown on the sides next to a change
+    head = start if first else min(end, start + context)
+    tail = end if last else max(head, end - context)
+    rows = [_line(lines, i, offset) for i in range(start, head)]
+    if expand_url is None or tail - head < 2:
+        rows += [_line(lines, i, offset) for i in range(head, tail)]
+    else:
+        rows.append(_expand_row.format(
+            escape(expand_url(head, tail, offset)), tail - head))
+    rows += [_line(lines, i, offset) for i in range(tail, end)]
+    return ''.join(rows)
@@ -17,3 +17,11 @@ mail = Mail()
 from pw.markdown import WikiMarkdown
 
 markdown = WikiMarkdown()
+
+from pw.pool import MongoClientPool
+
+mongo_pool = MongoClientPool()
+
+from pw.registry import WikiGroupRegistry
+
+wiki_groups = WikiGroupRegistry()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Search of several wiki groups at once.
+
+Each group is searched in a thread of a shared pool, with its database as
+the current one, and is yielded as soon as it answers, so the fastest
+groups are shown first. Scores are divided by the best score of their
+group, which makes the results of groups of different sizes comparable.
+
+A group not answering within FEDERATED_SEARCH_TIMEOUT seconds is yielded
+without results, and its search left to finish in the background. A
+group with FEDERATED_SEARCH_PENDING searches still running is not
+searched again until one finishes, so that one slow group cannot take
+all the threads of the pool.
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from contextvars import copy_context
+from functools import partial
+from threading import Lock
+import time
+
+from bson import ObjectId
+from flask import current_app
+
+from pw.models import WikiPage, using_db_alias
+from pw.search import search_index
+
+
+class FederatedSearch:
+    """Fans searches out to the wiki groups on a thread pool."""
+
+    def __init__(self):
+        self._executor = None
+        self._pending = Counter()
+        self._lock = Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    current_app.config.get('FEDERATED_SEARCH_WORKERS', 8),
+                    thread_name_prefix='federated-search')
+            return self._executor
+
+    def search(self, wiki_groups, query, limit=20):
+        """Yield `(wiki_group, results, total)` for each of `wiki_groups`,
+        in the order they answer. `results` is a list of dicts of the best
+        `limit` pages, None for the groups which did not answer."""
+        app = current_app._get_current_object()
+        timeout = app.config.get('FEDERATED_SEARCH_TIMEOUT', 2)
+        max_pending = app.config.get('FEDERATED_SEARCH_PENDING', 2)
+        deadline = time.time() + timeout
+
+        pool = self._pool()
+        futures = dict()
+        busy = list()
+        for wiki_group in wiki_groups:
+            with self._lock:
+                if self._pending[wiki_group] >= max_pending:
+                    busy.append(wiki_group)
+                    continue
+                self._pending[wiki_group] += 1
+            future = pool.submit(copy_context().run, self._search, app, wiki_group, query, limit)
+            future.add_done_callback(partial(self._done, wiki_group))
+            futures[future] = wiki_group
+
+        try:
+            for future in as_completed(futures, timeout=max(deadline - time.time(), 0)):
+                wiki_group = futures.pop(future)
+                try:
+                    results, total = future.result()
+                except Exception:
+                    app.logger.exception('Search of wiki group %s failed', wiki_group)
+                    results, total = None, 0
+                yield wiki_group, results, total
+        except TimeoutError:
+            pass
+        for wiki_group in list(futures.values()) + busy:
+            yield wiki_group, None, 0
+
+    def _done(self, wiki_group, future):
+        with self._lock:
+            self._pending[wiki_group] -= 1
+            if not self._pending[wiki_group]:
+                del self._pending[wiki_group]
+
+    @staticmethod
+    def _search(app, wiki_group, query, limit):
+        with app.app_context(), using_db_alias(wiki_group):
+            matches, total = search_index.search(wiki_group, query, limit=limit, with_scores=True)
+            ids = [ObjectId(page_id) for page_id, _ in matches]
+            wiki_pages = (WikiPage
+                          .objects
+                          .only('title', 'modified_on', 'modified_by')
+                          .in_bulk(ids))
+        best = matches[0][1] if matches else 1
+        results = list()
+        for _id, (_, score) in zip(ids, matches):
+            wiki_page = wiki_pages.get(_id)
+            if wiki_page is not None:
+                results.append(dict(
+                    id=str(_id),
+                    title=wiki_page.title,
+                    modified_by=wiki_page.modified_by,
+                    modified_on=wiki_page.modified_on.strftime('%Y-%m-%d %H:%M:%S'),
+                    score=score / best))
+        return results, total
+
+
+federated_search = FederatedSearch()
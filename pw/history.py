@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Search of page history and comments.
+
+Each page version stores the words of the lines its change added and
+removed, along with who made the change and when. Changes adding or
+removing words are found through the multikey indexes on those lists,
+bounded by date, and when a text was introduced or removed is answered
+from the same indexes, without rebuilding any version. The lines shown
+for a change come from its own diff.
+
+Comments store their words as well, and are found by words, author and
+date through the indexes on the comments of pages.
+"""
+from mongoengine.queryset.visitor import Q
+
+from pw.diff import parse_hunks
+from pw.models import WikiPage, WikiPageVersion
+from pw.search import tokenize
+
+# lines of a change shown in the results
+MAX_LINES = 5
+
+
+def history_query(keyword=None, author=None, start=None, end=None, mode='changed'):
+    """The versions whose change added, removed or either, as `mode`, all
+    the words of `keyword`, made by `author` between `start` and `end`."""
+    words = tokenize(keyword)
+    query = Q()
+    if words:
+        if mode == 'added':
+            query &= Q(added__all=words)
+        elif mode == 'removed':
+            query &= Q(removed__all=words)
+        else:
+            query &= Q(added__all=words) | Q(removed__all=words)
+    if author:
+        query &= Q(changed_by=author)
+    if start:
+        query &= Q(changed_on__gte=start)
+    if end:
+        query &= Q(changed_on__lt=end)
+    return (WikiPageVersion
+            .objects(query)
+            .only('page', 'version', 'diff', 'changed_on', 'changed_by')
+            .no_dereference())
+
+
+def first_changes(keyword, author=None, start=None, end=None, mode='added', limit=100):
+    """For each page, the first change adding the words of `keyword`, or
+    the last one removing them, for the `limit` pages changed latest."""
+    query_set = history_query(keyword, author, start, end, mode)
+    order = 1 if mode == 'added' else -1
+    ids = [result['version'] for result in WikiPageVersion._get_collection().aggregate([
+        {'$match': query_set._query},
+        {'$sort': {'changed_on': order}},
+        {'$group': {'_id': '$page',
+                    'version': {'$first': '$_id'},
+                    'changed_on': {'$first': '$changed_on'}}},
+        # groups come out in no particular order
+        {'$sort': {'changed_on': -1}},
+        {'$limit': limit}
+    ])]
+    versions = query_set.in_bulk(ids)
+    return sorted(versions.values(), key=lambda pv: pv.changed_on, reverse=True)
+
+
+def changed_lines(wiki_page_version, keyword=None, mode='changed'):
+    """The lines of the change of `wiki_page_version` with the words of
+    `keyword`, or the first lines without one, as `(sign, line)`."""
+    words = set(tokenize(keyword))
+    lines = list()
+    for _, _, _, _, removed, added in parse_hunks(wiki_page_version.diff):
+        changes = list()
+        if mode != 'added':
+            changes.extend(('-', line) for line in removed)
+        if mode != 'removed':
+            changes.extend(('+', line) for line in added)
+        for sign, line in changes:
+            if not words or words & set(tokenize(line)):
+                lines.append((sign, line.rstrip('\r\n')))
+                if len(lines) == MAX_LINES:
+                    return lines
+    return lines
+
+
+def search_comments(keyword=None, author=None, start=None, end=None, limit=100):
+    """The comments with all the words of `keyword`, written by `author`
+    between `start` and `end`, newest first, as `(wiki_page, comment)`."""
+    words = set(tokenize(keyword))
+    match = dict()
+    if words:
+        match['words'] = {'$all': sorted(words)}
+    if author:
+        match['author'] = author
+    if start or end:
+        match['timestamp'] = dict()
+        if start:
+            match['timestamp']['$gte'] = start
+        if end:
+            match['timestamp']['$lt'] = end
+    if match:
+        # `comments__match` would turn the operators into field values
+        wiki_pages = WikiPage.objects(__raw__={'comments': {'$elemMatch': match}})
+    else:
+        wiki_pages = WikiPage.objects(comments__timestamp__exists=True)
+
+    results = list()
+    for wiki_page in wiki_pages.only('title', 'comments'):
+        for comment in wiki_page.comments:
+            if author and comment.author != author:
+                continue
+            if start and comment.timestamp < start or end and comment.timestamp >= end:
+                continue
+            if not words <= set(comment.words):
+                continue
+            results.append((wiki_page, comment))
+    results.sort(key=lambda result: result[1].timestamp, reverse=True)
+    return results[:limit]
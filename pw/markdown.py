@@ -1,37 +1,269 @@
-from flask import g
+from flask import g, has_request_context
 import re
-from mistune import Markdown, Renderer, InlineLexer
+import hashlib
+from collections import namedtuple
+from contextlib import contextmanager
+from threading import Lock, RLock
+from bson import ObjectId
+from mistune import Markdown, Renderer, InlineLexer, BlockLexer, BlockGrammar
 from mistune_contrib.toc import TocMixin
 from flask_login import current_user
 
-from pw.models import WikiPage, WikiFile, WikiUser
+from pw.models import WikiPage, WikiFile, WikiUser, WikiBlock, db_alias
+from pw.search import title_index
+from pw.cache import GroupCache
+from pw.diff import parse_hunks
+
+
+_wiki_page_pat = re.compile(r'\[\[(.+?)\]\]')
+# Links are stored as `[[#<page id>]]`, so that they survive renames, and
+# shown as `[[<title>]]` in the editor.
+_wiki_page_id_pat = re.compile(r'#([0-9a-f]{24})$')
+_wiki_page_html_pat = re.compile(
+    r'(<a class="wiki-page" href="/[^/"]+/page/([0-9a-f]{24})">)(.*?)(</a>)')
+_wiki_file_pat = re.compile(r'\[(file|image):(\d+)(@(\d+)x(\d+))?\]')
+_wiki_at_pat = re.compile(r'\[@(.+?)\]')
+
+# Texts for which no block index is kept: line breaks that mistune and
+# str.splitlines disagree on, and link or footnote definitions, which are
+# shared by all blocks.
+_no_blocks_pat = re.compile(
+    r'\r(?!\n)|[\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029\u2424]|^ *\[[^\]\n]+\]:',
+    re.M
+)
+# Changed lines which may alter the extent of the blocks around them.
+_block_structure_pat = re.compile(r'```|~~~|<')
+# A block starting with this cannot continue the block before it.
+_continuation_pat = re.compile(r'[ \t>*+\-_=]|\d+\.')
+
+
+class WikiLinks:
+    """Lookup table of the wiki pages, files and users referenced in a
+    markdown text. Every collection is queried at most once, no matter how
+    many links the text contains.
+    """
+
+    def __init__(self, markdown, resolve_users=False):
+        # the text of the page links, titles or `#<page id>`
+        self.titles = titles = set(_wiki_page_pat.findall(markdown))
+        self.wiki_file_ids = wiki_file_ids = set(
+            int(m[1]) for m in _wiki_file_pat.findall(markdown))
+        self.usernames = usernames = (
+            set(_wiki_at_pat.findall(markdown)) if resolve_users else set())
+
+        self.pages = dict()
+        ids = [m.group(1) for m in map(_wiki_page_id_pat.match, titles) if m]
+        if ids:
+            for wiki_page in WikiPage.objects(id__in=ids).only('title'):
+                self.pages['#{}'.format(wiki_page.id)] = wiki_page
+        if len(ids) < len(titles):
+            for wiki_page in WikiPage.objects(title__in=list(titles)).only('title'):
+                self.pages[wiki_page.title] = wiki_page
+
+        self.files = dict()
+        if wiki_file_ids:
+            for wiki_file in WikiFile.objects(id__in=list(wiki_file_ids)).only('name'):
+                self.files[wiki_file.id] = wiki_file
+
+        self.users = dict()
+        if usernames:
+            for wiki_user in WikiUser.objects(name__in=list(usernames)).only('name', 'email'):
+                self.users[wiki_user.name] = wiki_user
+
+        # pages referenced but not found, to be inserted after rendering
+        self.new_pages = list()
+
+    def get_page(self, title):
+        wiki_page = self.pages.get(title)
+        m = _wiki_page_id_pat.match(title)
+        if wiki_page is None and title not in self.titles:
+            # The pre-scan sees the raw text, so this only happens when the
+            # lexer produces a title the regex did not.
+            if m:
+                wiki_page = WikiPage.objects(id=m.group(1)).only('title').first()
+            else:
+                wiki_page = WikiPage.objects(title=title).only('title').first()
+        if wiki_page is None and m:
+            # the page has been deleted, link to it as it was written
+            wiki_page = WikiPage(id=m.group(1), title=title)
+        if wiki_page is None:
+            self.add_new_page(title, ObjectId())
+        else:
+            self.pages[title] = wiki_page
+        return self.pages[title]
+
+    def show_titles(self, text):
+        """Replace the page ids in the page links of `text` with titles."""
+        def replace(m):
+            wiki_page = self.pages.get(m.group(1))
+            if wiki_page is None or not _wiki_page_id_pat.match(m.group(1)):
+                return m.group(0)
+            return '[[{}]]'.format(wiki_page.title)
+        return _wiki_page_pat.sub(replace, text)
+
+    def add_new_page(self, title, wiki_page_id):
+        wiki_page = WikiPage(
+            id=wiki_page_id,
+            title=title,
+            # pages created by command line tools keep the default author
+            modified_by=current_user.name if has_request_context() else 'system'
+        )
+        self.pages[title] = wiki_page
+        self.new_pages.append(wiki_page)
+
+    def get_file(self, wiki_file_id):
+        wiki_file_id = int(wiki_file_id)
+        if wiki_file_id not in self.files:
+            self.files[wiki_file_id] = WikiFile.objects(id=wiki_file_id).first()
+        return self.files[wiki_file_id]
+
+    def get_user(self, username):
+        if username not in self.users:
+            self.users[username] = WikiUser.objects(name=username).first()
+        return self.users[username]
+
+    def save_new_pages(self):
+        if self.new_pages:
+            WikiPage.objects.insert(self.new_pages, load_bulk=False)
+            for wiki_page in self.new_pages:
+                title_index.add(db_alias.get(), wiki_page.id, wiki_page.title)
+            self.new_pages = list()
+
+
+# Result of rendering a markdown text. `toc` holds the `(level, text)` of
+# its headings, `titles` and `usernames` the pages and users referenced in
+# the output, and `new_pages` the `(title, id)` of the pages created for it.
+# `blocks` holds the `(lines, html_len, headings, titles)` counts of each
+# independent block, or is None if the text cannot be split.
+RenderedMarkdown = namedtuple(
+    'RenderedMarkdown',
+    ['html', 'toc', 'titles', 'usernames', 'new_pages', 'blocks']
+)
+
+
+class RenderCache:
+    """Rendered markdown of each wiki group.
+
+    Entries are keyed by the hash of the markdown source together with the
+    state of every link it references, so a cached result is only reused
+    when it would render the same. Renaming a page or replacing a file bumps
+    its generation, which is part of the key of the markdown linking to it.
+    The entries rendered before are then unreachable and dropped by LRU
+    eviction.
+    """
+
+    def __init__(self):
+        self._caches = GroupCache('MARKDOWN_CACHE_SIZE', 256)
+        # wiki group -> {('p' or 'f', page or file id): generation}, only
+        # for the pages renamed and files replaced since the start
+        self._generations = dict()
+        self._lock = RLock()
+
+    def key(self, wiki_group, markdown, links, toc_offset=0):
+        generations = self._generations.get(wiki_group, {})
+        h = hashlib.sha1(markdown.encode('utf-8'))
+        h.update('\0{0}'.format(toc_offset).encode('utf-8'))
+        for title in sorted(links.titles):
+            wiki_page = links.pages.get(title)
+            if wiki_page is None:
+                h.update('\0p{0}\0'.format(title).encode('utf-8'))
+            else:
+                h.update('\0p{0}\0{1}\0{2}'.format(
+                    title,
+                    wiki_page.id,
+                    generations.get(('p', str(wiki_page.id)), 0)
+                ).encode('utf-8'))
+        for wiki_file_id in sorted(links.wiki_file_ids):
+            wiki_file = links.files.get(wiki_file_id)
+            h.update('\0f{0}\0{1}\0{2}'.format(
+                wiki_file_id,
+                wiki_file.name if wiki_file else '',
+                generations.get(('f', str(wiki_file_id)), 0)
+            ).encode('utf-8'))
+        for username in sorted(links.usernames):
+            h.update('\0u{0}\0{1}'.format(
+                username,
+                username in links.users
+            ).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, wiki_group, key):
+        return self._caches.get(wiki_group, key)
+
+    def set(self, wiki_group, key, rendered):
+        self._caches.set(wiki_group, key, rendered)
+
+    def invalidate_page(self, wiki_group, wiki_page_id):
+        """Drop the renders linking to the page `wiki_page_id`."""
+        self._invalidate(wiki_group, ('p', str(wiki_page_id)))
+
+    def invalidate_file(self, wiki_group, wiki_file_id):
+        """Drop the renders linking to the file `wiki_file_id`."""
+        self._invalidate(wiki_group, ('f', str(wiki_file_id)))
+
+    def _invalidate(self, wiki_group, target):
+        with self._lock:
+            generations = self._generations.setdefault(wiki_group, dict())
+            generations[target] = generations.get(target, 0) + 1
+
+    def stats(self):
+        """Hits, misses and size of the cache of each wiki group."""
+        return self._caches.all_stats()
+
+
+class RenderContext:
+    """Everything a single render produces besides the html.
+
+    Returned by `WikiMarkdown` instead of being stored on `flask.g`, so that
+    renders in different threads do not share any state. The references of
+    the page are appended to `wiki_page.refs`.
+    """
+
+    def __init__(self, wiki_group, wiki_page, pure=False):
+        self.wiki_group = wiki_group
+        self.wiki_page = wiki_page
+        self.pure = pure
+        self.toc = ''
+        self.html = ''
+        # users mentioned in the text
+        self.users_to_email = list()
+        # referenced pages which did not exist yet
+        self.new_pages = list()
+        # list of `WikiBlock`, or None if the text cannot be split
+        self.blocks = None
+        # the markdown to store, with links to the new pages by id
+        self.md = ''
 
 
 class WikiRenderer(TocMixin, Renderer):
 
+    def reset_links(self, links, wiki_group):
+        self.links = links
+        self.wiki_group = wiki_group
+        self.titles = list()
+        self.usernames = list()
+
     def wiki_page(self, title):
-        wiki_page_title = title
-        wiki_page = (WikiPage
-                     .objects(title=wiki_page_title)
-                     .only('title')
-                     .first())
-        if not wiki_page:
-            wiki_page = WikiPage(
-                title=wiki_page_title,
-                modified_by=current_user.name
-            ).save()
-        g.wiki_page.refs.append(wiki_page)
-
-        return render_wiki_page(wiki_page.id, wiki_page_title)
+        wiki_page = self.links.get_page(title)
+        self.titles.append(title)
+
+        return render_wiki_page(self.wiki_group, wiki_page.id, wiki_page.title)
+
+    def codespan(self, text):
+        return super().codespan(self.links.show_titles(text))
+
+    def block_code(self, code, lang=None):
+        return super().block_code(self.links.show_titles(code), lang)
 
     def wiki_file(self, wiki_file_id, wiki_file_type, w, h):
         w = w or 0
         h = h or 0
         w, h = int(w), int(h)
 
-        wiki_file = WikiFile.objects(id=wiki_file_id).first()
+        wiki_file = self.links.get_file(wiki_file_id)
         if wiki_file:
             return render_wiki_file(
+                self.wiki_group,
                 wiki_file.id,
                 wiki_file.name,
                 wiki_file_type,
@@ -40,23 +272,28 @@ class WikiRenderer(TocMixin, Renderer):
             )
 
     def wiki_at(self, username):
-        u = WikiUser.objects(name=username).first()
+        u = self.links.get_user(username)
         if u is not None:
-            g.users_to_email.append(u)
+            self.usernames.append(username)
             return '<strong class="wiki-user-notification">[@{0}]</strong>'.format(username)
 
 
 class WikiInlineLexer(InlineLexer):
 
+    def __init__(self, renderer, rules=None, **kwargs):
+        super().__init__(renderer, rules, **kwargs)
+        # rules are enabled per instance, leave the class list alone
+        self.default_rules = list(self.default_rules)
+
     def enable_wiki_page(self):
-        self.rules.wiki_page = re.compile(r'\[\[(.+?)\]\]')
+        self.rules.wiki_page = _wiki_page_pat
         self.default_rules.insert(0, 'wiki_page')
 
     def output_wiki_page(self, m):
         return self.renderer.wiki_page(m.group(1))
 
     def enable_wiki_file(self):
-        self.rules.wiki_file = re.compile(r'\[(file|image):(\d+)(@(\d+)x(\d+))?\]')
+        self.rules.wiki_file = _wiki_file_pat
         self.default_rules.insert(1, 'wiki_file')
 
     def output_wiki_file(self, m):
@@ -64,56 +301,428 @@ class WikiInlineLexer(InlineLexer):
         return self.renderer.wiki_file(wiki_file_id, wiki_file_type, w, h)
 
     def enable_wiki_at(self):
-        self.rules.wiki_at = re.compile(r'\[@(.+?)\]')
+        self.rules.wiki_at = _wiki_at_pat
         self.default_rules.insert(2, 'wiki_at')
 
     def output_wiki_at(self, m):
-        username = m.group(2)
+        username = m.group(1)
         return self.renderer.wiki_at(username)
 
 
+class WikiBlockLexer(BlockLexer):
+    """Block lexer which records where each top-level token ends."""
+
+    def __call__(self, text, rules=None):
+        if rules:
+            return self.parse(text, rules)
+
+        # Same as BlockLexer.parse, but keeps `(tokens, lines, at_line_start)`
+        # after each top-level match. Nested block quotes and lists still go
+        # through BlockLexer.parse.
+        text = text.rstrip('\n')
+        self.boundaries = []
+        lines = 0
+        while text:
+            for key in self.default_rules:
+                m = getattr(self.rules, key).match(text)
+                if m:
+                    getattr(self, 'parse_%s' % key)(m)
+                    break
+            else:  # pragma: no cover
+                raise RuntimeError('Infinite loop at: %s' % text)
+            matched = m.group(0)
+            text = text[len(matched):]
+            lines += matched.count('\n')
+            self.boundaries.append(
+                (len(self.tokens), lines, not text or matched.endswith('\n')))
+        return self.tokens
+
+
+class WikiMarkdownParser(Markdown):
+    """Markdown parser which splits its output into independent blocks."""
+
+    def output(self, text, rules=None):
+        self.tokens = self.block(text, rules)
+        total = len(self.tokens)
+        self.tokens.reverse()
+
+        self.inline.setup(self.block.def_links, self.block.def_footnotes)
+
+        # a token may end several matches, e.g. a single newline
+        line_ends = dict()
+        for tokens, lines, at_line_start in self.block.boundaries:
+            line_ends[tokens] = lines if at_line_start else None
+
+        renderer = self.renderer
+        self.boundaries = []
+        out = renderer.placeholder()
+        while self.pop():
+            out += self.tok()
+            lines = line_ends.get(total - len(self.tokens))
+            if lines is not None:
+                self.boundaries.append(
+                    (lines, len(out), renderer.toc_count, len(renderer.titles)))
+        return out
+
+
 class WikiMarkdown:
+    """Wiki markdown renderer which can be shared between threads.
+
+    Mistune parsers keep the state of the text being rendered, so every
+    render borrows a parser from a pool, and its results are returned in a
+    `RenderContext`.
+    """
+
     def __init__(self):
+        self.cache = RenderCache()
+        self._parsers = list()
+        self._lock = Lock()
+
+    def new_parser(self):
         renderer = WikiRenderer()
         inline = WikiInlineLexer(renderer)
         # enable the feature
         inline.enable_wiki_page()
         inline.enable_wiki_file()
-        self.markdown = Markdown(renderer, inline=inline)
+        block = WikiBlockLexer(BlockGrammar())
+        return WikiMarkdownParser(renderer, inline=inline, block=block)
+
+    @contextmanager
+    def parser(self):
+        with self._lock:
+            parser = self._parsers.pop() if self._parsers else None
+        if parser is None:
+            parser = self.new_parser()
+        yield parser
+        # not reached if rendering failed, so a broken parser is dropped
+        with self._lock:
+            self._parsers.append(parser)
+
+    def __call__(self, wiki_page, markdown, pure=False, wiki_group=None):
+        """Render markdown and return its `RenderContext`.
+
+        Referenced pages that do not exist yet are created, unless `pure` is
+        set, in which case nothing is written to the database and the pages
+        that would have been created are only reported in the context.
+        `wiki_group` defaults to the group of the current request.
+        """
+        ctx = RenderContext(wiki_group or g.wiki_group, wiki_page, pure)
+
+        # Resolve all links up front, then render from the lookup table.
+        links = self.links(markdown)
+        rendered = self.render_cached(ctx, markdown, links)
+        self.collect(ctx, links, rendered)
+
+        ctx.blocks = self.make_blocks(links, rendered)
+        ctx.toc = self.render_toc(rendered.toc)
+        ctx.html = rendered.html
+        ctx.md = normalize_links(markdown, ctx.new_pages)
+        return ctx
+
+    def update(self, wiki_page, markdown, diff, wiki_group=None):
+        """Render the new markdown of `wiki_page`, given the `diff` from its
+        current markdown, by re-rendering only the blocks the diff touches.
+
+        `wiki_page` needs `md`, `html` and `blocks` loaded. Falls back to a
+        full render whenever the block structure around the edit may change.
+        """
+        old_lines = wiki_page.md.splitlines(True)
+        new_lines = markdown.splitlines(True)
+        dirty = find_dirty_blocks(wiki_page.blocks, old_lines, new_lines, diff)
+        if dirty is None:
+            return self(wiki_page, markdown, wiki_group=wiki_group)
+
+        blocks = wiki_page.blocks
+        i, j = dirty
+        start = sum(b.lines for b in blocks[:i])
+        end = sum(b.lines for b in blocks[:j]) + len(new_lines) - len(old_lines)
+        html_start = sum(b.html_len for b in blocks[:i])
+        html_end = sum(b.html_len for b in blocks[:j])
+        toc_offset = sum(len(b.toc) for b in blocks[:i])
+        if html_end + sum(b.html_len for b in blocks[j:]) != len(wiki_page.html):
+            return self(wiki_page, markdown, wiki_group=wiki_group)
+
+        ctx = RenderContext(wiki_group or g.wiki_group, wiki_page)
+
+        text = ''.join(new_lines[start:end])
+        if j < len(blocks):
+            # Mistune strips trailing newlines, so some blocks would not be
+            # recognised at the end of the text; keep a line after them.
+            text += _sentinel
+        links = self.links(text)
+        rendered = self.render_cached(ctx, text, links, toc_offset=toc_offset)
+        if j < len(blocks):
+            rendered = strip_sentinel(rendered)
+        if (rendered is None or rendered.blocks is None or
+                len(rendered.toc) != sum(len(b.toc) for b in blocks[i:j])):
+            # block structure or heading ids after the edit would change
+            return self(wiki_page, markdown, wiki_group=wiki_group)
+
+        for block in blocks[:i]:
+            wiki_page.refs.extend(WikiPage(id=_id) for _id in block.refs)
+        self.collect(ctx, links, rendered)
+        for block in blocks[j:]:
+            wiki_page.refs.extend(WikiPage(id=_id) for _id in block.refs)
+
+        ctx.blocks = blocks[:i] + self.make_blocks(links, rendered) + blocks[j:]
+        ctx.toc = self.render_toc(
+            [tuple(entry) for block in ctx.blocks for entry in block.toc])
+        ctx.html = wiki_page.html[:html_start] + rendered.html + wiki_page.html[html_end:]
+        ctx.md = normalize_links(markdown, ctx.new_pages)
+        return ctx
+
+    def links(self, markdown):
+        with self.parser() as parser:
+            resolve_users = 'wiki_at' in parser.inline.default_rules
+        return WikiLinks(markdown, resolve_users=resolve_users)
+
+    def render_cached(self, ctx, markdown, links, toc_offset=0):
+        if ctx.pure:
+            # previews change with every keystroke, they would only evict
+            # the renders of saved pages
+            return self.render(ctx.wiki_group, markdown, links, toc_offset)
+        key = self.cache.key(ctx.wiki_group, markdown, links, toc_offset)
+        rendered = self.cache.get(ctx.wiki_group, key)
+        if rendered is None:
+            rendered = self.render(ctx.wiki_group, markdown, links, toc_offset)
+            self.cache.set(ctx.wiki_group, key, rendered)
+        else:
+            # reuse the ids the cached html links to
+            for title, wiki_page_id in rendered.new_pages:
+                links.add_new_page(title, wiki_page_id)
+        return rendered
+
+    def collect(self, ctx, links, rendered):
+        for title in rendered.titles:
+            ctx.wiki_page.refs.append(links.get_page(title))
+        for username in rendered.usernames:
+            ctx.users_to_email.append(links.get_user(username))
+
+        ctx.new_pages = links.new_pages
+        if not ctx.pure:
+            links.save_new_pages()
+
+    def render(self, wiki_group, markdown, links, toc_offset=0):
+        with self.parser() as parser:
+            renderer = parser.renderer
+            renderer.reset_links(links, wiki_group)
+            renderer.reset_toc()
+            renderer.toc_count = toc_offset
+            html = parser.parse(markdown)
+            boundaries = parser.boundaries
+            toc = tuple((level, text) for _, text, level, _ in renderer.toc_tree)
+            titles = tuple(renderer.titles)
+            usernames = tuple(renderer.usernames)
+
+        blocks = None
+        if not _no_blocks_pat.search(markdown):
+            blocks = list()
+            total_lines = len(markdown.splitlines())
+            last = (0, 0, toc_offset, 0)
+            for boundary in boundaries:
+                blocks.append(tuple(b - a for a, b in zip(last, boundary)))
+                last = boundary
+            # trailing newlines are not part of any token
+            if blocks:
+                lines, html_len, headings, title_count = blocks[-1]
+                blocks[-1] = (total_lines - last[0] + lines, html_len, headings, title_count)
+            elif total_lines:
+                blocks.append((total_lines, len(html), 0, 0))
+            blocks = tuple(blocks)
+
+        return RenderedMarkdown(
+            html=html,
+            toc=toc,
+            titles=titles,
+            usernames=usernames,
+            new_pages=tuple((p.title, p.id) for p in links.new_pages),
+            blocks=blocks
+        )
+
+    def make_blocks(self, links, rendered):
+        if rendered.blocks is None:
+            return None
+        blocks = list()
+        toc, titles = 0, 0
+        for lines, html_len, headings, title_count in rendered.blocks:
+            blocks.append(WikiBlock(
+                lines=lines,
+                html_len=html_len,
+                toc=[list(entry) for entry in rendered.toc[toc:toc+headings]],
+                refs=[links.get_page(title).id
+                      for title in rendered.titles[titles:titles+title_count]]
+            ))
+            toc += headings
+            titles += title_count
+        return blocks
+
+    def render_toc(self, toc):
+        with self.parser() as parser:
+            renderer = parser.renderer
+            renderer.toc_tree = [
+                (index, text, level, None) for index, (level, text) in enumerate(toc)]
+            # workaround for when there is no headings
+            try:
+                return renderer.render_toc(level=3)
+            except TypeError:
+                return ''
+
+
+_sentinel = '\0\n'
+_sentinel_html = '<p>\0</p>\n'
+
+
+def strip_sentinel(rendered):
+    """Remove the block rendered from `_sentinel`, or return None if it did
+    not render as a block of its own."""
+    if (not rendered.blocks or
+            rendered.blocks[-1] != (1, len(_sentinel_html), 0, 0) or
+            not rendered.html.endswith(_sentinel_html)):
+        return None
+    return rendered._replace(
+        html=rendered.html[:-len(_sentinel_html)],
+        blocks=rendered.blocks[:-1]
+    )
+
+
+def find_dirty_blocks(blocks, old_lines, new_lines, diff):
+    """Find the range `(i, j)` of blocks to re-render after applying `diff`.
+
+    Returns None if the page has to be rendered in full.
+    """
+    if not blocks or sum(b.lines for b in blocks) != len(old_lines):
+        return None
+    if _no_blocks_pat.search(''.join(new_lines)):
+        return None
+
+    hunks = parse_hunks(diff)
+    lo, hi = len(old_lines), 0
+    for old_start, old_count, _, _, removed, added in hunks:
+        if any(_block_structure_pat.search(line) for line in removed + added):
+            return None
+        if old_count:
+            lo = min(lo, old_start - 1)
+            hi = max(hi, old_start - 1 + old_count)
+        else:
+            # insertion after line `old_start`, touching both neighbours
+            lo = min(lo, max(old_start - 1, 0))
+            hi = max(hi, old_start + 1)
+    if not hunks:
+        return None
+
+    starts = [0]
+    for block in blocks:
+        starts.append(starts[-1] + block.lines)
+    i = max(k for k in range(len(blocks)) if starts[k] <= lo)
+    j = min(k for k in range(1, len(blocks) + 1) if starts[k] >= min(hi, starts[-1]))
+    delta = len(new_lines) - len(old_lines)
+
+    def separated(n, end=False):
+        # whether new line `n` starts a block which cannot be merged into
+        # the one before it
+        if n == 0:
+            return True
+        if n >= len(new_lines):
+            # the end of the page only bounds the region from below
+            return end
+        line = new_lines[n]
+        return (not new_lines[n - 1].strip(' \t\n') and
+                bool(line.strip(' \t\n')) and
+                not _continuation_pat.match(line))
+
+    while True:
+        if not separated(starts[i]):
+            i -= 1
+        elif not separated(starts[j] + delta, end=True):
+            j += 1
+        else:
+            break
+    if i == 0 and j == len(blocks):
+        return None
+    # fences and html may pair up with lines outside of the region
+    region = new_lines[starts[i]:starts[j] + delta]
+    if any(_block_structure_pat.search(line) for line in region):
+        return None
+    return i, j
+
+
+def normalize_links(markdown, wiki_pages=None):
+    """Replace the titles in the page links of `markdown` with page ids.
+
+    Only the titles of `wiki_pages` are replaced if given, otherwise those
+    of all the pages which exist.
+    """
+    if wiki_pages is None:
+        titles = [title for title in set(_wiki_page_pat.findall(markdown))
+                  if not _wiki_page_id_pat.match(title)]
+        wiki_pages = WikiPage.objects(title__in=titles).only('title') if titles else []
+    ids = {wiki_page.title: wiki_page.id for wiki_page in wiki_pages}
+    if not ids:
+        return markdown
+    return replace_links(markdown, ids)
+
+
+def replace_links(markdown, ids):
+    """Replace the titles in the page links of `markdown` using a mapping
+    from title to page id."""
+    def replace(m):
+        _id = ids.get(m.group(1))
+        return m.group(0) if _id is None else '[[#{}]]'.format(_id)
+    return _wiki_page_pat.sub(replace, markdown)
+
+
+def denormalize_links(markdown):
+    """Replace the page ids in the page links of `markdown` with the current
+    titles, for editing and comparing."""
+    ids = [m.group(1) for m in map(_wiki_page_id_pat.match,
+                                   set(_wiki_page_pat.findall(markdown))) if m]
+    if not ids:
+        return markdown
+    titles = {'#{}'.format(wiki_page.id): wiki_page.title
+              for wiki_page in WikiPage.objects(id__in=ids).only('title')}
+
+    def replace(m):
+        title = titles.get(m.group(1))
+        return m.group(0) if title is None else '[[{}]]'.format(title)
+    return _wiki_page_pat.sub(replace, markdown)
+
 
-    def __call__(self, wiki_page, markdown):
-        g.wiki_page = wiki_page
-        g.users_to_email = list()
-        self.markdown.renderer.reset_toc()
-        html = self.markdown.parse(markdown)
+def resolve_titles(*htmls):
+    """Show the current titles of the pages linked to in rendered html,
+    which keeps the titles the pages had when it was rendered."""
+    ids = set(_id for html in htmls for _, _id, _, _ in _wiki_page_html_pat.findall(html or ''))
+    if not ids:
+        return list(htmls)
+    titles = {str(wiki_page.id): wiki_page.title
+              for wiki_page in WikiPage.objects(id__in=list(ids)).only('title')}
 
-        # workaround for when there is no headings
-        try:
-            toc = self.markdown.renderer.render_toc(level=3)
-        except TypeError:
-            toc = ''
-        return toc, html
+    def replace(m):
+        title = titles.get(m.group(2))
+        return m.group(0) if title is None else m.group(1) + title + m.group(4)
+    return [html and _wiki_page_html_pat.sub(replace, html) for html in htmls]
 
 
 def render_wiki_page(
+    wiki_group,
     wiki_page_id,
     wiki_page_title
 ):
     return '<a class="wiki-page" href="/{0}/page/{1}">{2}</a>'.format(
-        g.wiki_group,
+        wiki_group,
         wiki_page_id,
         wiki_page_title
     )
 
 
 def render_wiki_file(
+    wiki_group,
     wiki_file_id,
     wiki_file_name,
     wiki_file_type,
     w=0,
     h=0
 ):
-    link = '/{0}/file/{1}'.format(g.wiki_group, wiki_file_id)
+    link = '/{0}/file/{1}'.format(wiki_group, wiki_file_id)
 
     if wiki_file_type == 'image':
         temp = ['src={0}'.format(link)]
@@ -1,12 +1,102 @@
 # -*- coding: utf-8 -*-
-from flask import g
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import g, current_app, has_app_context
 from datetime import datetime
-from mongoengine.connection import DEFAULT_CONNECTION_NAME
-from mongoengine.context_managers import switch_db
+from bson.binary import Binary
+from mongoengine.connection import DEFAULT_CONNECTION_NAME, get_db
 from flask_login import current_user, UserMixin
 
 from pw.extensions import db, bcrypt, login_manager
-from pw.utils import convert_user_ids_to_dict
+from pw.utils import (convert_user_ids_to_dict, compress_text, decompress_text,
+                      pack_text, unpack_text)
+from pw.diff import apply_hunks, parse_patch, parse_hunks
+from pw.cache import ExpiringGroupCache
+from pw.search import search_index, title_index, tokenize
+
+# Key pages and latest changes listed beside every page, by wiki group
+sidebar_cache = ExpiringGroupCache('SIDEBAR_CACHE_TTL', 10)
+
+# `[file:<id>]` and `[image:<id>]` in markdown, see `pw.markdown`
+_wiki_file_pat = re.compile(r'\[(?:file|image):(\d+)')
+
+# Database of the wiki group the current request or command works on
+db_alias = ContextVar('db_alias', default=DEFAULT_CONNECTION_NAME)
+# (db alias, document class) -> collection
+_collections = dict()
+# Read preference of the group documents in the current context, None to
+# read from the primary
+read_preference = ContextVar('read_preference', default=None)
+
+
+def use_db_alias(alias):
+    """Point the group documents at database `alias` in the current
+    context. Returns a token for `db_alias.reset`."""
+    return db_alias.set(alias)
+
+
+@contextmanager
+def using_db_alias(alias):
+    """Point the group documents at database `alias` within a block."""
+    token = db_alias.set(alias)
+    try:
+        yield
+    finally:
+        db_alias.reset(token)
+
+
+def forget_db_alias(alias):
+    """Drop the collections cached for `alias`, when its connection is
+    closed or its database dropped."""
+    for key in [key for key in _collections if key[0] == alias]:
+        _collections.pop(key, None)
+
+
+@contextmanager
+def using_read_preference(preference):
+    """Read the group documents with the pymongo `preference` within a
+    block. Writes always go to the primary."""
+    token = read_preference.set(preference)
+    try:
+        yield
+    finally:
+        read_preference.reset(token)
+
+
+class GroupDocument(db.Document):
+    """A document stored in the database of each wiki group.
+
+    The database is the one of the current context, see `use_db_alias` and
+    `using_db_alias`, so threads serving different groups do not interfere.
+    `switch_db` still takes precedence. Reads follow `using_read_preference`,
+    single querysets can still set their own with `.read_preference()`.
+    """
+
+    meta = {'abstract': True, 'db_alias': None}
+
+    @classmethod
+    def _get_db(cls):
+        return get_db(cls._meta.get('db_alias') or db_alias.get())
+
+    @classmethod
+    def _get_collection(cls):
+        if cls._meta.get('db_alias'):
+            # inside `switch_db`
+            collection = super()._get_collection()
+        else:
+            key = (db_alias.get(), cls)
+            collection = _collections.get(key)
+            if collection is None:
+                collection = cls._get_db()[cls._get_collection_name()]
+                _collections[key] = collection
+                if cls._meta.get('auto_create_index', True):
+                    cls.ensure_indexes()
+
+        preference = read_preference.get()
+        if preference is not None:
+            collection = collection.with_options(read_preference=preference)
+        return collection
 
 
 @login_manager.user_loader
@@ -14,8 +104,8 @@ def load_user(user_id):
     user_id_dict = convert_user_ids_to_dict(user_id)
     current_user_id = user_id_dict.get(DEFAULT_CONNECTION_NAME)
     if current_user_id is not None:
-        with switch_db(WikiUser, DEFAULT_CONNECTION_NAME) as WU:
-            return WU.objects(id=current_user_id).first()
+        with using_db_alias(DEFAULT_CONNECTION_NAME):
+            return WikiUser.objects(id=current_user_id).first()
 
     current_user_id = user_id_dict.get(g.wiki_group)
     if current_user_id is not None:
@@ -27,11 +117,16 @@ class WikiGroup(db.Document):
     name = db.StringField(unique=True)
     db_name = db.StringField(unique=True)
     active = db.BooleanField(required=True)
+    # Host name or mongodb:// URI of the MongoDB server or cluster holding
+    # the group database, empty for the host of MONGODB_SETTINGS
+    host = db.StringField()
+    # Set while the group is moved to another host, writes are refused
+    frozen = db.BooleanField(default=False)
 
     meta = {'collection': 'wiki_group'}
 
 
-class WikiUser(db.Document, UserMixin):
+class WikiUser(GroupDocument, UserMixin):
     name = db.StringField(unique=True, required=True)
     email = db.StringField(required=True)
     password_hash = db.BinaryField()
@@ -49,7 +144,7 @@ class WikiUser(db.Document, UserMixin):
         return bcrypt.check_password_hash(self.password_hash, password)
 
 
-class WikiLoginRecord(db.Document):
+class WikiLoginRecord(GroupDocument):
     username = db.StringField()
     timestamp = db.DateTimeField(default=datetime.now)
     browser = db.StringField()
@@ -59,24 +154,91 @@ class WikiLoginRecord(db.Document):
 
     meta = {
         'collection': 'wiki_login_record',
-        'ordering': ['-timestamp']
+        'ordering': ['-timestamp'],
+        'indexes': [('-timestamp', '-id')]
     }
 
 
-class WikiPageVersion(db.Document):
-    diff = db.StringField()
+class CompressedStringField(db.StringField):
+    """A string field stored compressed with the HISTORY_DIFF_CODEC codec,
+    when that makes it shorter. Values are always read back as strings, so
+    compressed and plain values can be mixed in one collection."""
+
+    def to_python(self, value):
+        if isinstance(value, bytes):
+            return unpack_text(value)
+        return super().to_python(value)
+
+    def to_mongo(self, value):
+        codec = diff_codec()
+        if codec and value:
+            data = pack_text(value, codec)
+            if len(data) < len(value.encode('utf-8')):
+                return Binary(data)
+        return value
+
+
+def diff_codec():
+    """The codec new diffs are stored with."""
+    return current_app.config.get('HISTORY_DIFF_CODEC') if has_app_context() else None
+
+
+class WikiPageVersion(GroupDocument):
+    page = db.ReferenceField('WikiPage')
+    # from this version to the next one
+    diff = CompressedStringField()
     version = db.IntField(required=True)
     modified_on = db.DateTimeField()
     modified_by = db.StringField()
+    # who made the next version out of this one, and when
+    changed_on = db.DateTimeField()
+    changed_by = db.StringField()
+    # words of the lines `diff` adds and removes, for history search
+    added = db.ListField(db.StringField())
+    removed = db.ListField(db.StringField())
+    # full markdown of this version, kept every HISTORY_SNAPSHOT_INTERVAL
+    # versions so that old versions do not have to be rebuilt from the
+    # current one
+    snapshot = db.BinaryField()
+    snapshot_codec = db.StringField()
 
     meta = {
         'collection': 'wiki_page_version',
-        'indexes': [{
-            'fields': ['$diff'],
-            'default_language': 'english'
-        }]
+        'indexes': [
+            ('page', 'version'),
+            # words first, then the date range, see pw.history
+            ('added', '-changed_on'),
+            ('removed', '-changed_on'),
+            ('changed_by', '-changed_on'),
+            '-changed_on'
+        ]
     }
 
+    def set_changes(self, diff):
+        """Store the words of the lines added and removed by `diff`."""
+        added, removed = set(), set()
+        for _, _, _, _, removed_lines, added_lines in parse_hunks(diff):
+            for line in added_lines:
+                added.update(tokenize(line))
+            for line in removed_lines:
+                removed.update(tokenize(line))
+        self.added = sorted(added)
+        self.removed = sorted(removed)
+
+    def get_snapshot(self):
+        if self.snapshot is None:
+            return None
+        return decompress_text(self.snapshot, self.snapshot_codec)
+
+    def set_snapshot(self, md, codec=None):
+        self.snapshot = compress_text(md, codec)
+        self.snapshot_codec = codec
+
+
+def snapshot_codec():
+    """The codec new snapshots are stored with."""
+    return 'zlib' if current_app.config.get('HISTORY_SNAPSHOT_COMPRESS') else None
+
 
 class WikiComment(db.EmbeddedDocument):
     # id = <epoch time>-<author id>
@@ -85,57 +247,220 @@ class WikiComment(db.EmbeddedDocument):
     author = db.StringField()
     md = db.StringField()
     html = db.StringField()
+    # words of `md`, for history search
+    words = db.ListField(db.StringField())
+
+    def set_words(self):
+        self.words = sorted(set(tokenize(self.md)))
 
 
-class WikiPage(db.Document):
+class WikiBlock(db.EmbeddedDocument):
+    # A run of top-level markdown blocks which renders independently,
+    # used to re-render only the part of a page touched by an edit.
+    lines = db.IntField()
+    html_len = db.IntField()
+    # [level, text] of each heading in the block
+    toc = db.ListField(db.ListField())
+    refs = db.ListField(db.ObjectIdField())
+
+
+class WikiPage(GroupDocument):
     title = db.StringField(required=True, unique=True)
     md = db.StringField(default='')
     html = db.StringField()
     toc = db.StringField()
     modified_on = db.DateTimeField(default=datetime.now)
     modified_by = db.StringField(default='system')
+    # last change of the page of any kind, an edit, a comment or a rename,
+    # which the search indexes of other processes pick pages up by
+    touched_on = db.DateTimeField(default=datetime.now)
     comments = db.ListField(db.EmbeddedDocumentField(WikiComment))
     current_version = db.IntField(default=1)
-    versions = db.ListField(db.ReferenceField(WikiPageVersion))
+    # versions before this one were dropped by `flask compact-history`
+    first_version = db.IntField(default=1)
     refs = db.ListField(db.ReferenceField('self'))
     keypage = db.IntField()
+    blocks = db.ListField(db.EmbeddedDocumentField(WikiBlock))
 
     meta = {
         'collection': 'wiki_page',
+        # pages not migrated by `flask migrate-versions` yet still hold the
+        # ids of their versions
+        'strict': False,
         'indexes': [
             '#title', {
                 'fields': ['$title', '$md', '$comments.md'],
                 'default_language': 'english',
                 'weights': {'title': 10, 'md': 2, 'comments.md': 1}
-            }
+            },
+            {'fields': ['keypage'], 'sparse': True},
+            ('-modified_on', '-id'),
+            ('modified_by', '-modified_on', '-id'),
+            {'fields': ['touched_on'], 'sparse': True},
+            # comments by date and by author, for history search
+            {'fields': ['comments.timestamp'], 'sparse': True},
+            {'fields': ['comments.author', 'comments.timestamp'], 'sparse': True},
+            {'fields': ['comments.words'], 'sparse': True}
         ]
     }
 
-    def update_db(self, diff, md, html, toc=None, update_refs=True):
+    def delete(self, *args, **kwargs):
+        super().delete(*args, **kwargs)
+        sidebar_cache.pop(db_alias.get())
+        search_index.refresh(db_alias.get(), self.id)
+        title_index.remove(db_alias.get(), self.id)
+
+    def update_db(self, diff, md, html, toc=None, update_refs=True, blocks=None):
+        now = datetime.now()
         wiki_page_version = WikiPageVersion(
+            page=self,
             diff=diff,
             version=self.current_version,
             modified_on=self.modified_on,
-            modified_by=self.modified_by
-        ).save()
+            modified_by=self.modified_by,
+            changed_on=now,
+            changed_by=current_user.name
+        )
+        wiki_page_version.set_changes(diff)
+        interval = current_app.config.get('HISTORY_SNAPSHOT_INTERVAL')
+        if interval and self.current_version % interval == 0:
+            # `md` still holds the markdown of the version being replaced
+            wiki_page_version.set_snapshot(self.md, snapshot_codec())
+        wiki_page_version.save()
 
         updates = {
             'set__md': md,
             'set__html': html,
             'inc__current_version': 1,
-            'set__modified_on': datetime.now(),
+            'set__modified_on': now,
             'set__modified_by': current_user.name,
-            'push__versions': wiki_page_version
+            'set__touched_on': now
         }
         if toc is not None:
             updates['set__toc'] = toc
         if update_refs:
             updates['set__refs'] = self.refs
+        if blocks is not None:
+            updates['set__blocks'] = blocks
+        else:
+            updates['unset__blocks'] = 1
 
         self.__class__.objects(id=self.id).update_one(**updates)
+        WikiLink.set_links(
+            self.id,
+            pages=[ref.id for ref in self.refs] if update_refs else None,
+            files=linked_files(md))
+        sidebar_cache.pop(db_alias.get())
+        search_index.refresh(db_alias.get(), self.id)
+
+    @classmethod
+    def sidebar(cls):
+        """The key pages and the five latest changed pages of the current
+        wiki group, cached for SIDEBAR_CACHE_TTL seconds."""
+        def load():
+            # always from the primary, a lagging secondary would keep an
+            # edit out of the list for the whole TTL
+            with using_read_preference(None):
+                keypages = list(cls.objects(keypage__exists=True)
+                                .only('title')
+                                .order_by('+keypage'))
+                changes = list(cls.objects
+                               .only('title', 'modified_on')
+                               .order_by('-modified_on')[:5])
+            return keypages, changes
+
+        return sidebar_cache.get(db_alias.get(), load)
+
+    def get_md(self, version):
+        """Rebuild the markdown of an earlier `version` of the page.
+
+        Starts from whichever is closest of the current markdown and the
+        snapshots on either side of `version`, so at most
+        HISTORY_SNAPSHOT_INTERVAL patches are applied. Needs `md`,
+        `current_version` and `first_version` loaded.
+        """
+        if version >= self.current_version:
+            return self.md
+        if version < self.first_version:
+            raise ValueError('Version {} has been dropped.'.format(version))
+
+        # (version, markdown) to start from
+        start = (self.current_version, self.md)
+        interval = current_app.config.get('HISTORY_SNAPSHOT_INTERVAL')
+        candidates = [self.first_version] if self.first_version > 1 else []
+        if interval:
+            below = version - version % interval
+            candidates += [v for v in (below, below + interval)
+                           if 0 < v < self.current_version]
+        if candidates:
+            snapshots = (WikiPageVersion
+                         .objects(page=self, version__in=candidates,
+                                  snapshot__exists=True)
+                         .only('version', 'snapshot', 'snapshot_codec'))
+            for pv in snapshots:
+                if abs(pv.version - version) < abs(start[0] - version):
+                    start = (pv.version, pv.get_snapshot())
+
+        start_version, md = start
+        lo, hi = sorted((start_version, version))
+        revert = start_version > version
+        patches = (WikiPageVersion
+                   .objects(page=self, version__gte=lo, version__lt=hi)
+                   .only('version', 'diff')
+                   .order_by('-version' if revert else 'version'))
+
+        lines = md.splitlines(True)
+        for pv in patches:
+            lines = apply_hunks(lines, parse_patch(pv.diff), revert)
+        return ''.join(lines)
+
+
+def linked_files(md):
+    """Ids of the files linked to in markdown."""
+    return set(int(_id) for _id in _wiki_file_pat.findall(md))
+
+
+class WikiLink(GroupDocument):
+    """An edge of the link graph, from a page or a comment on it to the
+    page or file it links to."""
+    source = db.ObjectIdField(required=True)
+    # id of the comment the link is in, if any
+    comment = db.StringField()
+    page = db.ObjectIdField()
+    file = db.IntField()
+
+    meta = {
+        'collection': 'wiki_link',
+        'indexes': [('source', 'comment'), 'page', 'file']
+    }
+
+    @classmethod
+    def set_links(cls, source, pages=None, files=None, comment=None):
+        """Replace the links of a page or comment with the ids of `pages`
+        and `files`. Either is left as it is if None."""
+        edges = dict()
+        if pages is not None:
+            edges['page'] = set(pages)
+        if files is not None:
+            edges['file'] = set(files)
+        for kind, targets in edges.items():
+            existing = set(cls
+                           .objects(source=source, comment=comment,
+                                    **{kind + '__exists': True})
+                           .scalar(kind))
+            removed = existing - targets
+            if removed:
+                cls.objects(source=source, comment=comment,
+                            **{kind + '__in': list(removed)}).delete()
+            added = targets - existing
+            if added:
+                cls.objects.insert(
+                    [cls(source=source, comment=comment, **{kind: target})
+                     for target in added],
+                    load_bulk=False)
 
 
-class WikiFile(db.Document):
+class WikiFile(GroupDocument):
     id = db.SequenceField(primary_key=True)
     name = db.StringField(required=True)
     mime_type = db.StringField()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Pagination of listings.
+
+Pages are fetched by the sort key of the last or first item shown, rather
+than by skipping the items of the previous pages, so that the 100th page
+costs the same as the first. The links to the next and previous pages
+carry that key in an opaque `cursor` argument. Links to a page number
+still skip, and the totals come from counts cached per wiki group.
+"""
+import base64
+import time
+from contextvars import copy_context
+from math import ceil
+from threading import Lock, Thread
+
+from bson import json_util
+from pymongo.errors import ExecutionTimeout
+from flask import current_app, g, request, url_for
+from mongoengine.queryset.visitor import Q
+
+from pw.cache import LRUCache
+from pw.utils import get_pagination_kwargs
+
+NUMBER_PER_PAGE = 100
+
+
+class Page:
+    """The items of a page, as `data` in the listing templates."""
+
+    def __init__(self, items):
+        self.items = items
+
+
+class CountCache:
+    """Counts of querysets, by wiki group and query.
+
+    A count older than COUNT_CACHE_TTL seconds is still returned, while a
+    thread counts again, so only the first listing of a query waits for
+    its count. A count running longer than COUNT_MAX_TIME_MS is given up
+    for the estimated size of the collection, which is an upper bound.
+    """
+
+    def __init__(self, maxsize=1024):
+        self._counts = LRUCache(maxsize)
+        self._refreshing = set()
+        self._lock = Lock()
+
+    def get(self, query_set):
+        collection = query_set._collection
+        key = (g.get('wiki_group'), collection.full_name, query_set._search_text,
+               json_util.dumps(query_set._query, sort_keys=True))
+        app = current_app._get_current_object()
+        entry = self._counts.get(key)
+        if entry is None:
+            return self._count(app, key, query_set)
+
+        ttl = app.config.get('COUNT_CACHE_TTL', 60)
+        if time.time() - entry[0] > ttl:
+            with self._lock:
+                refresh = key not in self._refreshing
+                self._refreshing.add(key)
+            if refresh:
+                # the thread reads from the same group database
+                Thread(target=copy_context().run,
+                       args=(self._refresh, app, key, query_set.clone()),
+                       daemon=True).start()
+        return entry[1]
+
+    def _count(self, app, key, query_set):
+        max_time_ms = app.config.get('COUNT_MAX_TIME_MS', 2000)
+        collection = query_set._collection
+        count = None
+        if query_set._query or query_set._search_text:
+            try:
+                count = query_set.max_time_ms(max_time_ms).count()
+            except ExecutionTimeout:
+                app.logger.warning('Count of %s timed out, using its estimated size',
+                                   collection.full_name)
+        if count is None:
+            # from the collection metadata, without scanning
+            count = collection.estimated_document_count(maxTimeMS=max_time_ms)
+        self._counts.set(key, (time.time(), count))
+        return count
+
+    def _refresh(self, app, key, query_set):
+        try:
+            self._count(app, key, query_set)
+        except Exception:
+            app.logger.exception('Refresh of the count of %s failed',
+                                 query_set._collection.full_name)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+counts = CountCache()
+
+
+def paginate(query_set, key='id', descending=False):
+    """Template arguments of the requested page of `query_set`.
+
+    Pages are fetched by cursor, ordered by the field `key` and then the
+    id. With `key` None, as for text search results ordered by score, the
+    order of `query_set` is kept and pages are fetched by skipping.
+    """
+    current_page_number = request.args.get('page', default=1, type=int)
+    cursor = _decode_cursor(request.args.get('cursor')) if key else None
+    total = counts.get(query_set.clone().order_by())
+    if key:
+        query_set = query_set.order_by(*_order(key, descending))
+
+    if cursor is None:
+        # by page number, the cursors take over from there
+        items = list(query_set
+                     .skip((current_page_number - 1) * NUMBER_PER_PAGE)
+                     .limit(NUMBER_PER_PAGE + 1))
+        has_next = len(items) > NUMBER_PER_PAGE
+        items = items[:NUMBER_PER_PAGE]
+    else:
+        current_page_number, value, last_id, forward = cursor
+        query_set = query_set.filter(_beyond(key, value, last_id, forward != descending))
+        if not forward:
+            query_set = query_set.order_by(*_order(key, not descending))
+        items = list(query_set.limit(NUMBER_PER_PAGE + 1))
+        more = len(items) > NUMBER_PER_PAGE
+        items = items[:NUMBER_PER_PAGE]
+        has_next = more if forward else True
+        if not forward:
+            items.reverse()
+            if not more:
+                current_page_number = 1
+
+    # the count may be out of date, the page just fetched is not
+    if has_next:
+        total_page_number = max(ceil(total / NUMBER_PER_PAGE), current_page_number + 1)
+    else:
+        total_page_number = current_page_number
+
+    kwargs = dict(data=Page(items), number_per_page=NUMBER_PER_PAGE)
+    get_pagination_kwargs(kwargs, current_page_number, total_page_number)
+    if key and items:
+        kwargs['prev_url'] = _cursor_url(current_page_number - 1, key, items[0], False)
+        kwargs['next_url'] = _cursor_url(current_page_number + 1, key, items[-1], True)
+    return kwargs
+
+
+def _order(field, descending):
+    sign = '-' if descending else '+'
+    if field == 'id':
+        return (sign + 'id',)
+    return sign + field, sign + 'id'
+
+
+def _beyond(field, value, last_id, after):
+    """Items sorting after, or before, the item with `value` and `last_id`."""
+    op = 'gt' if after else 'lt'
+    if field == 'id':
+        return Q(**{'id__' + op: last_id})
+    return (Q(**{'{}__{}'.format(field, op): value})
+            | Q(**{field: value, 'id__' + op: last_id}))
+
+
+def _cursor_url(page_number, field, item, forward):
+    value = None if field == 'id' else getattr(item, field)
+    token = json_util.dumps([page_number, value, item.id, forward])
+    args = request.args.to_dict()
+    args.pop('page', None)
+    args['cursor'] = base64.urlsafe_b64encode(token.encode()).decode()
+    return url_for(request.endpoint, **dict(request.view_args, **args))
+
+
+def _decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        page_number, value, last_id, forward = json_util.loads(
+            base64.urlsafe_b64decode(cursor.encode()).decode())
+        return max(int(page_number), 1), value, last_id, bool(forward)
+    except (ValueError, TypeError):
+        return None
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""One MongoDB client per host, shared by the databases of all wiki groups."""
+from threading import Lock
+
+from flask import current_app
+from mongoengine.connection import (DEFAULT_CONNECTION_NAME, get_connection,
+                                    register_connection)
+from mongoengine.connection import _connection_settings as db_connection_settings
+from mongoengine.connection import _connections as db_connections
+from mongoengine.connection import _dbs as db_databases
+from pymongo import MongoClient, monitoring
+
+# keys of MONGODB_SETTINGS which are not options of the client
+_not_client_options = {'db', 'host', 'port', 'alias'}
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Counts the connections of the pool of each server, by address."""
+
+    def __init__(self):
+        self._pools = dict()
+        self._lock = Lock()
+
+    def _pool(self, address):
+        pool = self._pools.get(address)
+        if pool is None:
+            pool = self._pools[address] = dict(
+                max_size=None, open=0, in_use=0, peak_in_use=0,
+                checkouts=0, failed_checkouts=0, created=0, closed=0, cleared=0)
+        return pool
+
+    def _count(self, address, **changes):
+        with self._lock:
+            pool = self._pool(address)
+            for key, change in changes.items():
+                pool[key] += change
+            pool['peak_in_use'] = max(pool['peak_in_use'], pool['in_use'])
+
+    def pool_created(self, event):
+        with self._lock:
+            self._pool(event.address)['max_size'] = event.options.get('maxPoolSize')
+
+    def pool_cleared(self, event):
+        self._count(event.address, cleared=1)
+
+    def pool_closed(self, event):
+        with self._lock:
+            self._pools.pop(event.address, None)
+
+    def connection_created(self, event):
+        self._count(event.address, open=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._count(event.address, open=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._count(event.address, failed_checkouts=1)
+
+    def connection_checked_out(self, event):
+        self._count(event.address, in_use=1, checkouts=1)
+
+    def connection_checked_in(self, event):
+        self._count(event.address, in_use=-1)
+
+    def snapshot(self):
+        """The counters of each pool, sorted by server address."""
+        with self._lock:
+            return [dict(pool, address='{0}:{1}'.format(*address))
+                    for address, pool in sorted(self._pools.items())]
+
+
+class MongoClientPool:
+    """Clients shared by the wiki group databases, one per MongoDB host.
+
+    A client holds a connection pool and monitor threads for every server,
+    so a client per group adds up to many idle sockets. Groups on the host
+    of the default connection share its client, which is created by
+    flask_mongoengine from MONGODB_SETTINGS. Groups on other hosts share a
+    client per host, created with the same options and credentials, or
+    those set for the host in MONGODB_HOSTS.
+    """
+
+    def __init__(self):
+        self.stats = PoolStats()
+        self._clients = dict()
+        self._hosts = dict()
+        self._lock = Lock()
+        self._listening = False
+
+    def init_app(self, app):
+        """Count pool events. Must run before any client is created."""
+        if not self._listening:
+            monitoring.register(self.stats)
+            self._listening = True
+
+    def client(self, host=None, port=None):
+        """The client shared by the databases on `host`, a host name or a
+        mongodb:// URI. The host of MONGODB_SETTINGS by default."""
+        settings = current_app.config['MONGODB_SETTINGS']
+        key = (host or settings['host'], port or settings.get('port'))
+        if key == (settings['host'], settings.get('port')):
+            return get_connection(DEFAULT_CONNECTION_NAME)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                options = {k: v for k, v in settings.items()
+                           if k not in _not_client_options}
+                options.update(current_app.config.get('MONGODB_HOSTS', {}).get(host, {}))
+                client = self._clients[key] = MongoClient(*key, **options)
+            return client
+
+    def connect(self, db_name, host=None, port=None):
+        """Register the database `db_name` on `host` under the alias
+        `db_name`, replacing any previous registration.
+
+        The alias is swapped in place, so that requests using it meanwhile
+        get either the old database or the new one.
+        """
+        settings = current_app.config['MONGODB_SETTINGS']
+        client = self.client(host, port)
+        with self._lock:
+            register_connection(
+                alias=db_name,
+                name=db_name,
+                host=host or settings['host'],
+                port=port or settings.get('port')
+            )
+            db_connections[db_name] = client
+            db_databases[db_name] = client[db_name]
+            self._hosts[db_name] = host or None
+
+    def disconnect(self, db_name):
+        """Forget the alias `db_name` without closing the shared client."""
+        with self._lock:
+            db_connection_settings.pop(db_name, None)
+            db_connections.pop(db_name, None)
+            db_databases.pop(db_name, None)
+            self._hosts.pop(db_name, None)
+
+    def host(self, db_name):
+        """The host `db_name` is registered on, None for the default host."""
+        return self._hosts.get(db_name)
+
+    def __contains__(self, db_name):
+        return db_name in self._hosts
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Registry of the active wiki groups."""
+import time
+from threading import Lock
+
+from flask import current_app
+
+from pw.extensions import mongo_pool
+from pw.models import WikiGroup, forget_db_alias
+
+
+class WikiGroupRegistry:
+    """The active wiki groups, kept in memory so that requests are checked
+    against them without a database round trip.
+
+    The super admin views invalidate the registry whenever they change a
+    group. Other processes see the change once their copy is older than
+    WIKI_GROUP_TTL seconds, and register connections for the groups which
+    have been added or moved to another host in the meantime.
+    """
+
+    def __init__(self):
+        self._groups = dict()
+        self._loaded_at = None
+        self._lock = Lock()
+
+    def init_app(self, app):
+        with app.app_context():
+            self.reload()
+
+    def reload(self):
+        with self._lock:
+            self._reload()
+
+    def _reload(self):
+        groups = {wiki_group.db_name: wiki_group
+                  for wiki_group in WikiGroup.objects(active=True).only(
+                      'name', 'db_name', 'host', 'frozen')}
+        for db_name, wiki_group in groups.items():
+            host = wiki_group.host or None
+            if db_name not in mongo_pool or mongo_pool.host(db_name) != host:
+                mongo_pool.connect(db_name, host)
+                forget_db_alias(db_name)
+        self._groups = groups
+        self._loaded_at = time.time()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _expired(self):
+        ttl = current_app.config.get('WIKI_GROUP_TTL', 30)
+        loaded_at = self._loaded_at
+        return loaded_at is None or time.time() - loaded_at > ttl
+
+    def _current(self):
+        if self._expired():
+            with self._lock:
+                # unless another thread reloaded while this one waited
+                if self._expired():
+                    self._reload()
+        return self._groups
+
+    def __contains__(self, db_name):
+        return db_name in self._current()
+
+    def is_frozen(self, db_name):
+        """Whether writes to `db_name` are refused while it is moved."""
+        wiki_group = self._current().get(db_name)
+        return wiki_group is not None and bool(wiki_group.frozen)
+
+    def active(self):
+        """The active `WikiGroup`s, by name."""
+        return sorted(self._current().values(), key=lambda wiki_group: wiki_group.name)
@@ -0,0 +1,647 @@
+# -*- coding: utf-8 -*-
+"""Full text search of wiki pages.
+
+Each wiki group has an inverted index, held in memory and ranked with
+BM25 over the title, body and comments of the pages. For each term of a
+field the index keeps the pages containing it, in the order they were
+indexed, along with the term frequencies and positions, as arrays of
+unsigned ints.
+
+An edited page is indexed again under a new number, and its old number
+is marked dead, so that the arrays are only ever appended to. Once the
+dead pages make up a good part of the index, its segments are merged
+into one without them. Pages changed by other processes, including
+their comments and titles, are picked up from their `touched_on`.
+
+`flask rebuild-search-index` writes the index of a group to a file,
+leaving out the dead pages. A process starting up maps that file into
+memory instead of reading every page, and only indexes the pages changed
+since the file was written.
+
+Queries are made of words, `"quoted phrases"` and `prefixes*`. A page
+must contain every phrase. Words and prefixes only add to the ranking.
+
+Titles are completed from a separate index per group: a sorted list of
+the lowercased title suffixes starting at each word, searched by bisection.
+"""
+import json
+import math
+import mmap
+import os
+import re
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from heapq import nlargest
+from threading import RLock
+
+from flask import current_app
+from mongoengine.base import get_document
+
+MAGIC = b'PWS1'
+
+# field key: weight
+FIELDS = {'t': 3.0, 'b': 1.0, 'c': 0.5}
+K1 = 1.2
+B = 0.75
+# prefixes are expanded to at most this many terms
+MAX_EXPANSIONS = 50
+# the postings of dead pages are dropped once there are this many of them,
+# and as many as this fraction of the live pages
+COMPACT_MIN_DEAD = 1000
+COMPACT_DEAD_RATIO = 0.5
+
+_token_pat = re.compile(r'[^\W_]+')
+# the ids stored in wiki links, see `pw.markdown`
+_page_id_pat = re.compile(r'#[0-9a-f]{24}')
+_query_pat = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text):
+    return _token_pat.findall(_page_id_pat.sub(' ', text or '').lower())
+
+
+class _Postings:
+    """The pages containing a term, with the term frequency in each and the
+    start of its positions in `positions`."""
+    __slots__ = ('docs', 'tfs', 'starts', 'positions')
+
+    def __init__(self, docs=None, tfs=None, starts=None, positions=None):
+        self.docs = array('I') if docs is None else docs
+        self.tfs = array('I') if tfs is None else tfs
+        self.starts = array('I') if starts is None else starts
+        self.positions = array('I') if positions is None else positions
+
+    def positions_of(self, i):
+        end = self.starts[i + 1] if i + 1 < len(self.starts) else len(self.positions)
+        return self.positions[self.starts[i]:end]
+
+
+class _MemorySegment:
+    """Postings of the pages indexed since the index was loaded."""
+
+    def __init__(self):
+        self._postings = dict()
+        self._keys = None
+
+    def get(self, key):
+        return self._postings.get(key)
+
+    def add(self, key, doc, positions):
+        postings = self._postings.get(key)
+        if postings is None:
+            postings = self._postings[key] = _Postings()
+            self._keys = None
+        postings.docs.append(doc)
+        postings.tfs.append(len(positions))
+        postings.starts.append(len(postings.positions))
+        postings.positions.extend(positions)
+
+    def keys(self):
+        if self._keys is None:
+            self._keys = sorted(self._postings)
+        return self._keys
+
+
+class _FileSegment:
+    """Postings read from a file mapped into memory, without copying."""
+
+    def __init__(self, data, terms):
+        self._data = data
+        self._terms = terms
+        self._keys = sorted(terms)
+
+    def get(self, key):
+        offsets = self._terms.get(key)
+        if offsets is None:
+            return None
+        offset, count, positions_count = offsets
+        view = self._data[offset:offset + 4 * (3 * count + positions_count)].cast('I')
+        return _Postings(view[:count], view[count:2 * count],
+                         view[2 * count:3 * count], view[3 * count:])
+
+    def keys(self):
+        return self._keys
+
+
+class SearchIndex:
+    """The search index of a wiki group."""
+
+    def __init__(self):
+        self.page_ids = list()
+        self.modified = array('d')
+        self.lengths = {field: array('I') for field in FIELDS}
+        self.live = bytearray()
+        self.doc_of = dict()
+        self.total_lengths = dict.fromkeys(FIELDS, 0)
+        self.live_count = 0
+        self.segments = [_MemorySegment()]
+        self.synced_at = 0.0
+        self.lock = RLock()
+
+    def add(self, page_id, title, md, comments, modified_on):
+        """Index the page `page_id`, replacing any earlier version."""
+        texts = {'t': title, 'b': md, 'c': '\n'.join(comments)}
+        with self.lock:
+            self.remove(page_id)
+            doc = len(self.page_ids)
+            self.page_ids.append(page_id)
+            self.modified.append(modified_on.timestamp() if modified_on else 0.0)
+            self.live.append(1)
+            self.doc_of[page_id] = doc
+            self.live_count += 1
+            segment = self.segments[-1]
+            for field, text in texts.items():
+                tokens = tokenize(text)
+                self.lengths[field].append(len(tokens))
+                self.total_lengths[field] += len(tokens)
+                positions = dict()
+                for position, token in enumerate(tokens):
+                    positions.setdefault(token, []).append(position)
+                for token, token_positions in positions.items():
+                    segment.add(field + token, doc, token_positions)
+
+    def remove(self, page_id):
+        with self.lock:
+            doc = self.doc_of.pop(page_id, None)
+            if doc is None:
+                return
+            self.live[doc] = 0
+            self.live_count -= 1
+            for field in FIELDS:
+                self.total_lengths[field] -= self.lengths[field][doc]
+
+    def search(self, query, start=None, end=None, offset=0, limit=100, with_scores=False):
+        """Page ids of the best matches of `query` from `offset` on, and
+        the number of matches, optionally of pages modified between the
+        datetimes `start` and `end`. With `with_scores`, pairs of page id
+        and score rather than page ids."""
+        words, prefixes, phrases = _parse(query)
+        with self.lock:
+            scores = dict()
+            for word in words:
+                self._score_terms(scores, lambda field: [field + word])
+            for prefix in prefixes:
+                self._score_terms(scores, lambda field: self._expand(field + prefix))
+            required = None
+            for phrase in phrases:
+                matches = self._score_phrase(phrase)
+                required = set(matches) if required is None else required & set(matches)
+                for doc, score in matches.items():
+                    scores[doc] = scores.get(doc, 0.0) + score
+            if required is not None:
+                scores = {doc: score for doc, score in scores.items() if doc in required}
+            if start or end:
+                low = start.timestamp() if start else float('-inf')
+                high = end.timestamp() if end else float('inf')
+                scores = {doc: score for doc, score in scores.items()
+                          if low <= self.modified[doc] <= high}
+            best = nlargest(offset + limit, scores.items(), key=lambda item: item[1])
+            if with_scores:
+                return [(self.page_ids[doc], score) for doc, score in best[offset:]], len(scores)
+            return [self.page_ids[doc] for doc, _ in best[offset:]], len(scores)
+
+    def _bm25(self, field):
+        """The BM25 score of a term in `field` of a page, as a function of
+        the idf of the term, its frequency and the page number."""
+        lengths = self.lengths[field]
+        average = self.total_lengths[field] / max(self.live_count, 1) or 1
+        weight = FIELDS[field] * (K1 + 1)
+        return lambda idf, tf, doc: weight * idf * tf / (
+            tf + K1 * (1 - B + B * lengths[doc] / average))
+
+    def _idf(self, count):
+        return math.log(1 + (self.live_count - count + 0.5) / (count + 0.5))
+
+    def _score_terms(self, scores, keys_of):
+        live = self.live
+        for field in FIELDS:
+            bm25 = self._bm25(field)
+            for key in keys_of(field):
+                postings = [p for p in (s.get(key) for s in self.segments) if p is not None]
+                # dead pages are counted until the index is rebuilt
+                idf = self._idf(sum(len(p.docs) for p in postings))
+                for p in postings:
+                    for doc, tf in zip(p.docs, p.tfs):
+                        if live[doc]:
+                            scores[doc] = scores.get(doc, 0.0) + bm25(idf, tf, doc)
+
+    def _score_phrase(self, phrase):
+        """Pages containing `phrase` in any field, with their score."""
+        scores = dict()
+        live = self.live
+        for field in FIELDS:
+            bm25 = self._bm25(field)
+            keys = [field + word for word in phrase]
+            for segment in self.segments:
+                postings = [segment.get(key) for key in keys]
+                if any(p is None for p in postings):
+                    continue
+                idf = sum(self._idf(len(p.docs)) for p in postings)
+                rarest = min(postings, key=lambda p: len(p.docs))
+                for doc in rarest.docs:
+                    if not live[doc]:
+                        continue
+                    tf = _phrase_count(postings, doc)
+                    if tf:
+                        scores[doc] = scores.get(doc, 0.0) + bm25(idf, tf, doc)
+        return scores
+
+    def _expand(self, prefix):
+        keys = set()
+        for segment in self.segments:
+            segment_keys = segment.keys()
+            i = bisect_left(segment_keys, prefix)
+            while (i < len(segment_keys) and segment_keys[i].startswith(prefix)
+                   and len(keys) < MAX_EXPANSIONS):
+                keys.add(segment_keys[i])
+                i += 1
+        return keys
+
+    @property
+    def dead_count(self):
+        return len(self.page_ids) - self.live_count
+
+    def needs_compaction(self):
+        dead_count = self.dead_count
+        return (dead_count >= COMPACT_MIN_DEAD
+                and dead_count >= COMPACT_DEAD_RATIO * self.live_count)
+
+    def _live_docs(self):
+        docs = [doc for doc in range(len(self.page_ids)) if self.live[doc]]
+        return docs, {doc: new_doc for new_doc, doc in enumerate(docs)}
+
+    def _merged(self, renumber):
+        """Yield each term with its postings in all the segments, merged
+        and restricted to the pages of `renumber`, under their new numbers."""
+        keys = sorted(set().union(*(segment.keys() for segment in self.segments)))
+        for key in keys:
+            merged = _Postings()
+            for segment in self.segments:
+                postings = segment.get(key)
+                if postings is None:
+                    continue
+                for i, doc in enumerate(postings.docs):
+                    if doc in renumber:
+                        merged.docs.append(renumber[doc])
+                        merged.tfs.append(postings.tfs[i])
+                        merged.starts.append(len(merged.positions))
+                        merged.positions.extend(postings.positions_of(i))
+            if merged.docs:
+                yield key, merged
+
+    def compact(self):
+        """Merge the segments into one in memory, without the dead pages."""
+        with self.lock:
+            docs, renumber = self._live_docs()
+            segment = _MemorySegment()
+            for key, merged in self._merged(renumber):
+                segment._postings[key] = merged
+            self.page_ids = [self.page_ids[doc] for doc in docs]
+            self.modified = array('d', (self.modified[doc] for doc in docs))
+            self.lengths = {field: array('I', (lengths[doc] for doc in docs))
+                            for field, lengths in self.lengths.items()}
+            self.live = bytearray(b'\1' * len(docs))
+            self.doc_of = {page_id: doc for doc, page_id in enumerate(self.page_ids)}
+            self.segments = [segment]
+
+    def save(self, path):
+        """Write the live pages to the file `path`, to be mapped by `load`."""
+        with self.lock:
+            docs, renumber = self._live_docs()
+            terms, chunks, offset = dict(), list(), 0
+            for key, merged in self._merged(renumber):
+                terms[key] = (offset, len(merged.docs), len(merged.positions))
+                for values in (merged.docs, merged.tfs, merged.starts, merged.positions):
+                    chunks.append(values.tobytes())
+                    offset += 4 * len(values)
+            header = json.dumps(dict(
+                byteorder=sys.byteorder,
+                synced_at=self.synced_at,
+                page_ids=[self.page_ids[doc] for doc in docs],
+                modified=[self.modified[doc] for doc in docs],
+                lengths={field: [lengths[doc] for doc in docs]
+                         for field, lengths in self.lengths.items()},
+                terms=terms
+            )).encode()
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            f.write(b'\0' * (-(len(header) + 12) % 4))
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """The index saved to `path`, or None if it is missing or unusable."""
+        try:
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if data[:4] != MAGIC:
+            return None
+        size = int.from_bytes(data[4:12], 'little')
+        header = json.loads(data[12:12 + size].decode())
+        if header['byteorder'] != sys.byteorder:
+            return None
+
+        index = cls()
+        index.page_ids = header['page_ids']
+        index.modified = array('d', header['modified'])
+        index.lengths = {field: array('I', lengths)
+                         for field, lengths in header['lengths'].items()}
+        index.live = bytearray(b'\1' * len(index.page_ids))
+        index.doc_of = {page_id: doc for doc, page_id in enumerate(index.page_ids)}
+        index.total_lengths = {field: sum(lengths) for field, lengths in index.lengths.items()}
+        index.live_count = len(index.page_ids)
+        start = 12 + size + (-(size + 12) % 4)
+        terms = {key: tuple(offsets) for key, offsets in header['terms'].items()}
+        index.segments = [_FileSegment(memoryview(data)[start:], terms), _MemorySegment()]
+        index.synced_at = header['synced_at']
+        return index
+
+
+def _parse(query):
+    words, prefixes, phrases = list(), list(), list()
+    for quoted, word in _query_pat.findall(query):
+        if quoted:
+            tokens = tokenize(quoted)
+            if len(tokens) > 1:
+                phrases.append(tokens)
+            else:
+                words.extend(tokens)
+        elif word.endswith('*'):
+            prefixes.extend(tokenize(word)[-1:])
+            words.extend(tokenize(word)[:-1])
+        else:
+            words.extend(tokenize(word))
+    return words, prefixes, phrases
+
+
+def _phrase_count(postings, doc):
+    """Occurrences of the terms of `postings` one after the other in `doc`."""
+    starts = None
+    for offset, p in enumerate(postings):
+        i = bisect_left(p.docs, doc)
+        if i == len(p.docs) or p.docs[i] != doc:
+            return 0
+        positions = {position - offset for position in p.positions_of(i)}
+        starts = positions if starts is None else starts & positions
+        if not starts:
+            return 0
+    return len(starts)
+
+
+class SearchIndexes:
+    """The search index of each wiki group, loaded on first use.
+
+    Queries first index the pages modified since the last query, at most
+    every SEARCH_INDEX_SYNC seconds, and the pages this process changed
+    since, so that saving a page does not wait for it to be indexed.
+    """
+
+    def __init__(self):
+        self._indexes = dict()
+        self._pending = dict()
+        self._lock = RLock()
+
+    def _path(self, wiki_group):
+        directory = current_app.config.get(
+            'SEARCH_INDEX_PATH', os.path.join(current_app.config['DATA_PATH'], 'search'))
+        return os.path.join(directory, wiki_group + '.idx')
+
+    def _index(self, wiki_group):
+        with self._lock:
+            index = self._indexes.get(wiki_group)
+            if index is None:
+                index = SearchIndex.load(self._path(wiki_group)) or SearchIndex()
+                self._indexes[wiki_group] = index
+            return index
+
+    def search(self, wiki_group, query, **kwargs):
+        index = self._index(wiki_group)
+        interval = current_app.config.get('SEARCH_INDEX_SYNC', 1)
+        if wiki_group in self._pending or time.time() - index.synced_at > interval:
+            self.sync(wiki_group)
+        return index.search(query, **kwargs)
+
+    def sync(self, wiki_group):
+        """Index the pages of `wiki_group` modified since the last sync.
+        The group must be the current database."""
+        # imported here, pw.models imports this module
+        from pw.models import using_read_preference
+        index = self._index(wiki_group)
+        # always from the primary, a lagging secondary would drop the
+        # pending pages and move `synced_at` past edits it has not seen
+        with index.lock, using_read_preference(None):
+            with self._lock:
+                pending = self._pending.pop(wiki_group, set())
+            now = time.time()
+            # a little early, for edits saved while the last sync ran
+            since = datetime.fromtimestamp(index.synced_at - 5) if index.synced_at else None
+            pages = get_document('WikiPage').objects
+            if since is not None:
+                pages = pages(touched_on__gte=since)
+            for wiki_page in pages.only('title', 'md', 'comments.md', 'modified_on'):
+                self._add(index, wiki_page)
+                pending.discard(str(wiki_page.id))
+            if pending:
+                # changed without touching `touched_on`, or deleted
+                found = set()
+                for wiki_page in (get_document('WikiPage')
+                                  .objects(id__in=list(pending))
+                                  .only('title', 'md', 'comments.md', 'modified_on')):
+                    self._add(index, wiki_page)
+                    found.add(str(wiki_page.id))
+                for page_id in pending - found:
+                    index.remove(page_id)
+            index.synced_at = now
+            if index.needs_compaction():
+                index.compact()
+
+    def refresh(self, wiki_group, page_id):
+        """Index the page `page_id` again at the next search of the group,
+        after it has been changed. Does nothing until the index of the group
+        is used."""
+        with self._lock:
+            if wiki_group in self._indexes:
+                self._pending.setdefault(wiki_group, set()).add(str(page_id))
+
+    def rebuild(self, wiki_group):
+        """Index every page of `wiki_group` and save the index to a file."""
+        index = SearchIndex()
+        with self._lock:
+            self._indexes[wiki_group] = index
+        self.sync(wiki_group)
+        path = self._path(wiki_group)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        index.save(path)
+        return index.live_count
+
+    @staticmethod
+    def _add(index, wiki_page):
+        index.add(str(wiki_page.id), wiki_page.title, wiki_page.md,
+                  [comment.md or '' for comment in wiki_page.comments],
+                  wiki_page.modified_on)
+
+
+search_index = SearchIndexes()
+
+
+class TitleIndex:
+    """The page titles of a wiki group, sorted for completion.
+
+    A title is entered for the start of each of its words, so that
+    "Pie chart" is completed from "pie" and from "cha". The entries are
+    two parallel lists, the lowercased keys and the page numbers, kept in
+    order by inserting with bisect.
+    """
+
+    def __init__(self):
+        self.keys = list()
+        self.docs = list()
+        self.titles = list()
+        self.page_ids = list()
+        self.doc_of = dict()
+        self.synced_at = 0.0
+        self.loaded_at = 0.0
+        self.lock = RLock()
+
+    @staticmethod
+    def _keys(title):
+        lowered = title.lower()
+        return {lowered[m.start():] for m in _token_pat.finditer(lowered)} | {lowered}
+
+    def add(self, page_id, title):
+        with self.lock:
+            doc = self.doc_of.get(page_id)
+            if doc is not None:
+                if self.titles[doc] == title:
+                    return
+                self._unlink(doc)
+            else:
+                doc = len(self.titles)
+                self.titles.append(None)
+                self.page_ids.append(page_id)
+                self.doc_of[page_id] = doc
+            self.titles[doc] = title
+            for key in self._keys(title):
+                i = bisect_left(self.keys, key)
+                self.keys.insert(i, key)
+                self.docs.insert(i, doc)
+
+    def load(self, pages):
+        """Fill the empty index with the `(page_id, title)` of `pages`,
+        sorting once rather than inserting each entry."""
+        with self.lock:
+            entries = list()
+            for page_id, title in pages:
+                doc = len(self.titles)
+                self.titles.append(title)
+                self.page_ids.append(page_id)
+                self.doc_of[page_id] = doc
+                entries.extend((key, doc) for key in self._keys(title))
+            entries.sort()
+            self.keys = [key for key, _ in entries]
+            self.docs = [doc for _, doc in entries]
+
+    def remove(self, page_id):
+        with self.lock:
+            doc = self.doc_of.pop(page_id, None)
+            if doc is not None:
+                self._unlink(doc)
+                self.titles[doc] = None
+
+    def _unlink(self, doc):
+        for key in self._keys(self.titles[doc]):
+            i = bisect_left(self.keys, key)
+            while i < len(self.keys) and self.keys[i] == key:
+                if self.docs[i] == doc:
+                    del self.keys[i]
+                    del self.docs[i]
+                    break
+                i += 1
+
+    def complete(self, prefix, limit=10):
+        """The `(page_id, title)` of up to `limit` pages with a title, or a
+        word of it, starting with `prefix`. Titles starting with it and
+        short titles come first."""
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return list()
+        with self.lock:
+            docs = list()
+            i = bisect_left(self.keys, prefix)
+            # a few more than needed, to rank them
+            while (i < len(self.keys) and self.keys[i].startswith(prefix)
+                   and len(docs) < 5 * limit):
+                if self.docs[i] not in docs:
+                    docs.append(self.docs[i])
+                i += 1
+            matches = [(self.page_ids[doc], self.titles[doc]) for doc in docs]
+        matches.sort(key=lambda match: (not match[1].lower().startswith(prefix), len(match[1])))
+        return matches[:limit]
+
+
+class TitleIndexes:
+    """The title index of each wiki group.
+
+    Pages created, renamed or deleted by this process are updated at once.
+    Pages created or renamed by other processes are picked up from their
+    `touched_on` at most every SEARCH_INDEX_SYNC seconds, and the index is
+    read again every TITLE_INDEX_TTL seconds, for the pages deleted by them
+    and the changes made to the database directly.
+    """
+
+    def __init__(self):
+        self._indexes = dict()
+        self._lock = RLock()
+
+    def complete(self, wiki_group, prefix, limit=10):
+        """The group must be the current database."""
+        config = current_app.config
+        with self._lock:
+            index = self._indexes.get(wiki_group)
+            if index is None or time.time() - index.loaded_at > config.get('TITLE_INDEX_TTL', 300):
+                index = self._indexes[wiki_group] = TitleIndex()
+        with index.lock:
+            if time.time() - index.synced_at > config.get('SEARCH_INDEX_SYNC', 1):
+                self._sync(index)
+        return index.complete(prefix, limit)
+
+    @staticmethod
+    def _sync(index):
+        now = time.time()
+        pages = get_document('WikiPage').objects
+        if index.synced_at:
+            pages = pages(touched_on__gte=datetime.fromtimestamp(index.synced_at - 5))
+            for page_id, title in pages.scalar('id', 'title'):
+                index.add(str(page_id), title)
+        else:
+            index.load((str(page_id), title) for page_id, title in pages.scalar('id', 'title'))
+            index.loaded_at = now
+        index.synced_at = now
+
+    def add(self, wiki_group, page_id, title):
+        """Add or rename the page `page_id`, if the index of the group is
+        in use."""
+        index = self._indexes.get(wiki_group)
+        if index is not None:
+            index.add(str(page_id), title)
+
+    def remove(self, wiki_group, page_id):
+        """Remove the deleted page `page_id`, if the index of the group is
+        in use."""
+        index = self._indexes.get(wiki_group)
+        if index is not None:
+            index.remove(str(page_id))
+
+
+title_index = TitleIndexes()
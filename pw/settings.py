@@ -22,8 +22,19 @@ MONGODB_SETTINGS = {
     'host': env.str('DB_SERVICE', default='127.0.0.1'),
     'port': env.int('DB_PORT', default=27017),
     'username': env.str('DB_USER'),
-    'password': env.str('DB_PASS')
+    'password': env.str('DB_PASS'),
+    # Connection pool of the client shared by all wiki groups on a host
+    'maxPoolSize': env.int('DB_MAX_POOL_SIZE', default=100),
+    'minPoolSize': env.int('DB_MIN_POOL_SIZE', default=0),
+    'maxIdleTimeMS': env.int('DB_MAX_IDLE_TIME_MS', default=300000),
+    'waitQueueTimeoutMS': env.int('DB_WAIT_QUEUE_TIMEOUT_MS', default=10000),
+    'serverSelectionTimeoutMS': env.int('DB_SERVER_SELECTION_TIMEOUT_MS', default=10000)
 }
+# Client options of the other hosts wiki groups are placed on, by host name
+# or URI, such as their own credentials:
+# {"db2.example.com": {"username": "pw", "password": "...", "authSource": "admin"}}
+# Hosts not listed connect with the options and credentials above.
+MONGODB_HOSTS = env.json('MONGODB_HOSTS', default={})
 DEBUG_TB_ENABLED = DEBUG
 DEBUG_TB_INTERCEPT_REDIRECTS = False
 WTF_CSRF_TIME_LIMIT = 100000000 # TODO: change
@@ -31,6 +42,70 @@ DATA_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, o
 DB_PATH = os.path.join(DATA_PATH, 'db')
 UPLOAD_PATH = os.path.join(DATA_PATH, 'upload')
 
+# Read preference of the views which only read, such as secondaryPreferred
+# or nearest, and of single views by endpoint, e.g. wiki.search=nearest.
+# Empty to read everything from the primary.
+READ_PREFERENCE = env.str('READ_PREFERENCE', default='') or None
+READ_PREFERENCES = env.dict('READ_PREFERENCES', default={})
+# Skip the secondaries lagging more than this, 0 for no limit (at least 90)
+READ_MAX_STALENESS_SECONDS = env.int('READ_MAX_STALENESS_SECONDS', default=0)
+# Seconds a user reads from the primary after writing, to see their own
+# changes while the secondaries catch up
+READ_YOUR_WRITES_SECONDS = env.int('READ_YOUR_WRITES_SECONDS', default=30)
+
+# Number of threads serving requests in run.py
+WAITRESS_THREADS = env.int('WAITRESS_THREADS', default=4)
+
+# Seconds a process keeps its list of active wiki groups, to pick up the
+# changes made by other processes
+WIKI_GROUP_TTL = env.int('WIKI_GROUP_TTL', default=30)
+
+# Seconds the key pages and latest changes beside every page are cached,
+# they are refreshed at once after changes made by the same process
+SIDEBAR_CACHE_TTL = env.int('SIDEBAR_CACHE_TTL', default=10)
+
+# Seconds the totals of listings are used before they are counted again,
+# in the background
+COUNT_CACHE_TTL = env.int('COUNT_CACHE_TTL', default=60)
+# Milliseconds a count may run on the server, slower counts are replaced
+# by the estimated number of documents of the collection
+COUNT_MAX_TIME_MS = env.int('COUNT_MAX_TIME_MS', default=2000)
+
+# Directory of the search index files written by `flask rebuild-search-index`,
+# and seconds between checks for pages changed by other processes
+SEARCH_INDEX_PATH = env.str('SEARCH_INDEX_PATH', default=os.path.join(DATA_PATH, 'search'))
+SEARCH_INDEX_SYNC = env.float('SEARCH_INDEX_SYNC', default=1)
+# Seconds before the page titles completed by /<wiki_group>/titles/complete
+# are read again, for the changes made to the database directly
+TITLE_INDEX_TTL = env.int('TITLE_INDEX_TTL', default=300)
+# Threads searching the wiki groups for /<wiki_group>/search/groups, the
+# seconds a group has to answer, and the searches of a group which may be
+# still running before it is skipped
+FEDERATED_SEARCH_WORKERS = env.int('FEDERATED_SEARCH_WORKERS', default=8)
+FEDERATED_SEARCH_TIMEOUT = env.float('FEDERATED_SEARCH_TIMEOUT', default=2)
+FEDERATED_SEARCH_PENDING = env.int('FEDERATED_SEARCH_PENDING', default=2)
+
+# Number of rendered markdown texts cached per wiki group
+MARKDOWN_CACHE_SIZE = env.int('MARKDOWN_CACHE_SIZE', default=256)
+
+# Keep the full markdown of every Nth page version, so that an old version
+# is rebuilt from the nearest snapshot instead of the current text.
+# Set to 0 to disable.
+HISTORY_SNAPSHOT_INTERVAL = env.int('HISTORY_SNAPSHOT_INTERVAL', default=50)
+HISTORY_SNAPSHOT_COMPRESS = env.bool('HISTORY_SNAPSHOT_COMPRESS', default=True)
+
+# Codec diffs of new page versions are stored with: zlib, zstd (needs the
+# zstandard package) or empty to store them as plain text
+HISTORY_DIFF_CODEC = env.str('HISTORY_DIFF_CODEC', default='zlib') or None
+
+# `flask compact-history` drops the versions older than this many days
+HISTORY_RETENTION_DAYS = env.int('HISTORY_RETENTION_DAYS', default=365)
+
+# Unchanged lines shown around each change on the history page, and number
+# of rendered diffs cached per wiki group
+HISTORY_DIFF_CONTEXT = env.int('HISTORY_DIFF_CONTEXT', default=3)
+HISTORY_DIFF_CACHE_SIZE = env.int('HISTORY_DIFF_CACHE_SIZE', default=128)
+
 # Email to send out notification to users
 # Here Gmail is used as an example. 
 # If you want to stay with Gmail, 
@@ -2,7 +2,9 @@ let renderMathFlag = false;
 
 function update(e) {
     setOutput(e.getValue());
+}
 
+function updateTitle() {
     //If a title is added to the document it will be the new document.title, otherwise use default
     var headerElements = document.querySelectorAll('h1');
     if (headerElements.length > 0 && headerElements[0].textContent.length > 0) {
@@ -20,30 +22,18 @@ function update(e) {
 }
 
 function setOutput(val) {
-    val = val.replace(/<equation>((.*?\n)*?.*?)<\/equation>/ig, function(a, b) {
-        return '<img src="http://latex.codecogs.com/png.latex?' + encodeURIComponent(b) + '" />';
-    });
-
-    var out = document.getElementById('out');
-    var old = out.cloneNode(true);
-    out.innerHTML = marked(val);
-    if (renderMathFlag) {
-        MathJax.Hub.Queue(["Typeset", MathJax.Hub, "out"]);
-        renderMathFlag = false;
-    }
-
-    var allold = old.getElementsByTagName("*");
-    if (allold === undefined) return;
-
-    var allnew = out.getElementsByTagName("*");
-    if (allnew === undefined) return;
+    schedulePreview(val, function(changed) {
+        var out = document.getElementById('out');
+        if (renderMathFlag) {
+            MathJax.Hub.Queue(["Typeset", MathJax.Hub, "out"]);
+            renderMathFlag = false;
+        }
 
-    for (var i = 0, max = Math.min(allold.length, allnew.length); i < max; i++) {
-        if (!allold[i].isEqualNode(allnew[i])) {
-            out.scrollTop = allnew[i].offsetTop;
-            return;
+        if (changed && changed.offsetTop !== undefined) {
+            out.scrollTop = changed.offsetTop;
         }
-    }
+        updateTitle();
+    });
 }
 
 CodeMirrorSpellChecker({
@@ -0,0 +1,11 @@
+// Load collapsed unchanged lines of the history diff when clicked.
+$('#diff-table').on('click', '.diff-expand', function() {
+  let row = $(this);
+  if (row.hasClass('loading')) return;
+  row.addClass('loading');
+  $.get(row.data('url'), function(rows) {
+    row.replaceWith(rows);
+  }).fail(function() {
+    row.removeClass('loading');
+  });
+});
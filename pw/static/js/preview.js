@@ -0,0 +1,56 @@
+// Live preview for the editor.
+// The markdown is rendered by the server, so the preview matches the saved
+// page exactly. Requests are debounced while the user types, responses to
+// outdated requests are dropped, and only the top-level nodes that changed
+// are replaced in the output pane.
+const PREVIEW_DELAY = 300;
+let previewTimer = null;
+let previewSeq = 0;
+
+function schedulePreview(val, callback) {
+  clearTimeout(previewTimer);
+  previewTimer = setTimeout(function() {
+    requestPreview(val, callback);
+  }, PREVIEW_DELAY);
+}
+
+function requestPreview(val, callback) {
+  let seq = ++previewSeq;
+  $.ajax({
+    url: '/' + wiki_group + '/preview',
+    method: 'POST',
+    data: {md: val},
+    headers: {'X-CSRFToken': $('meta[name=csrf-token]').attr('content')},
+    success: function(data) {
+      // a newer request has been sent in the meantime
+      if (seq !== previewSeq) return;
+      let changed = patchOutput(document.getElementById('out'), data.html);
+      if (callback) callback(changed);
+    }
+  });
+}
+
+// Replace the children of `out` that differ from the new html.
+// Returns the first node that changed, or null.
+function patchOutput(out, html) {
+  let template = document.createElement('template');
+  template.innerHTML = html;
+  let newNodes = Array.from(template.content.childNodes);
+  let oldNodes = Array.from(out.childNodes);
+  let firstChanged = null;
+
+  for (let i = 0; i < newNodes.length; i++) {
+    if (i >= oldNodes.length) {
+      out.appendChild(newNodes[i]);
+    } else if (!oldNodes[i].isEqualNode(newNodes[i])) {
+      out.replaceChild(newNodes[i], oldNodes[i]);
+    } else {
+      continue;
+    }
+    firstChanged = firstChanged || newNodes[i];
+  }
+  for (let i = newNodes.length; i < oldNodes.length; i++) {
+    out.removeChild(oldNodes[i]);
+  }
+  return firstChanged;
+}
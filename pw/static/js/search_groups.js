@@ -0,0 +1,51 @@
+// Show the results of each wiki group as it answers, merged by score.
+(function() {
+  let container = $('#search-result');
+  if (!container.length) return;
+  let results = [];
+
+  function render() {
+    let tbody = $('#search-groups-results').empty();
+    results.forEach(function(result, i) {
+      $('<tr>')
+        .append($('<th scope="row">').text(i + 1))
+        .append($('<td>').text(result.group))
+        .append($('<td>').append($('<a>').attr('href', result.url).text(result.title)))
+        .append($('<td>').text(result.modified_by))
+        .append($('<td>').text(result.modified_on))
+        .appendTo(tbody);
+    });
+  }
+
+  function receive(line) {
+    let answer = JSON.parse(line);
+    let status = $('#search-groups-status [data-wiki-group="' + answer.wiki_group + '"]');
+    if (answer.results === null) {
+      status.text(answer.name + ': no answer');
+      return;
+    }
+    status.text(answer.name + ': ' + answer.total);
+    answer.results.forEach(function(result) {
+      result.group = answer.name;
+      results.push(result);
+    });
+    results.sort(function(a, b) { return b.score - a.score; });
+    render();
+  }
+
+  fetch(container.data('url'), {credentials: 'same-origin'}).then(function(response) {
+    let reader = response.body.getReader();
+    let decoder = new TextDecoder();
+    let buffer = '';
+    function read() {
+      return reader.read().then(function(chunk) {
+        buffer += decoder.decode(chunk.value || new Uint8Array(), {stream: !chunk.done});
+        let lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.filter(Boolean).forEach(receive);
+        if (!chunk.done) return read();
+      });
+    }
+    return read();
+  });
+})();
@@ -5,15 +5,14 @@ from flask import (Blueprint, render_template, redirect, url_for, flash,
 import os
 import shutil
 from mongoengine.connection import DEFAULT_CONNECTION_NAME
-from mongoengine.connection import _connection_settings as db_connection_settings
-from mongoengine.connection import disconnect
 from flask_login import login_user, logout_user, current_user
 
-from pw.extensions import db
+from pw.extensions import db, markdown, mongo_pool, wiki_groups
 from pw.authentication import admin_required
 from pw.auth.forms import LoginForm
 from pw.super_admin.forms import AddWikiGroupForm
-from pw.models import WikiGroup, WikiUser, WikiLoginRecord, WikiPage
+from pw.models import (WikiGroup, WikiUser, WikiLoginRecord, WikiPage, forget_db_alias,
+                       using_db_alias)
 from pw.utils import flash_errors, convert_user_ids_to_dict, convert_dict_to_user_ids
 
 blueprint = Blueprint('super_admin', __name__, static_folder='../static')
@@ -26,7 +25,7 @@ def pull_wiki_group_code(endpoint, values):
 @blueprint.route('/')
 def cover():
     """Cover page."""
-    active_wiki_groups = WikiGroup.objects(active=True).all()
+    active_wiki_groups = wiki_groups.active()
     return render_template(
         'super_admin/cover.html',
         active_wiki_groups=active_wiki_groups
@@ -97,12 +96,7 @@ def home():
             try:
                 os.mkdir(os.path.join(current_app.config['UPLOAD_PATH'], new_group.db_name))
                 new_group.save()
-                db.register_connection(
-                    alias=new_group.db_name, 
-                    name=new_group.db_name,
-                    host=current_app.config['MONGODB_SETTINGS']['host'],
-                    port=current_app.config['MONGODB_SETTINGS']['port']
-                )
+                mongo_pool.connect(new_group.db_name)
 
                 new_user = WikiUser(
                     name=form.username.data,
@@ -110,8 +104,10 @@ def home():
                     is_admin=True
                 )
                 new_user.set_password(form.password.data)
-                new_user.switch_db(new_group.db_name).save()
-                WikiPage(title='Home').switch_db(new_group.db_name).save()
+                with using_db_alias(new_group.db_name):
+                    new_user.save()
+                    WikiPage(title='Home').save()
+                wiki_groups.invalidate()
                 flash('New wiki group added', 'success')
                 return redirect(url_for('.home'))
             except FileExistsError:
@@ -134,16 +130,13 @@ def activate(wiki_group):
     if wg is not None:
         if wg.active:
             wg.active = False
-            db_connection_settings.pop(wg.db_name, None)
-            disconnect(wg.db_name)
+            mongo_pool.disconnect(wg.db_name)
+            forget_db_alias(wg.db_name)
         else:
             wg.active = True
-            db.register_connection(
-                alias=wg.db_name,
-                name=wg.db_name,
-                host=current_app.config['MONGODB_SETTINGS']['host'],
-                port=current_app.config['MONGODB_SETTINGS']['port'])
+            mongo_pool.connect(wg.db_name, wg.host)
         wg.save()
+        wiki_groups.invalidate()
     return redirect(url_for('.home'))
 
 
@@ -153,16 +146,27 @@ def delete_group(wiki_group):
     wg = WikiGroup.objects(db_name=wiki_group).first()
     if wg is not None:
         if wg.active:
-            db_connection_settings.pop(wg.db_name, None)
-            disconnect(wg.db_name)
-        db.connection.drop_database(wg.db_name)
+            mongo_pool.disconnect(wg.db_name)
+            forget_db_alias(wg.db_name)
+        mongo_pool.client(wg.host).drop_database(wg.db_name)
         wg.delete()
+        wiki_groups.invalidate()
 
         shutil.rmtree(os.path.join(current_app.config['UPLOAD_PATH'], wiki_group))
 
     return redirect(url_for('.home'))
 
 
+@blueprint.route('/super-admin/pool')
+@admin_required
+def pool():
+    """Connection pool utilization, by MongoDB server, and use of the
+    markdown cache, by wiki group."""
+    return render_template('super_admin/pool.html',
+                           pools=mongo_pool.stats.snapshot(),
+                           markdown_caches=markdown.cache.stats())
+
+
 # TODO: maybe move these routes to another blueprint
 @blueprint.route('/favicon.ico')
 def favicon():
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 """Helper utilities and decorators."""
-from flask import flash, request
+import zlib
+from flask import flash
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for the zstd codec
+    zstandard = None
 
 
 def flash_errors(form, category='warning'):
@@ -34,16 +40,6 @@ def get_pagination_kwargs(d, current_page_number, total_page_number):
         calc_page_num(d['current_page_number'], d['total_page_number'])
 
 
-def paginate(query_set):
-    current_page_number=request.args.get('page', default=1, type=int)
-    number_per_page = 100
-    results = query_set.paginate(current_page_number, per_page=number_per_page)
-    total_page_number = results.pages
-    kwargs = dict(data=results, number_per_page=number_per_page)
-    get_pagination_kwargs(kwargs, current_page_number, total_page_number)
-    return kwargs
-
-
 def convert_user_ids_to_dict(user_ids):
     # session['user_id'] = '<wiki_group_1>-<wiki_user_id_1>,<wiki_group_2>-<wiki_user_id_2>,...'
     user_id_dict = dict()
@@ -59,4 +55,48 @@ def convert_dict_to_user_ids(user_id_dict):
     user_id_list = list()
     for wiki_group, _id in user_id_dict.items():
         user_id_list.append('{0}-{1}'.format(wiki_group, _id))
-    return ','.join(user_id_list)
\ No newline at end of file
+    return ','.join(user_id_list)
+
+
+def compress_text(text, codec=None):
+    """Encode text for a binary field, compressing it with `codec`."""
+    data = text.encode('utf-8')
+    if codec == 'zlib':
+        return zlib.compress(data)
+    elif codec == 'zstd':
+        return _zstd().ZstdCompressor().compress(data)
+    elif codec is None:
+        return data
+    raise ValueError('Unknown codec: {}'.format(codec))
+
+
+def decompress_text(data, codec=None):
+    if codec == 'zlib':
+        data = zlib.decompress(data)
+    elif codec == 'zstd':
+        data = _zstd().ZstdDecompressor().decompress(data)
+    elif codec is not None:
+        raise ValueError('Unknown codec: {}'.format(codec))
+    return data.decode('utf-8')
+
+
+def _zstd():
+    if zstandard is None:
+        raise ValueError('The zstd codec needs the zstandard package.')
+    return zstandard
+
+
+# the first byte of packed text tells how the rest is compressed
+_codec_tags = {'zlib': b'z', 'zstd': b's'}
+_tag_codecs = {v: k for k, v in _codec_tags.items()}
+
+
+def pack_text(text, codec):
+    """Compress text with `codec` into bytes which record the codec used."""
+    if codec not in _codec_tags:
+        raise ValueError('Unknown codec: {}'.format(codec))
+    return _codec_tags[codec] + compress_text(text, codec)
+
+
+def unpack_text(data):
+    return decompress_text(data[1:], _tag_codecs[data[:1]])
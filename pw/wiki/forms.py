@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 """Wiki forms."""
 from flask_wtf import FlaskForm
-from wtforms import TextAreaField, SubmitField, IntegerField, StringField
+from wtforms import TextAreaField, SubmitField, IntegerField, StringField, SelectField
 from wtforms.validators import DataRequired
 
 
@@ -35,6 +35,26 @@ class SearchForm(FlaskForm):
     submit = SubmitField('Search')
 
 
+class HistorySearchForm(FlaskForm):
+    search = StringField('Words')
+    author = StringField('Author')
+    start_date = StringField()
+    end_date = StringField()
+    mode = SelectField('Find', choices=[
+        ('changed', 'Changes adding or removing the words'),
+        ('added', 'Changes adding the words'),
+        ('removed', 'Changes removing the words'),
+        ('introduced', 'When the words were introduced, by page'),
+        ('dropped', 'When the words were last removed, by page'),
+        ('comments', 'Comments')
+    ], default='changed')
+    oldest_first = SelectField('Order', choices=[
+        ('', 'Newest first'),
+        ('1', 'Oldest first')
+    ], default='')
+    submit = SubmitField('Search')
+
+
 class HistoryRecoverForm(FlaskForm):
     version = IntegerField(
         'Recover history',
@@ -1,22 +1,33 @@
 # -*- coding: utf-8 -*-
 """Wiki section, including wiki pages for each group."""
 from flask import (Blueprint, g, request, redirect, url_for, render_template,
-                   flash, current_app, send_from_directory)
+                   flash, current_app, send_from_directory, jsonify, session,
+                   Response, stream_with_context)
 import os
+import json
+import math
 from datetime import date, datetime, timedelta
+from bson import ObjectId
 from flask_login import current_user
-import difflib
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
 from mongoengine.errors import ValidationError
 
-from pw.blueprints import setup_blueprint
+from pw.blueprints import setup_blueprint, secondary_reads, before_write
 from pw.authentication import login_required
-from pw.extensions import db, markdown
+from pw.extensions import db, markdown, wiki_groups
 from pw.wiki.forms import (SearchForm, CommentForm, WikiEditForm,
-                           RenameForm, HistoryRecoverForm)
-from pw.models import WikiPage, WikiPageVersion, WikiFile, WikiComment, WikiUser
-from pw.markdown import render_wiki_page, render_wiki_file
-from pw.utils import flash_errors, get_pagination_kwargs, paginate
-from pw.diff import make_patch, apply_patches
+                           RenameForm, HistoryRecoverForm, HistorySearchForm)
+from pw.models import (WikiPage, WikiPageVersion, WikiFile, WikiComment, WikiUser,
+                       WikiLink, linked_files, sidebar_cache)
+from pw.markdown import (render_wiki_file, normalize_links, denormalize_links,
+                         resolve_titles)
+from pw.utils import flash_errors, get_pagination_kwargs, convert_user_ids_to_dict
+from pw.pagination import NUMBER_PER_PAGE, Page, paginate
+from pw.search import search_index, title_index
+from pw.federated import federated_search
+from pw.history import history_query, first_changes, changed_lines, search_comments
+from pw.diff import make_patch, apply_patch
+from pw.diffview import diff_cache, render_diff, render_lines
 from pw.email import send_email
 
 blueprint = Blueprint('wiki', __name__, static_folder='../static', url_prefix='/<wiki_group>')
@@ -33,27 +44,36 @@ def home():
 
 @blueprint.route('/page/<wiki_page_id>', methods=['GET', 'POST'])
 @login_required
+@secondary_reads
 def page(wiki_page_id):
     form = CommentForm()
     wiki_page = (WikiPage
                  .objects
-                 .exclude('versions', 'refs')
+                 .exclude('refs', 'blocks')
                  .get_or_404(id=wiki_page_id))
 
     if form.validate_on_submit():
-        _, comment_html = markdown(wiki_page, form.textArea.data)
+        before_write()
+        rendered = markdown(wiki_page, normalize_links(form.textArea.data))
         new_comment = WikiComment(
             id='{}-{}'.format(datetime.utcnow().strftime('%s.%f'), current_user.id),
             author=current_user.name,
-            html=comment_html,
-            md=form.textArea.data
+            html=rendered.html,
+            md=rendered.md
         )
+        new_comment.set_words()
 
         (WikiPage
          .objects(id=wiki_page_id)
-         .update_one(push__comments=new_comment))
-
-        user_emails = [u.email for u in g.users_to_email]
+         .update_one(push__comments=new_comment, set__touched_on=datetime.now()))
+        WikiLink.set_links(
+            wiki_page.id,
+            pages=[ref.id for ref in wiki_page.refs],
+            files=linked_files(new_comment.md),
+            comment=new_comment.id)
+        search_index.refresh(g.wiki_group, wiki_page.id)
+
+        user_emails = [u.email for u in rendered.users_to_email]
         msg = '{0} ({1}) mentioned you at <a href="{2}">{3}</a>'\
             .format(
                 current_user.name,
@@ -67,6 +87,12 @@ def page(wiki_page_id):
             wiki_page_id=wiki_page_id
         ))
 
+    # show the current titles of the linked pages
+    wiki_page.html, *comment_htmls = resolve_titles(
+        wiki_page.html, *[comment.html for comment in wiki_page.comments])
+    for comment, html in zip(wiki_page.comments, comment_htmls):
+        comment.html = html
+
     return render_template(
         'wiki/page.html',
         wiki_page=wiki_page,
@@ -78,31 +104,41 @@ def page(wiki_page_id):
 @login_required
 def delete_comment(wiki_page_id):
     wiki_comment_id = request.args.get('comment')
-    WikiPage.objects(id=wiki_page_id).update_one(pull__comments__id=wiki_comment_id)
+    before_write()
+    (WikiPage
+     .objects(id=wiki_page_id)
+     .update_one(pull__comments__id=wiki_comment_id, set__touched_on=datetime.now()))
+    WikiLink.objects(source=wiki_page_id, comment=wiki_comment_id).delete()
+    search_index.refresh(g.wiki_group, wiki_page_id)
     return redirect(url_for('.page', wiki_page_id=wiki_page_id))
 
 
 @blueprint.route('/edit/<wiki_page_id>', methods=['GET', 'POST'])
 @login_required
 def edit(wiki_page_id):
-    fields = ['title', 'md', 'current_version',
+    fields = ['title', 'md', 'html', 'blocks', 'current_version',
               'modified_on', 'modified_by']
     wiki_page = (WikiPage.objects
                  .no_dereference()
                  .only(*fields)
                  .get_or_404(id=wiki_page_id))
     form = WikiEditForm(
-        textArea=wiki_page.md,
+        textArea=denormalize_links(wiki_page.md),
         current_version=wiki_page.current_version
     )
 
     if form.validate_on_submit():
         if form.current_version.data == wiki_page.current_version:
-            md = form.textArea.data
+            before_write()
+            md = normalize_links(form.textArea.data)
             diff = make_patch(wiki_page.md, md)
             if diff:
-                toc, html = markdown(wiki_page, md)
-                wiki_page.update_db(diff, md, html, toc=toc)
+                rendered = markdown.update(wiki_page, md, diff)
+                if rendered.md != md:
+                    # links to the pages created by the edit
+                    md, diff = rendered.md, make_patch(wiki_page.md, rendered.md)
+                wiki_page.update_db(diff, md, rendered.html, toc=rendered.toc,
+                                    blocks=rendered.blocks)
 
             return redirect(url_for('.page', wiki_page_id=wiki_page.id))
         else:
@@ -116,6 +152,18 @@ def edit(wiki_page_id):
     )
 
 
+@blueprint.route('/preview', methods=['POST'])
+@login_required
+def preview():
+    """Render markdown for the editor without touching the database."""
+    rendered = markdown(WikiPage(), request.form.get('md', ''), pure=True)
+    return jsonify(
+        toc=rendered.toc,
+        html=rendered.html,
+        new_pages=[wiki_page.title for wiki_page in rendered.new_pages]
+    )
+
+
 @blueprint.route('/upload/<wiki_page_id>')
 @login_required
 def upload(wiki_page_id):
@@ -128,6 +176,7 @@ def upload(wiki_page_id):
 @blueprint.route('/handle-upload', methods=['POST'])
 @login_required
 def handle_upload():
+    before_write()
     form = request.form
     wiki_page_id = form.get('wiki_page_id', None)
     upload_from_upload_page = form.get('upload_page', None)
@@ -155,6 +204,7 @@ def handle_upload():
             file_type = 'file'
         file_markdown += '\n\n[{}:{}]'.format(file_type, wiki_file.id)
         file_html += '<p>{}</p>'.format(render_wiki_file(
+            g.wiki_group,
             wiki_file.id,
             wiki_file.name,
             file_type,
@@ -183,10 +233,10 @@ def handle_upload():
 
 @blueprint.route('/replace-file', methods=['POST'])
 def replace_file():
+    before_write()
     form = request.form
     file = request.files['wiki_file']
     wiki_file_id = form.get('wiki_file_id', None)
-    wiki_file_markdown = '[file:{0}]'.format(wiki_file_id)
 
     # save uploaded file with WikiFile.id as filename
     file.save(os.path.join(
@@ -205,18 +255,24 @@ def replace_file():
          # `size` is reserved
          set__size__=file.tell()))
 
+    markdown.cache.invalidate_file(g.wiki_group, wiki_file_id)
+
     if wiki_file and wiki_file.name != file.filename:
+        links = WikiLink.objects(file=int(wiki_file_id))
         # re-render the wiki page markdown with replace file
-        for wiki_page in WikiPage.objects(md__contains=wiki_file_markdown).only('md'):
-            toc, html = markdown(wiki_page, wiki_page.md)
+        sources = links.filter(comment=None).distinct('source')
+        for wiki_page in WikiPage.objects(id__in=sources).only('md'):
+            rendered = markdown(wiki_page, wiki_page.md)
             (WikiPage
             .objects(id=wiki_page.id)
-            .update_one(set__toc=toc, set__html=html))
+            .update_one(set__toc=rendered.toc, set__html=rendered.html,
+                        set__blocks=rendered.blocks))
 
         # re-render the wiki comment markdown with replace file
-        for wiki_page in WikiPage.objects(comments__md__contains=wiki_file_markdown).only('comments'):
+        sources = links.filter(comment__exists=True).distinct('source')
+        for wiki_page in WikiPage.objects(id__in=sources).only('comments'):
             for comment in wiki_page.comments:
-                _, comment.html = markdown(wiki_page, comment.md)
+                comment.html = markdown(wiki_page, comment.md).html
             WikiPage.objects(id=wiki_page.id).update_one(comments=wiki_page.comments)
 
     return ''
@@ -224,10 +280,12 @@ def replace_file():
 
 @blueprint.route('/reference/<wiki_page_id>')
 @login_required
+@secondary_reads
 def reference(wiki_page_id):
     wiki_page = WikiPage.objects.only('title').get_or_404(id=wiki_page_id)
+    sources = WikiLink.objects(page=wiki_page.id, comment=None).distinct('source')
     wiki_referencing_pages = (WikiPage
-                              .objects(refs__contains=wiki_page_id)
+                              .objects(id__in=sources)
                               .only('title')
                               .all())
 
@@ -254,45 +312,18 @@ def rename(wiki_page_id):
         elif WikiPage.objects(title=new_title).count() > 0:
             flash('The new page title has already been taken.', 'danger')
         else:
-            old_md = '[[{}]]'.format(wiki_page.title)
-            new_md = '[[{}]]'.format(new_title)
-
-            old_html = render_wiki_page(wiki_page.id, wiki_page.title)
-            new_html = render_wiki_page(wiki_page.id, new_title)
-
-            # update the markdown of referencing wiki page 
-            wiki_referencing_pages = (
-                WikiPage
-                .objects(refs__contains=wiki_page_id)
-                .only('md', 'html', 'comments')
-                .all()
-            )
-
-            for ref in wiki_referencing_pages:
-                new_md_content = ref.md.replace(old_md, new_md)
-                new_html_content = ref.html.replace(old_html, new_html)
-
-                (WikiPage
-                 .objects(id=ref.id)
-                 .update_one(
-                     set__md=new_md_content,
-                     set__html=new_html_content))
-
-            # update renamed page title in comments
-            for wp in WikiPage.objects(comments__md__contains=old_md).only('comments'):
-                for comment in wp.comments:
-                    comment.md = comment.md.replace(old_md, new_md)
-                    comment.html = comment.html.replace(old_html, new_html)
-                WikiPage.objects(id=wp.id).update_one(comments=wp.comments)
-
-            # update the diff of related wiki page versions
-            for pv in WikiPageVersion.objects.search_text(old_md).all():
-                pv.diff = pv.diff.replace(old_md, new_md)
-                pv.save()
-
+            before_write()
+            # links are stored by page id and rendered with the current
+            # title, so only the page itself changes
             (WikiPage
              .objects(id=wiki_page.id)
-             .update_one(set__title=new_title))
+             .update_one(set__title=new_title, set__touched_on=datetime.now()))
+            markdown.cache.invalidate_page(g.wiki_group, wiki_page.id)
+            # rendered history diffs show the old title
+            diff_cache.clear(g.wiki_group)
+            sidebar_cache.pop(g.wiki_group)
+            search_index.refresh(g.wiki_group, wiki_page.id)
+            title_index.add(g.wiki_group, wiki_page.id, new_title)
 
             return redirect(url_for('.page', wiki_page_id=wiki_page.id))
     else:
@@ -307,6 +338,7 @@ def rename(wiki_page_id):
 
 @blueprint.route('/file/<int:wiki_file_id>')
 @login_required
+@secondary_reads
 def file(wiki_file_id):
     wiki_file = WikiFile.objects.only('name').get_or_404(id=wiki_file_id)
     return send_from_directory(
@@ -319,34 +351,38 @@ def file(wiki_file_id):
 
 @blueprint.route('/history/<wiki_page_id>', methods=['GET', 'POST'])
 @login_required
+@secondary_reads
 def history(wiki_page_id):
-    fields = ['title', 'md', 'current_version',
-              'modified_on', 'modified_by', 'versions']
+    fields = ['title', 'md', 'current_version', 'first_version',
+              'modified_on', 'modified_by']
     wiki_page = (WikiPage
                  .objects
                  .only(*fields)
                  .get_or_404(id=wiki_page_id))
 
-    if wiki_page.current_version == 1:
+    if wiki_page.current_version <= wiki_page.first_version:
         return redirect(url_for('.page', wiki_page_id=wiki_page_id))
 
     form = HistoryRecoverForm()
     if form.validate_on_submit():
         if form.version.data >= wiki_page.current_version:
             flash('Please enter an old version number.', 'danger')
+        elif form.version.data < wiki_page.first_version:
+            flash('Versions before {} are no longer kept.'.format(wiki_page.first_version),
+                  'danger')
         else:
-            old_to_current = wiki_page.versions[(form.version.data-1):]
-            old_to_current_patches = [pv.diff for pv in old_to_current[::-1]]
-            recovered_content = apply_patches(
-                wiki_page.md,
-                old_to_current_patches,
-                revert=True
-            )
+            before_write()
+            # versions saved before links were stored by id have titles
+            recovered_content = normalize_links(wiki_page.get_md(form.version.data))
 
             diff = make_patch(wiki_page.md, recovered_content)
             if diff:
-                toc, html = markdown(wiki_page, recovered_content)
-                wiki_page.update_db(diff, recovered_content, html, toc=toc)
+                rendered = markdown(wiki_page, recovered_content)
+                if rendered.md != recovered_content:
+                    recovered_content = rendered.md
+                    diff = make_patch(wiki_page.md, recovered_content)
+                wiki_page.update_db(diff, recovered_content, rendered.html,
+                                    toc=rendered.toc, blocks=rendered.blocks)
             return redirect(url_for('.page', wiki_page_id=wiki_page.id))
     else:
         flash_errors(form)
@@ -363,15 +399,36 @@ def history(wiki_page_id):
             wiki_page_id=wiki_page_id,
             version=wiki_page.current_version-1
         ))
+    if old_ver_num < wiki_page.first_version:
+        return redirect(url_for(
+            '.history',
+            wiki_page_id=wiki_page_id,
+            version=wiki_page.first_version
+        ))
 
-    wiki_page_versions = wiki_page.versions[old_ver_num-1:]
-    old_to_current_patches = [pv.diff for pv in wiki_page_versions[::-1]]
-    new_markdown = apply_patches(wiki_page.md, old_to_current_patches[:-1], revert=True)
-    old_markdown = apply_patches(new_markdown, [old_to_current_patches[-1]], revert=True)
-
-    diff = difflib.HtmlDiff()
-    diff_table = diff.make_table(old_markdown.splitlines(), new_markdown.splitlines())
-    diff_table = diff_table.replace('&nbsp;', ' ').replace(' nowrap="nowrap"', '')
+    # the template reads the old version from the end, the new one before it
+    wiki_page_versions = list(
+        WikiPageVersion
+        .objects(page=wiki_page, version__in=[old_ver_num, new_ver_num])
+        .exclude('snapshot')
+        .order_by('-version'))
+    if not wiki_page_versions:
+        flash('The page has no history to show.', 'warning')
+        return redirect(url_for('.page', wiki_page_id=wiki_page_id))
+    context = current_app.config.get('HISTORY_DIFF_CONTEXT', 3)
+    key = (str(wiki_page.id), old_ver_num, context)
+    diff_table = diff_cache.get(g.wiki_group, key)
+    if diff_table is None:
+        def expand_url(start, end, offset):
+            return url_for('.history_lines', wiki_page_id=wiki_page_id,
+                           version=old_ver_num, start=start, end=end, offset=offset)
+
+        # show links by title, which leaves the line numbers of the patch as they are
+        old_markdown = denormalize_links(wiki_page.get_md(old_ver_num))
+        diff_table = render_diff(old_markdown,
+                                 denormalize_links(wiki_page_versions[-1].diff),
+                                 context, expand_url)
+        diff_cache.set(g.wiki_group, key, diff_table)
 
     kwargs = dict()
     get_pagination_kwargs(kwargs, old_ver_num, wiki_page.current_version-1)
@@ -388,8 +445,33 @@ def history(wiki_page_id):
     )
 
 
+@blueprint.route('/history/<wiki_page_id>/lines')
+@login_required
+@secondary_reads
+def history_lines(wiki_page_id):
+    """Rows of unchanged lines collapsed on the history page."""
+    version = request.args.get('version', type=int)
+    start = request.args.get('start', default=0, type=int)
+    end = request.args.get('end', default=0, type=int)
+    offset = request.args.get('offset', default=0, type=int)
+
+    key = (str(wiki_page_id), version, start, end, offset)
+    rows = diff_cache.get(g.wiki_group, key)
+    if rows is None:
+        wiki_page = (WikiPage
+                     .objects
+                     .only('md', 'current_version', 'first_version')
+                     .get_or_404(id=wiki_page_id))
+        if version is None or not wiki_page.first_version <= version < wiki_page.current_version:
+            return '', 404
+        rows = render_lines(denormalize_links(wiki_page.get_md(version)), start, end, offset)
+        diff_cache.set(g.wiki_group, key, rows)
+    return rows
+
+
 @blueprint.route('/search', methods=['GET', 'POST'])
 @login_required
+@secondary_reads
 def search():
     # TODO: add filter by user
     keyword = request.args.get('keyword')
@@ -399,20 +481,21 @@ def search():
     form = SearchForm(search=keyword, start_date=start_date, end_date=end_date)
 
     if keyword and not keyword.isspace():
-        filters = dict()
-        if start_date:
-            start_date = datetime.strptime(start_date, '%m/%d/%Y')
-            filters['modified_on__gte'] = temp
-        if end_date:
-            end_date = datetime.strptime(end_date, '%m/%d/%Y') + timedelta(days=1)
-            filters['modified_on__lte'] = temp
-        query_set = (WikiPage
-                     .objects(**filters)
-                     .search_text(keyword)
-                     .only('title', 'modified_on', 'modified_by')
-                     .order_by('$text_score', '-modified_on'))
-
-        kwargs = paginate(query_set)
+        start, end = _date_range(start_date, end_date)
+        current_page_number = request.args.get('page', default=1, type=int)
+        page_ids, total = search_index.search(
+            g.wiki_group, keyword, start=start, end=end,
+            offset=(current_page_number - 1) * NUMBER_PER_PAGE, limit=NUMBER_PER_PAGE)
+        ids = [ObjectId(page_id) for page_id in page_ids]
+        wiki_pages = (WikiPage
+                      .objects
+                      .only('title', 'modified_on', 'modified_by')
+                      .in_bulk(ids))
+        kwargs = dict(
+            data=Page([wiki_pages[_id] for _id in ids if _id in wiki_pages]),
+            number_per_page=NUMBER_PER_PAGE)
+        get_pagination_kwargs(kwargs, current_page_number,
+                              max(math.ceil(total / NUMBER_PER_PAGE), 1))
 
     if form.validate_on_submit():
         return redirect(url_for(
@@ -429,8 +512,153 @@ def search():
     )
 
 
+def _date_range(start_date, end_date):
+    """The datetimes from the start of `start_date` to the end of
+    `end_date`, dates as MM/DD/YYYY. A date which does not parse leaves
+    its end of the range open."""
+    try:
+        start = datetime.strptime(start_date, '%m/%d/%Y') if start_date else None
+    except ValueError:
+        flash('Invalid start date, expected MM/DD/YYYY.', 'danger')
+        start = None
+    try:
+        end = datetime.strptime(end_date, '%m/%d/%Y') + timedelta(days=1) if end_date else None
+    except ValueError:
+        flash('Invalid end date, expected MM/DD/YYYY.', 'danger')
+        end = None
+    return start, end
+
+
+@blueprint.route('/history/search', methods=['GET', 'POST'])
+@login_required
+@secondary_reads
+def history_search():
+    """Search the changes made to pages, and the comments."""
+    keyword = request.args.get('keyword', '')
+    author = request.args.get('author', '')
+    start_date = request.args.get('start')
+    end_date = request.args.get('end')
+    mode = request.args.get('mode', 'changed')
+    oldest_first = request.args.get('oldest', '')
+    form = HistorySearchForm(search=keyword, author=author, start_date=start_date,
+                             end_date=end_date, mode=mode, oldest_first=oldest_first)
+
+    if form.validate_on_submit():
+        return redirect(url_for(
+            '.history_search',
+            keyword=form.search.data,
+            author=form.author.data,
+            start=form.start_date.data,
+            end=form.end_date.data,
+            mode=form.mode.data,
+            oldest=form.oldest_first.data
+        ))
+
+    kwargs = dict()
+    keyword = keyword.strip()
+    if keyword or author or start_date or end_date:
+        start, end = _date_range(start_date, end_date)
+        if mode == 'comments':
+            kwargs['comments'] = search_comments(keyword, author, start, end,
+                                                 limit=NUMBER_PER_PAGE)
+        elif mode in ('introduced', 'dropped') and keyword:
+            kwargs['versions'] = first_changes(
+                keyword, author, start, end,
+                mode='added' if mode == 'introduced' else 'removed',
+                limit=NUMBER_PER_PAGE)
+        else:
+            if mode not in ('added', 'removed'):
+                mode = 'changed'
+            query_set = history_query(keyword, author, start, end, mode)
+            kwargs = paginate(query_set, 'changed_on', descending=not oldest_first)
+            kwargs['versions'] = kwargs['data'].items
+
+        if 'versions' in kwargs:
+            kwargs['versions'] = _changes(kwargs['versions'], keyword, mode)
+
+    return render_template(
+        'wiki/history_search.html',
+        form=form,
+        **kwargs
+    )
+
+
+def _changes(wiki_page_versions, keyword, mode):
+    """`(wiki_page_version, title, lines)` of the versions of pages which
+    still exist, with the lines of the change showing links by title."""
+    mode = {'introduced': 'added', 'dropped': 'removed'}.get(mode, mode)
+    titles = dict(WikiPage
+                  .objects(id__in=[pv.page.id for pv in wiki_page_versions])
+                  .scalar('id', 'title'))
+    wiki_page_versions = [pv for pv in wiki_page_versions if pv.page.id in titles]
+    changes = [changed_lines(pv, keyword, mode) for pv in wiki_page_versions]
+    # one lookup of the linked titles for all the lines
+    lines = iter(denormalize_links(
+        '\n'.join(line for lines in changes for _, line in lines)).split('\n'))
+    return [(pv, titles[pv.page.id], [(sign, next(lines)) for sign, _ in change])
+            for pv, change in zip(wiki_page_versions, changes)]
+
+
+@blueprint.route('/search/groups')
+@login_required
+def search_groups():
+    """Search every wiki group the user is logged into. The results are
+    fetched by the page from `search_groups_results`."""
+    keyword = request.args.get('keyword', '')
+    return render_template(
+        'wiki/search_groups.html',
+        keyword=keyword,
+        wiki_groups=_logged_in_groups()
+    )
+
+
+@blueprint.route('/search/groups/results')
+@login_required
+def search_groups_results():
+    """Search results of each wiki group the user is logged into, as a
+    line of JSON per group, sent as soon as the group answers."""
+    keyword = request.args.get('keyword', '')
+    limit = min(request.args.get('limit', default=20, type=int), NUMBER_PER_PAGE)
+    names = {wiki_group.db_name: wiki_group.name for wiki_group in _logged_in_groups()}
+
+    def generate():
+        if not keyword or keyword.isspace():
+            return
+        for wiki_group, results, total in federated_search.search(names, keyword, limit):
+            for result in results or []:
+                result['url'] = url_for('.page', wiki_group=wiki_group, wiki_page_id=result['id'])
+            yield json.dumps(dict(
+                wiki_group=wiki_group,
+                name=names[wiki_group],
+                results=results,
+                total=total
+            )) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no'})
+
+
+def _logged_in_groups():
+    """The active wiki groups the user is logged into, all of them for
+    the super admin."""
+    user_id_dict = convert_user_ids_to_dict(session.get('user_id'))
+    return [wiki_group for wiki_group in wiki_groups.active()
+            if DEFAULT_CONNECTION_NAME in user_id_dict or wiki_group.db_name in user_id_dict]
+
+
+@blueprint.route('/titles/complete')
+@login_required
+def complete_titles():
+    """Pages with a title, or a word of it, starting with `q`."""
+    prefix = request.args.get('q', '')
+    limit = min(request.args.get('limit', default=10, type=int), 50)
+    return jsonify([dict(id=page_id, title=title)
+                    for page_id, title in title_index.complete(g.wiki_group, prefix, limit)])
+
+
 @blueprint.route('/changes')
 @login_required
+@secondary_reads
 def changes():
     selected_wiki_user = request.args.get('user')
     wiki_users = WikiUser.objects.distinct('name')
@@ -443,9 +671,8 @@ def changes():
 
     query_set = (WikiPage
                  .objects(**filters)
-                 .only('title', 'modified_on', 'modified_by')
-                 .order_by('-modified_on'))
-    kwargs = paginate(query_set)
+                 .only('title', 'modified_on', 'modified_by'))
+    kwargs = paginate(query_set, 'modified_on', descending=True)
 
     return render_template(
         'wiki/changes.html',
@@ -463,6 +690,8 @@ def pdf(wiki_page_id):
                  .only('title', 'html', 'modified_on', 'modified_by')
                  .get_or_404(id=wiki_page_id))
 
+    wiki_page.html, = resolve_titles(wiki_page.html)
+
     return render_template(
         'wiki/pdf.html',
         wiki_page=wiki_page,
@@ -22,4 +22,4 @@ logging.basicConfig(
     level=logging.INFO
 )
 app.logger.addHandler(logger)
-serve(app, listen='127.0.0.1:31415', threads=1)
\ No newline at end of file
+serve(app, listen='127.0.0.1:31415', threads=app.config['WAITRESS_THREADS'])
@@ -0,0 +1,47 @@
+#! /bin/bash
+# Start a local three node replica set, to try out reading from secondaries
+# (see READ_PREFERENCE in pw/settings.py). Stop it with stop_mongodb.sh.
+
+ROOT="$( cd "$( cd "$(dirname "$0")" ; pwd -P )/../.." ; pwd -P )"
+RS_PATH="$ROOT/data/rs"
+PORTS="27017 27018 27019"
+
+# the nodes authenticate each other with a key file, created on first start
+if [ ! -f "$RS_PATH/keyfile" ]; then
+  if [ -z "$DB_USER" ] || [ -z "$DB_PASS" ]; then
+    echo "Set DB_USER and DB_PASS for the admin account to create"
+    exit 1
+  fi
+  mkdir -p "$RS_PATH"
+  openssl rand -base64 756 > "$RS_PATH/keyfile"
+  chmod 400 "$RS_PATH/keyfile"
+  INITIATE=1
+fi
+
+for PORT in $PORTS; do
+  mkdir -p "$RS_PATH/$PORT"
+  mongod --replSet rs0 --dbpath "$RS_PATH/$PORT" \
+      --bind_ip 127.0.0.1 --port $PORT \
+      --keyFile "$RS_PATH/keyfile" \
+      --logpath "$RS_PATH/$PORT.log" \
+      --fork
+done
+
+if [ -n "$INITIATE" ]; then
+  sleep 3
+  mongo --port 27017 --quiet --eval "rs.initiate({_id: 'rs0', members: [
+      {_id: 0, host: '127.0.0.1:27017'},
+      {_id: 1, host: '127.0.0.1:27018'},
+      {_id: 2, host: '127.0.0.1:27019'}]})"
+
+  # wait for the first node to become primary
+  until mongo --port 27017 --quiet --eval "db.isMaster().ismaster" | grep -q true; do
+    sleep 1
+  done
+
+  # create admin account for database, allowed from localhost before any user exists
+  mongo admin --port 27017 --eval "db.createUser({user: '$DB_USER', pwd: '$DB_PASS', roles:[{role:'root',db:'admin'}]});"
+fi
+
+echo "Replica set started, connect to it with"
+echo "DB_SERVICE='mongodb://127.0.0.1:27017,127.0.0.1:27018,127.0.0.1:27019/admin?replicaSet=rs0'"
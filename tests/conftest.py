@@ -1,14 +1,76 @@
 # -*- coding: utf-8 -*-
 """Defines fixtures available to all tests."""
 
+import mongomock
 import pytest
+from flask import g
+from pymongo import DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from flask_login import login_user
 from webtest import TestApp
 from mongoengine.connection import get_db
 
 from pw.app import create_app
-from pw.extensions import db as _db
+from pw.extensions import db as _db, wiki_groups
 from pw.models import *
 
+from tests.factories import PASSWORD, WikiGroupFactory, WikiPageFactory, WikiUserFactory
+
+
+def _bulk_write(collection, requests, ordered=True):
+    for request in requests:
+        if isinstance(request, InsertOne):
+            collection.insert_one(request._doc)
+        elif isinstance(request, ReplaceOne):
+            collection.replace_one(request._filter, request._doc, upsert=request._upsert)
+        elif isinstance(request, UpdateOne):
+            collection.update_one(request._filter, request._doc, upsert=request._upsert)
+        elif isinstance(request, UpdateMany):
+            collection.update_many(request._filter, request._doc, upsert=request._upsert)
+        elif isinstance(request, DeleteOne):
+            collection.delete_one(request._filter)
+        else:
+            collection.delete_many(request._filter)
+
+
+@pytest.fixture(autouse=True)
+def bulk_writes(monkeypatch):
+    """Run bulk writes one request after the other. The bulk writes of
+    mongomock are neither unordered nor compatible with the requests of
+    recent pymongo versions."""
+    monkeypatch.setattr(mongomock.collection.Collection, 'bulk_write', _bulk_write)
+
+
+class _ReadPreferenceCollection:
+    """A mongomock collection with a read preference, which is otherwise
+    ignored, the mock server being its own primary."""
+
+    def __init__(self, collection, read_preference):
+        self._collection = collection
+        self.read_preference = read_preference
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+@pytest.fixture(autouse=True)
+def read_preferences(monkeypatch):
+    """Accept the read preferences mongomock does not implement."""
+    with_options = mongomock.collection.Collection.with_options
+
+    def _with_options(collection, read_preference=None, **kwargs):
+        collection = with_options(collection, **kwargs)
+        if read_preference is None:
+            return collection
+        return _ReadPreferenceCollection(collection, read_preference)
+    monkeypatch.setattr(mongomock.collection.Collection, 'with_options', _with_options)
+
+
+@pytest.fixture(autouse=True)
+def max_time(monkeypatch):
+    """Accept the time limits of queries, which mongomock does not."""
+    monkeypatch.setattr(mongomock.collection.Cursor, 'max_time_ms',
+                        lambda cursor, max_time_ms: cursor, raising=False)
+
 
 @pytest.fixture
 def app():
@@ -42,7 +104,48 @@ def db():
 
 
 @pytest.fixture
-def wiki_group(db):
-    """A wiki group for the tests."""
+def wiki_group(app, db):
+    """A wiki group for the tests, with a home page, as the current group
+    of the test request."""
     _wiki_group = WikiGroupFactory.create()
-    return _wiki_group
+    wiki_groups.reload()
+    g.wiki_group = _wiki_group.db_name
+    with using_db_alias(_wiki_group.db_name):
+        WikiPageFactory.create(title='Home')
+        yield _wiki_group
+
+    get_db(_wiki_group.db_name).client.drop_database(_wiki_group.db_name)
+    forget_db_alias(_wiki_group.db_name)
+
+
+@pytest.fixture
+def other_group(wiki_group):
+    """A second wiki group."""
+    _wiki_group = WikiGroupFactory.create()
+    wiki_groups.reload()
+    with using_db_alias(_wiki_group.db_name):
+        WikiPageFactory.create(title='Home')
+    yield _wiki_group
+    get_db(_wiki_group.db_name).client.drop_database(_wiki_group.db_name)
+    forget_db_alias(_wiki_group.db_name)
+
+
+@pytest.fixture
+def user(wiki_group):
+    """A user of the wiki group."""
+    return WikiUserFactory.create()
+
+
+@pytest.fixture
+def current_user(user):
+    """`user`, logged in for the test request."""
+    login_user(user)
+    return user
+
+
+@pytest.fixture
+def logged_in(testapp, wiki_group, user):
+    """The Webtest app, logged into the wiki group as `user`."""
+    testapp.post('/{}/login'.format(wiki_group.db_name),
+                 dict(username=user.name, password=PASSWORD))
+    return testapp
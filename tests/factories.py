@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""Factories to help in tests."""
+from factory import LazyFunction, Sequence
+from factory.mongoengine import MongoEngineFactory
+
+from pw.extensions import bcrypt
+from pw.models import WikiGroup, WikiPage, WikiUser
+
+PASSWORD = 'example'
+
+
+class WikiGroupFactory(MongoEngineFactory):
+    """Wiki group factory."""
+
+    name = Sequence(lambda n: 'Group {0}'.format(n))
+    db_name = Sequence(lambda n: 'group{0}'.format(n))
+    active = True
+
+    class Meta:
+        """Factory configuration."""
+
+        model = WikiGroup
+
+
+class WikiUserFactory(MongoEngineFactory):
+    """Wiki user factory, saved to the current database."""
+
+    name = Sequence(lambda n: 'user{0}'.format(n))
+    email = Sequence(lambda n: 'user{0}@example.com'.format(n))
+    is_admin = False
+    # few rounds, to keep the tests fast
+    password_hash = LazyFunction(lambda: bcrypt.generate_password_hash(PASSWORD, 4))
+
+    class Meta:
+        """Factory configuration."""
+
+        model = WikiUser
+
+
+class WikiPageFactory(MongoEngineFactory):
+    """Wiki page factory, saved to the current database."""
+
+    title = Sequence(lambda n: 'Page {0}'.format(n))
+
+    class Meta:
+        """Factory configuration."""
+
+        model = WikiPage
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Compressed history tests."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from pw.diff import make_patch
+from pw.models import WikiPageVersion
+from pw.utils import compress_text, decompress_text, pack_text, unpack_text
+
+from tests.factories import WikiPageFactory
+
+TEXT = 'Some text that compresses well. ' * 20 + 'ünïcödé\n'
+
+
+class TestCompressText:
+    """Text encoded for binary fields."""
+
+    @pytest.mark.parametrize('codec', [None, 'zlib'])
+    def test_round_trip(self, codec):
+        assert decompress_text(compress_text(TEXT, codec), codec) == TEXT
+
+    def test_zstd(self):
+        pytest.importorskip('zstandard')
+        assert decompress_text(compress_text(TEXT, 'zstd'), 'zstd') == TEXT
+        assert unpack_text(pack_text(TEXT, 'zstd')) == TEXT
+
+    def test_pack(self):
+        data = pack_text(TEXT, 'zlib')
+        assert len(data) < len(TEXT)
+        assert unpack_text(data) == TEXT
+
+    def test_unknown_codec(self):
+        with pytest.raises(ValueError):
+            compress_text(TEXT, 'lzma')
+        with pytest.raises(ValueError):
+            decompress_text(b'', 'lzma')
+        with pytest.raises(ValueError):
+            pack_text(TEXT, None)
+
+
+@pytest.mark.usefixtures('wiki_group')
+class TestCompressedStringField:
+    """Diffs stored compressed when that makes them shorter."""
+
+    def stored(self, wiki_page_version):
+        return WikiPageVersion._get_collection().find_one(
+            {'_id': wiki_page_version.id})['diff']
+
+    def test_compressed(self, app):
+        app.config['HISTORY_DIFF_CODEC'] = 'zlib'
+        pv = WikiPageVersion(version=1, diff=TEXT).save()
+        assert isinstance(self.stored(pv), bytes)
+        assert WikiPageVersion.objects.get(id=pv.id).diff == TEXT
+
+    def test_short_values_plain(self, app):
+        app.config['HISTORY_DIFF_CODEC'] = 'zlib'
+        pv = WikiPageVersion(version=1, diff='@@ -1 +1 @@\n-a\n+b\n').save()
+        assert self.stored(pv) == '@@ -1 +1 @@\n-a\n+b\n'
+
+    def test_mixed(self, app):
+        app.config['HISTORY_DIFF_CODEC'] = None
+        plain = WikiPageVersion(version=1, diff=TEXT).save()
+        assert self.stored(plain) == TEXT
+        app.config['HISTORY_DIFF_CODEC'] = 'zlib'
+        compressed = WikiPageVersion(version=2, diff=TEXT).save()
+        assert [pv.diff for pv in WikiPageVersion.objects.order_by('version')] == [TEXT, TEXT]
+        assert isinstance(self.stored(compressed), bytes)
+
+
+def text(version):
+    return ''.join('line {}{}\n'.format(i, '*' * (i == version)) for i in range(10))
+
+
+@pytest.mark.usefixtures('current_user')
+class TestCompactHistory:
+    """`flask compact-history`"""
+
+    @pytest.fixture
+    def wiki_page(self, app):
+        app.config['HISTORY_DIFF_CODEC'] = None
+        _wiki_page = WikiPageFactory.create(md=text(1))
+        for version in range(2, 8):
+            _wiki_page.update_db(make_patch(_wiki_page.md, text(version)), text(version), '',
+                                 update_refs=False)
+            _wiki_page.reload()
+        # versions 1 to 4 are a year old
+        WikiPageVersion._get_collection().update_many(
+            {'version': {'$lte': 4}},
+            {'$set': {'modified_on': datetime.now() - timedelta(days=400)}})
+        return _wiki_page
+
+    def test_compact(self, app, wiki_group, wiki_page):
+        app.config['HISTORY_DIFF_CODEC'] = 'zlib'
+        result = app.test_cli_runner().invoke(
+            args=['compact-history', '-g', wiki_group.db_name, '--days', '365'])
+        assert result.exit_code == 0, result.output
+        assert '4 versions dropped' in result.output
+
+        wiki_page.reload()
+        assert wiki_page.first_version == 5
+        versions = WikiPageVersion.objects(page=wiki_page).order_by('version')
+        assert [pv.version for pv in versions] == [5, 6]
+        assert versions[0].snapshot is not None
+        for version in range(5, 8):
+            assert wiki_page.get_md(version) == text(version)
+        with pytest.raises(ValueError):
+            wiki_page.get_md(4)
+
+    def test_compress_diffs(self, app, wiki_group, wiki_page):
+        app.config['HISTORY_DIFF_CODEC'] = 'zlib'
+        collection = WikiPageVersion._get_collection()
+        collection.update_one({'version': 6}, {'$set': {'diff': TEXT}})
+        result = app.test_cli_runner().invoke(
+            args=['compact-history', '-g', wiki_group.db_name, '--days', '1000'])
+        assert result.exit_code == 0, result.output
+        assert '0 versions dropped' in result.output
+        assert isinstance(collection.find_one({'version': 6})['diff'], bytes)
+        assert WikiPageVersion.objects.get(version=6).diff == TEXT
+
+    def test_without_codec(self, app, wiki_group, wiki_page):
+        result = app.test_cli_runner().invoke(
+            args=['compact-history', '-g', wiki_group.db_name, '--days', '1000'])
+        assert result.exit_code == 0, result.output
+        assert 'compressed' not in result.output
+        assert WikiPageVersion._get_collection().count_documents(
+            {'diff': {'$type': 'string'}}) == 6
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Diff tests."""
+import random
+
+import pytest
+
+from pw.diff import (BACKENDS, apply_patch, apply_patches, make_patch, parse_hunks,
+                     parse_patch)
+
+TEXTS = [
+    '',
+    'one line without a break',
+    'one\ntwo\nthree\n',
+    'one\ntwo\nthree',
+    'one\r\ntwo\r\n',
+    'a\nb\na\nb\na\nb\n',
+    '\n\n\n',
+]
+
+
+def random_text(r):
+    return ''.join(r.choice(['x\n', 'y\n', 'z\n', 'x', '\n', 'unique {}\n'.format(r.random())])
+                   for _ in range(r.randint(0, 30)))
+
+
+@pytest.mark.parametrize('backend', [None] + sorted(BACKENDS))
+class TestRoundTrip:
+    """Patches of every backend."""
+
+    @pytest.mark.parametrize('a', TEXTS)
+    @pytest.mark.parametrize('b', TEXTS)
+    def test_texts(self, backend, a, b):
+        patch = make_patch(a, b, backend)
+        assert apply_patch(a, patch) == b
+        assert apply_patch(b, patch, revert=True) == a
+
+    def test_random(self, backend):
+        r = random.Random(0)
+        for _ in range(200):
+            a, b = random_text(r), random_text(r)
+            patch = make_patch(a, b, backend)
+            assert apply_patch(a, patch) == b
+            assert apply_patch(b, patch, revert=True) == a
+
+    def test_identical(self, backend):
+        assert make_patch('same\n', 'same\n', backend) == ''
+
+    def test_chain(self, backend):
+        r = random.Random(1)
+        versions = [random_text(r) for _ in range(5)]
+        patches = [make_patch(a, b, backend) for a, b in zip(versions, versions[1:])]
+        assert apply_patches(versions[0], patches) == versions[-1]
+        assert apply_patches(versions[-1], reversed(patches), revert=True) == versions[0]
+
+
+def test_long_repetitive_text():
+    a = 'line\n' * 3000 + 'end\n'
+    b = 'line\n' * 1500 + 'middle\n' + 'line\n' * 1500 + 'end\n'
+    for backend in sorted(BACKENDS):
+        patch = make_patch(a, b, backend)
+        assert apply_patch(a, patch) == b
+        assert apply_patch(b, patch, revert=True) == a
+
+
+def test_parse_patch_follows_parse_hunks():
+    patch = make_patch('a\nb\nc\n', 'a\nB\nc\nd\n')
+    assert parse_hunks(patch) == [(2, 1, 2, 1, ['b\n'], ['B\n']),
+                                  (3, 0, 4, 1, [], ['d\n'])]
+    assert [tuple(hunk) for hunk in parse_patch(patch)] == [(1, ['b\n'], 1, ['B\n']),
+                                                          (3, [], 3, ['d\n'])]
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""History diff view tests."""
+import re
+
+import pytest
+
+from pw.diff import make_patch
+from pw.diffview import render_diff, render_lines
+from pw.models import WikiPage, using_db_alias
+
+from tests.factories import WikiPageFactory
+
+OLD = ''.join('line {}\n'.format(i) for i in range(40))
+NEW = OLD.replace('line 19\n', 'changed 19\n')
+
+
+def expand_url(start, end, offset):
+    return '/lines?start={}&end={}&offset={}'.format(start, end, offset)
+
+
+def line_numbers(rows):
+    return [int(n) for n in re.findall(r'<tr><td class="diff_header">(\d+)</td>', rows)]
+
+
+class TestRenderDiff:
+    """Unchanged lines collapsed around the changes."""
+
+    def test_collapse(self):
+        rows = render_diff(OLD, make_patch(OLD, NEW), 3, expand_url)
+        assert rows.count('diff-expand') == 2
+        assert 'data-url="/lines?start=0&amp;end=16&amp;offset=0"' in rows
+        assert '16 unchanged lines' in rows
+        assert 'data-url="/lines?start=23&amp;end=40&amp;offset=0"' in rows
+        assert line_numbers(rows) == list(range(17, 24))
+        assert 'class="diff_chg">line 19<' in rows
+        assert 'class="diff_chg">changed 19<' in rows
+
+    def test_without_expand_url(self):
+        rows = render_diff(OLD, make_patch(OLD, NEW), 3)
+        assert 'diff-expand' not in rows
+        assert line_numbers(rows) == list(range(1, 41))
+
+    def test_short_gap_shown(self):
+        """A single unchanged line is shown rather than collapsed."""
+        new = NEW.replace('line 27\n', 'changed 27\n')
+        rows = render_diff(OLD, make_patch(OLD, new), 3, expand_url)
+        assert rows.count('diff-expand') == 2
+        assert line_numbers(rows) == list(range(17, 32))
+
+    def test_added_lines(self):
+        new = OLD.replace('line 19\n', 'line 19\nnew a\nnew b\n')
+        rows = render_diff(OLD, make_patch(OLD, new), 3, expand_url)
+        assert rows.count('class="diff_add"') == 2
+        # the new line numbers after the insertion are shifted
+        assert 'data-url="/lines?start=23&amp;end=40&amp;offset=2"' in rows
+
+    def test_render_lines(self):
+        rows = render_lines(OLD, 22, 25, 2)
+        assert line_numbers(rows) == [23, 24, 25]
+        assert '<td class="diff_header">27</td><td>line 24</td>' in rows
+
+    def test_escape(self):
+        old = '<b>\n'
+        rows = render_diff(old, make_patch(old, '<i>\n'))
+        assert '&lt;b&gt;' in rows and '<b>' not in rows
+
+
+class TestHistoryView:
+    """The history page of a wiki page."""
+
+    @pytest.fixture
+    def wiki_page(self, wiki_group, current_user):
+        _wiki_page = WikiPageFactory.create(md=OLD)
+        _wiki_page.update_db(make_patch(OLD, NEW), NEW, '', update_refs=False)
+        return _wiki_page
+
+    def test_history(self, logged_in, wiki_group, wiki_page):
+        res = logged_in.get('/{}/history/{}'.format(wiki_group.db_name, wiki_page.id))
+        assert 'changed 19' in res
+        url = re.search(r'data-url="([^"]+)"', res.text).group(1).replace('&amp;', '&')
+        lines = logged_in.get(url)
+        assert line_numbers(lines.text) == list(range(1, 17))
+
+    def test_no_versions(self, logged_in, wiki_group):
+        with using_db_alias(wiki_group.db_name):
+            wiki_page = WikiPage.objects(title='Home').first()
+        wiki_page.update(current_version=2)
+        res = logged_in.get('/{}/history/{}'.format(wiki_group.db_name, wiki_page.id))
+        assert res.status_code == 302
+        assert res.location.endswith('/page/{}'.format(wiki_page.id))
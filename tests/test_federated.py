@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Search of several wiki groups at once."""
+import json
+from threading import Event
+
+import pytest
+
+from pw.federated import FederatedSearch
+from pw.models import using_db_alias
+
+from tests.factories import PASSWORD, WikiPageFactory, WikiUserFactory
+
+
+@pytest.fixture
+def groups(app, tmpdir, wiki_group, other_group):
+    """Database names of two groups with pages about fruit."""
+    app.config['SEARCH_INDEX_PATH'] = str(tmpdir)
+    for _wiki_group, titles in ((wiki_group, ['Apple', 'Apple pie', 'Pear']),
+                                (other_group, ['Apple tree'])):
+        with using_db_alias(_wiki_group.db_name):
+            for title in titles:
+                WikiPageFactory.create(title=title, md='about {}'.format(title.lower()))
+    return [wiki_group.db_name, other_group.db_name]
+
+
+class TestFederatedSearch:
+    """Groups searched in parallel, yielded as they answer."""
+
+    def test_search(self, groups):
+        results = {wiki_group: (results, total) for wiki_group, results, total
+                   in FederatedSearch().search(groups, 'apple')}
+        assert set(results) == set(groups)
+        first, total = results[groups[0]]
+        assert total == 2
+        assert sorted(r['title'] for r in first) == ['Apple', 'Apple pie']
+        assert first[0]['score'] == 1.0
+        assert [r['title'] for r in results[groups[1]][0]] == ['Apple tree']
+
+    def test_limit(self, groups):
+        for wiki_group, results, total in FederatedSearch().search(groups[:1], 'apple', 1):
+            assert len(results) == 1
+            assert total == 2
+
+    def test_failed(self, app, groups, monkeypatch):
+        def _search(app, wiki_group, query, limit):
+            raise RuntimeError
+        monkeypatch.setattr(FederatedSearch, '_search', staticmethod(_search))
+        assert sorted(FederatedSearch().search(groups, 'apple')) == [
+            (wiki_group, None, 0) for wiki_group in sorted(groups)]
+
+    def test_timeout_and_busy(self, app, groups, monkeypatch):
+        app.config['FEDERATED_SEARCH_TIMEOUT'] = 0.1
+        app.config['FEDERATED_SEARCH_PENDING'] = 1
+        release = Event()
+        search = FederatedSearch._search
+
+        def _search(app, wiki_group, query, limit):
+            if wiki_group == groups[1]:
+                release.wait(5)
+            return search(app, wiki_group, query, limit)
+        monkeypatch.setattr(FederatedSearch, '_search', staticmethod(_search))
+
+        federated = FederatedSearch()
+        results = list(federated.search(groups, 'apple'))
+        assert [(wiki_group, r is None) for wiki_group, r, _ in results] == [
+            (groups[0], False), (groups[1], True)]
+        # the slow search is still running, so the group is skipped
+        results = list(federated.search(groups, 'apple'))
+        assert results[-1] == (groups[1], None, 0)
+        release.set()
+        federated._executor.shutdown()
+        assert not federated._pending
+
+
+class TestSearchGroupsView:
+    """Results of the groups the user is logged into."""
+
+    def test_results(self, testapp, wiki_group, other_group, groups):
+        with using_db_alias(wiki_group.db_name):
+            user = WikiUserFactory.create()
+        testapp.post('/{}/login'.format(wiki_group.db_name),
+                     dict(username=user.name, password=PASSWORD))
+        res = testapp.get('/{}/search/groups/results'.format(wiki_group.db_name),
+                          dict(keyword='apple'))
+        lines = [json.loads(line) for line in res.text.splitlines()]
+        assert [line['wiki_group'] for line in lines] == [wiki_group.db_name]
+        assert lines[0]['name'] == wiki_group.name
+        assert lines[0]['total'] == 2
+        assert all(r['url'].startswith('/{}/page/'.format(wiki_group.db_name))
+                   for r in lines[0]['results'])
+
+    def test_empty_keyword(self, logged_in, wiki_group):
+        res = logged_in.get('/{}/search/groups/results'.format(wiki_group.db_name),
+                            dict(keyword=' '))
+        assert res.text == ''
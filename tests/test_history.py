@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""History search tests."""
+from datetime import datetime
+
+import pytest
+
+from pw.history import first_changes, history_query
+from pw.models import WikiPage, WikiPageVersion
+
+
+def version(wiki_page, number, day, added=(), removed=(), changed_by='user'):
+    return WikiPageVersion(page=wiki_page, version=number, diff='',
+                           changed_on=datetime(2020, 1, day), changed_by=changed_by,
+                           added=list(added), removed=list(removed)).save()
+
+
+@pytest.mark.usefixtures('app', 'db')
+class TestFirstChanges:
+    """First and last changes of each page."""
+
+    @pytest.fixture
+    def versions(self):
+        old, new, other = (WikiPage(title=title).save() for title in ('Old', 'New', 'Other'))
+        return dict(
+            old_added=version(old, 1, 1, added=['apple']),
+            old_again=version(old, 2, 20, added=['apple']),
+            old_removed=version(old, 3, 25, removed=['apple']),
+            new_added=version(new, 1, 10, added=['apple', 'pie']),
+            new_removed=version(new, 2, 15, removed=['apple']),
+            new_removed_again=version(new, 3, 18, removed=['apple']),
+            other=version(other, 1, 5, added=['pear'], changed_by='someone'),
+        )
+
+    def test_added(self, versions):
+        """The first change of each page, the pages changed latest first."""
+        assert first_changes('apple') == [versions['new_added'], versions['old_added']]
+
+    def test_removed(self, versions):
+        """The last change of each page, the pages changed latest first."""
+        assert (first_changes('apple', mode='removed') ==
+                [versions['old_removed'], versions['new_removed_again']])
+
+    def test_limit(self, versions):
+        """The pages changed latest are kept."""
+        assert first_changes('apple', limit=1) == [versions['new_added']]
+        assert (first_changes('apple', mode='removed', limit=1) ==
+                [versions['old_removed']])
+
+    def test_date_range(self, versions):
+        assert (first_changes('apple', start=datetime(2020, 1, 2)) ==
+                [versions['old_again'], versions['new_added']])
+
+    def test_all_words(self, versions):
+        assert first_changes('apple pie') == [versions['new_added']]
+
+    def test_author(self, versions):
+        assert list(history_query(author='someone')) == [versions['other']]
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Link graph tests."""
+import pytest
+from bson import ObjectId
+
+from pw.diff import make_patch
+from pw.models import WikiLink, linked_files, using_db_alias
+
+from tests.factories import WikiPageFactory, WikiUserFactory, PASSWORD
+
+
+def edges(source, comment=None):
+    return set((link.page, link.file) for link in
+               WikiLink.objects(source=source, comment=comment))
+
+
+@pytest.mark.usefixtures('wiki_group')
+class TestSetLinks:
+    """Edges replaced by the links of a save."""
+
+    def test_set_links(self):
+        source, a, b = ObjectId(), ObjectId(), ObjectId()
+        WikiLink.set_links(source, pages=[a, b], files=[1])
+        assert edges(source) == set([(a, None), (b, None), (None, 1)])
+        WikiLink.set_links(source, pages=[b], files=[1, 2])
+        assert edges(source) == set([(b, None), (None, 1), (None, 2)])
+
+    def test_unchanged_kind(self):
+        """Pages or files left as they are when not given."""
+        source, a = ObjectId(), ObjectId()
+        WikiLink.set_links(source, pages=[a], files=[1])
+        WikiLink.set_links(source, files=[])
+        assert edges(source) == {(a, None)}
+
+    def test_comments(self):
+        source, a = ObjectId(), ObjectId()
+        WikiLink.set_links(source, pages=[a])
+        WikiLink.set_links(source, pages=[a], files=[3], comment='c1')
+        WikiLink.set_links(source, pages=[], comment=None)
+        assert edges(source) == set()
+        assert edges(source, 'c1') == set([(a, None), (None, 3)])
+
+    def test_linked_files(self):
+        assert linked_files('[file:1] [image:2@10x10] [file:x] [file:1]') == {1, 2}
+
+    @pytest.mark.usefixtures('current_user')
+    def test_update_db(self):
+        target = WikiPageFactory.create(title='Target')
+        source = WikiPageFactory.create(title='Source')
+        source.refs = [target]
+        md = '[[Target]] [file:5]'
+        source.update_db(make_patch(source.md, md), md, '')
+        assert edges(source.id) == set([(target.id, None), (None, 5)])
+
+
+class TestViews:
+    """Views reading the link graph."""
+
+    def test_reference(self, logged_in, wiki_group):
+        with using_db_alias(wiki_group.db_name):
+            target = WikiPageFactory.create(title='Target')
+            source = WikiPageFactory.create(title='Linking page')
+            WikiLink.set_links(source.id, pages=[target.id])
+            commented = WikiPageFactory.create(title='Commented page')
+            WikiLink.set_links(commented.id, pages=[target.id], comment='c1')
+        res = logged_in.get('/{}/reference/{}'.format(wiki_group.db_name, target.id))
+        references = res.text.split('class="list-group"')[1]
+        assert 'Linking page' in references
+        # links in comments are not references of the page
+        assert 'Commented page' not in references
+
+    def test_link_report(self, testapp, wiki_group):
+        with using_db_alias(wiki_group.db_name):
+            admin = WikiUserFactory.create(is_admin=True)
+            WikiPageFactory.create(title='Orphan')
+            source = WikiPageFactory.create(title='Linking page')
+            WikiLink.set_links(source.id, pages=[ObjectId('0' * 24)], files=[42])
+        testapp.post('/{}/login'.format(wiki_group.db_name),
+                     dict(username=admin.name, password=PASSWORD))
+        res = testapp.get('/{}/link-report'.format(wiki_group.db_name))
+        assert 'Orphan' in res
+        assert 'page {}'.format('0' * 24) in res
+        assert 'file 42' in res
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Wiki link resolution tests."""
+import pytest
+
+from pw import markdown as markdown_module
+from pw.extensions import markdown
+from pw.markdown import WikiLinks
+from pw.models import WikiFile, WikiPage
+
+from tests.factories import WikiPageFactory
+
+
+@pytest.mark.usefixtures('wiki_group')
+class TestWikiLinks:
+    """Links resolved up front, in one query per collection."""
+
+    def test_resolve(self):
+        wiki_page = WikiPageFactory.create(title='Existing')
+        wiki_file = WikiFile(name='a.txt').save()
+        links = WikiLinks('[[Existing]] [[Existing]] [[Missing]] [[#{}]] [file:{}] [file:999]'
+                          .format(wiki_page.id, wiki_file.id))
+        assert links.titles == {'Existing', 'Missing', '#{}'.format(wiki_page.id)}
+        assert links.pages['Existing'].id == wiki_page.id
+        assert links.pages['#{}'.format(wiki_page.id)].id == wiki_page.id
+        assert 'Missing' not in links.pages
+        assert links.files == {wiki_file.id: wiki_file}
+
+    def test_no_query_after_scan(self, monkeypatch):
+        """Pages found by the scan are not looked up again."""
+        wiki_page = WikiPageFactory.create(title='Existing')
+        links = WikiLinks('[[Existing]] [[#{}]]'.format(wiki_page.id))
+
+        class NoQueries:
+            @property
+            def objects(self):
+                raise AssertionError('page queried while rendering')
+
+        monkeypatch.setattr(markdown_module, 'WikiPage', NoQueries())
+        assert links.get_page('Existing').id == wiki_page.id
+        assert links.get_page('#{}'.format(wiki_page.id)).title == 'Existing'
+
+    def test_deleted_page(self):
+        """A link to the id of a deleted page keeps the id."""
+        links = WikiLinks('[[#{}]]'.format('0' * 24))
+        assert str(links.get_page('#' + '0' * 24).id) == '0' * 24
+        assert not links.new_pages
+
+
+@pytest.mark.usefixtures('current_user')
+class TestRender:
+    """Links in rendered pages."""
+
+    def test_links(self, wiki_group):
+        existing = WikiPageFactory.create(title='Existing')
+        wiki_file = WikiFile(name='a.txt').save()
+        rendered = markdown(WikiPage(title='Page'),
+                            '[[Existing]] [[New]] [[New]] [file:{}]'.format(wiki_file.id),
+                            pure=True)
+        assert '/{}/page/{}'.format(wiki_group.db_name, existing.id) in rendered.html
+        assert 'a.txt' in rendered.html
+        assert [wiki_page.title for wiki_page in rendered.new_pages] == ['New']
+        # both links point to the one page to create
+        new_id = str(rendered.new_pages[0].id)
+        assert rendered.html.count(new_id) == 2
+        assert rendered.md.count('[[#{}]]'.format(new_id)) == 2
+        # the links to existing pages are stored by id on save
+        assert '[[Existing]]' in rendered.md
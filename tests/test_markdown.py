@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Markdown rendering tests."""
+import pytest
+from flask import g
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
+
+from pw.diff import make_patch
+from pw.extensions import markdown
+from pw.markdown import find_dirty_blocks
+from pw.models import WikiPage
+
+OLD = '''# Title
+
+First paragraph, see [[Other]].
+
+## Section
+
+- one
+- two
+
+Last paragraph.
+'''
+
+
+@pytest.fixture
+def wiki_page(app, db):
+    """A page rendered in full, linking to an existing page."""
+    g.wiki_group = DEFAULT_CONNECTION_NAME
+    WikiPage(title='Other').save()
+    _wiki_page = WikiPage(title='Page')
+    rendered = markdown(_wiki_page, OLD)
+    _wiki_page.md = rendered.md
+    _wiki_page.html = rendered.html
+    _wiki_page.blocks = rendered.blocks
+    return _wiki_page
+
+
+@pytest.mark.usefixtures('db')
+class TestIncrementalRender:
+    """Rendering only the blocks an edit touches."""
+
+    def assert_same_as_full(self, wiki_page, new):
+        diff = make_patch(wiki_page.md, new)
+        incremental = markdown.update(wiki_page, new, diff)
+        full = markdown(WikiPage(title='Page'), new)
+        assert incremental.html == full.html
+        assert incremental.toc == full.toc
+        assert incremental.md == full.md
+        assert ([(b.lines, b.html_len) for b in incremental.blocks] ==
+                [(b.lines, b.html_len) for b in full.blocks])
+
+    def test_edit_paragraph(self, wiki_page):
+        new = OLD.replace('First paragraph', 'The first paragraph')
+        diff = make_patch(wiki_page.md, new)
+        assert find_dirty_blocks(wiki_page.blocks, wiki_page.md.splitlines(True),
+                                 new.splitlines(True), diff) is not None
+        self.assert_same_as_full(wiki_page, new)
+
+    def test_edit_list(self, wiki_page):
+        self.assert_same_as_full(wiki_page, OLD.replace('- two\n', '- two\n- three\n'))
+
+    def test_edit_heading(self, wiki_page):
+        self.assert_same_as_full(wiki_page, OLD.replace('## Section', '## Renamed section'))
+
+    def test_add_block(self, wiki_page):
+        self.assert_same_as_full(wiki_page, OLD + '\nAnother paragraph.\n')
+
+    def test_remove_block(self, wiki_page):
+        self.assert_same_as_full(wiki_page, OLD.replace('Last paragraph.\n', ''))
+
+    def test_add_fence(self, wiki_page):
+        """Edits changing the block structure fall back to a full render."""
+        new = OLD.replace('Last paragraph.\n', '```\ncode\n```\n')
+        diff = make_patch(wiki_page.md, new)
+        assert find_dirty_blocks(wiki_page.blocks, wiki_page.md.splitlines(True),
+                                 new.splitlines(True), diff) is None
+        self.assert_same_as_full(wiki_page, new)
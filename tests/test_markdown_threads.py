@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Markdown rendering from several threads."""
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+import pytest
+from flask import current_app
+
+from pw.extensions import markdown
+from pw.markdown import WikiMarkdown
+from pw.models import WikiPage
+
+
+def text(n):
+    return '# Heading {0}\n\n- item {0}\n- see [[Home]]\n\nParagraph {0} with *emphasis*.\n'.format(n)
+
+
+@pytest.mark.usefixtures('current_user')
+class TestThreads:
+    """Parsers borrowed from a pool, results returned in a context."""
+
+    def test_concurrent_renders(self, wiki_group):
+        expected = [markdown(WikiPage(), text(n), pure=True) for n in range(40)]
+        engine = WikiMarkdown()
+        app = current_app._get_current_object()
+
+        def render(n):
+            with app.app_context():
+                return engine(WikiPage(), text(n), pure=True, wiki_group=wiki_group.db_name)
+
+        with ThreadPoolExecutor(8) as executor:
+            futures = [executor.submit(copy_context().run, render, n) for n in range(40)]
+            results = [future.result() for future in futures]
+        assert [r.html for r in results] == [r.html for r in expected]
+        assert [r.toc for r in results] == [r.toc for r in expected]
+        assert len(engine._parsers) <= 8
+
+    def test_parser_reused(self):
+        engine = WikiMarkdown()
+        engine(WikiPage(), text(1), pure=True)
+        engine(WikiPage(), text(2), pure=True)
+        assert len(engine._parsers) == 1
+
+    def test_failed_parser_dropped(self):
+        engine = WikiMarkdown()
+        with pytest.raises(ZeroDivisionError):
+            with engine.parser():
+                1 / 0
+        assert engine._parsers == []
+
+    def test_renders_do_not_share_state(self):
+        """The references of one page do not leak into the next render."""
+        first = WikiPage(title='First')
+        markdown(first, '[[Home]]', pure=True)
+        second = WikiPage(title='Second')
+        markdown(second, 'no links', pure=True)
+        assert [wiki_page.title for wiki_page in first.refs] == ['Home']
+        assert second.refs == []
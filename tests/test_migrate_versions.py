@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Tests of `flask migrate-versions`."""
+import pytest
+
+from pw.models import WikiPage, WikiPageVersion
+
+from tests.factories import WikiPageFactory
+
+
+@pytest.mark.usefixtures('db')
+class TestMigrateVersions:
+    """Pages referenced from their versions instead of listing them."""
+
+    @pytest.fixture
+    def pages(self):
+        """Pages with their versions listed, as before the migration."""
+        _pages = list()
+        for title, count in (('One', 3), ('Two', 1), ('None', 0)):
+            wiki_page = WikiPageFactory.create(title=title, current_version=count + 1)
+            versions = [WikiPageVersion(diff='', version=v + 1).save().id
+                        for v in range(count)]
+            WikiPage._get_collection().update_one(
+                {'_id': wiki_page.id}, {'$set': {'versions': versions}})
+            _pages.append(wiki_page)
+        return _pages
+
+    def test_migrate(self, app, wiki_group, pages):
+        result = app.test_cli_runner().invoke(
+            args=['migrate-versions', '-g', wiki_group.db_name, '-b', '2'])
+        assert result.exit_code == 0, result.output
+        for wiki_page, count in zip(pages, (3, 1, 0)):
+            versions = WikiPageVersion.objects(page=wiki_page).order_by('version')
+            assert [pv.version for pv in versions] == list(range(1, count + 1))
+        assert WikiPage._get_collection().count_documents({'versions': {'$exists': True}}) == 0
+
+    def test_run_again(self, app, wiki_group, pages):
+        runner = app.test_cli_runner()
+        runner.invoke(args=['migrate-versions', '-g', wiki_group.db_name])
+        result = runner.invoke(args=['migrate-versions', '-g', wiki_group.db_name])
+        assert result.exit_code == 0, result.output
+        assert 'migrated' not in result.output
+        assert WikiPageVersion.objects(page=pages[0]).count() == 3
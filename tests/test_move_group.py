@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Tests of wiki groups on several hosts and `flask move-group`."""
+import time
+from types import SimpleNamespace
+
+import mongomock
+import pytest
+
+from pw.commands import _sync_collection
+from pw.extensions import mongo_pool, wiki_groups
+from pw.models import WikiGroup, WikiPage, using_db_alias
+
+from tests.factories import WikiPageFactory
+
+
+@pytest.fixture
+def other_host(app, monkeypatch):
+    """Mock clients for the hosts other than the default one."""
+    monkeypatch.setattr('pw.pool.MongoClient', mongomock.MongoClient)
+    monkeypatch.setattr(mongo_pool, '_clients', dict())
+    return 'other'
+
+
+class TestSyncCollection:
+    """Documents copied in batches, only when they differ."""
+
+    def test_sync(self):
+        source = mongomock.MongoClient().db.source
+        target = mongomock.MongoClient().db.target
+        source.insert_many([{'_id': i, 'n': i} for i in range(10)])
+        assert _sync_collection(source, target, 3) == (10, 0)
+        assert _sync_collection(source, target, 3) == (0, 0)
+
+        source.update_one({'_id': 4}, {'$set': {'n': 40}})
+        source.delete_many({'_id': {'$in': [0, 5, 9]}})
+        source.insert_one({'_id': 10, 'n': 10})
+        assert _sync_collection(source, target, 3) == (2, 3)
+        assert list(target.find(sort=[('_id', 1)])) == list(source.find(sort=[('_id', 1)]))
+
+    def test_empty_source(self):
+        source = mongomock.MongoClient().db.source
+        target = mongomock.MongoClient().db.target
+        target.insert_one({'_id': 1})
+        assert _sync_collection(source, target, 3) == (0, 1)
+
+
+class TestMoveGroup:
+    """A group moved while it is in use."""
+
+    def test_move(self, app, monkeypatch, wiki_group, other_host):
+        app.config['WIKI_GROUP_TTL'] = 0
+        with using_db_alias(wiki_group.db_name):
+            for n in range(5):
+                WikiPageFactory.create()
+            late = WikiPageFactory.create(title='Deleted while frozen')
+
+        def sleep(seconds):
+            assert WikiGroup.objects.get(id=wiki_group.id).frozen
+            # a write which made it in before every process saw the freeze
+            with using_db_alias(wiki_group.db_name):
+                late.delete()
+        monkeypatch.setattr('pw.commands.time', SimpleNamespace(time=time.time, sleep=sleep))
+
+        result = app.test_cli_runner().invoke(
+            args=['move-group', wiki_group.db_name, other_host, '-b', '2'])
+        assert result.exit_code == 0, result.output
+        wiki_group.reload()
+        assert wiki_group.host == other_host
+        assert not wiki_group.frozen
+
+        wiki_groups.reload()
+        assert mongo_pool.host(wiki_group.db_name) == other_host
+        with using_db_alias(wiki_group.db_name):
+            titles = WikiPage.objects.distinct('title')
+        assert len(titles) == 6
+        assert 'Deleted while frozen' not in titles
+
+    def test_same_host(self, app, wiki_group):
+        result = app.test_cli_runner().invoke(args=['move-group', wiki_group.db_name, ''])
+        assert result.exit_code != 0
+        assert 'already on' in result.output
+
+    def test_frozen(self, logged_in, wiki_group):
+        with using_db_alias(wiki_group.db_name):
+            home = WikiPage.objects.get(title='Home')
+        wiki_group.update(frozen=True)
+        wiki_groups.invalidate()
+        url = '/{}/edit/{}'.format(wiki_group.db_name, home.id)
+        assert logged_in.get(url).status_code == 200
+        res = logged_in.post(url, dict(textArea='Changed', current_version=1),
+                             expect_errors=True)
+        assert res.status_code == 503
+        with using_db_alias(wiki_group.db_name):
+            assert WikiPage.objects.get(id=home.id).md != 'Changed'
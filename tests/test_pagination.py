@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Keyset pagination and cached count tests."""
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import pytest
+
+from pw import pagination
+from pw.models import WikiPage
+from pw.pagination import CountCache, paginate
+
+from tests.factories import WikiPageFactory
+
+
+@pytest.fixture
+def pages(app, wiki_group, monkeypatch):
+    """The home page and pages modified one after the other, some at the
+    same time."""
+    monkeypatch.setattr(pagination, 'NUMBER_PER_PAGE', 3)
+    start = datetime(2020, 1, 1)
+    for n in range(10):
+        WikiPageFactory.create(title='Page {}'.format(n),
+                               modified_on=start + timedelta(minutes=n // 2))
+    return list(WikiPage.objects.order_by('-modified_on', '-id'))
+
+
+def listing(app, wiki_group, url=None):
+    """The arguments of the changes listing at `url`."""
+    url = url or '/{}/changes'.format(wiki_group.db_name)
+    with app.test_request_context(url):
+        return paginate(WikiPage.objects, 'modified_on', descending=True)
+
+
+def titles(kwargs):
+    return [wiki_page.title for wiki_page in kwargs['data'].items]
+
+
+class TestPaginate:
+    """Pages fetched after the last item of the previous one."""
+
+    def test_forward(self, app, wiki_group, pages):
+        seen = list()
+        kwargs = listing(app, wiki_group)
+        numbers = list()
+        while True:
+            seen += titles(kwargs)
+            numbers.append(kwargs['current_page_number'])
+            if numbers[-1] == kwargs['total_page_number']:
+                break
+            kwargs = listing(app, wiki_group, kwargs['next_url'])
+        assert seen == [wiki_page.title for wiki_page in pages]
+        assert numbers == [1, 2, 3, 4]
+
+    def test_backward(self, app, wiki_group, pages):
+        url = '/{}/changes?page=4'.format(wiki_group.db_name)
+        kwargs = listing(app, wiki_group, url)
+        assert titles(kwargs) == [wiki_page.title for wiki_page in pages[9:]]
+        kwargs = listing(app, wiki_group, kwargs['prev_url'])
+        assert kwargs['current_page_number'] == 3
+        assert titles(kwargs) == [wiki_page.title for wiki_page in pages[6:9]]
+        kwargs = listing(app, wiki_group, kwargs['prev_url'])
+        kwargs = listing(app, wiki_group, kwargs['prev_url'])
+        assert kwargs['current_page_number'] == 1
+        assert titles(kwargs) == [wiki_page.title for wiki_page in pages[:3]]
+
+    def test_keeps_arguments(self, app, wiki_group, pages):
+        url = '/{}/changes?page=2&oldest_first=0'.format(wiki_group.db_name)
+        query = urlsplit(listing(app, wiki_group, url)['next_url']).query
+        assert 'oldest_first=0' in query
+        assert 'cursor=' in query and 'page=' not in query
+
+    def test_bad_cursor(self, app, wiki_group, pages):
+        url = '/{}/changes?page=2&cursor=nonsense'.format(wiki_group.db_name)
+        assert titles(listing(app, wiki_group, url)) == [p.title for p in pages[3:6]]
+
+
+class TestCountCache:
+    """Counts cached per group and query."""
+
+    def test_cached(self, app, wiki_group):
+        cache = CountCache()
+        assert cache.get(WikiPage.objects) == 1
+        WikiPageFactory.create()
+        assert cache.get(WikiPage.objects) == 1
+        assert cache.get(WikiPage.objects(title__ne='Home')) == 1
+
+    def test_refresh(self, app, wiki_group):
+        app.config['COUNT_CACHE_TTL'] = 0
+        cache = CountCache()
+        cache.get(WikiPage.objects(title__ne='x'))
+        WikiPageFactory.create()
+        # the old count, while a thread counts again
+        assert cache.get(WikiPage.objects(title__ne='x')) == 1
+        for _ in range(100):
+            if not cache._refreshing:
+                break
+            time.sleep(0.01)
+        app.config['COUNT_CACHE_TTL'] = 60
+        assert cache.get(WikiPage.objects(title__ne='x')) == 2
+
+    def test_failed_refresh(self, app, wiki_group, monkeypatch):
+        app.config['COUNT_CACHE_TTL'] = 0
+        cache = CountCache()
+        cache.get(WikiPage.objects)
+
+        def fail(*args):
+            raise RuntimeError
+        monkeypatch.setattr(cache, '_count', fail)
+        assert cache.get(WikiPage.objects) == 1
+        for _ in range(100):
+            if not cache._refreshing:
+                break
+            time.sleep(0.01)
+        assert not cache._refreshing
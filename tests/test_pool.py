@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""MongoDB client pool tests."""
+from threading import Event, Thread
+from types import SimpleNamespace
+
+import mongomock
+import pytest
+from mongoengine.connection import DEFAULT_CONNECTION_NAME, get_connection, get_db
+
+from pw.extensions import mongo_pool
+from pw.pool import PoolStats
+
+
+@pytest.fixture
+def created(app, monkeypatch):
+    """The arguments of the clients created for the other hosts, which are
+    mock clients."""
+    _created = list()
+
+    def client(*args, **kwargs):
+        _created.append((args, kwargs))
+        return mongomock.MongoClient(*args, **kwargs)
+
+    monkeypatch.setattr('pw.pool.MongoClient', client)
+    monkeypatch.setattr(mongo_pool, '_clients', dict())
+    return _created
+
+
+@pytest.fixture
+def pool(created):
+    """`mongo_pool`, with the test aliases dropped afterwards."""
+    yield mongo_pool
+    for db_name in ('pool1', 'pool2', 'pool3'):
+        mongo_pool.disconnect(db_name)
+
+
+class TestClientPool:
+    """One client per host."""
+
+    def test_default_host(self, pool, created):
+        pool.connect('pool1')
+        pool.connect('pool2')
+        default = get_connection(DEFAULT_CONNECTION_NAME)
+        assert get_connection('pool1') is default
+        assert get_connection('pool2') is default
+        assert pool.host('pool1') is None
+        assert created == []
+
+    def test_shared_per_host(self, pool, created):
+        pool.connect('pool1', 'other')
+        pool.connect('pool2', 'other')
+        pool.connect('pool3', 'third')
+        assert get_connection('pool1') is get_connection('pool2')
+        assert get_connection('pool3') is not get_connection('pool1')
+        assert len(created) == 2
+        assert get_db('pool1').name == 'pool1'
+        assert pool.host('pool1') == 'other'
+
+    def test_host_options(self, app, pool, created):
+        app.config['MONGODB_HOSTS'] = {'other': {'username': 'wiki'}}
+        pool.connect('pool1', 'other')
+        assert created == [(('other', None), {'username': 'wiki'})]
+
+    def test_reconnect(self, pool):
+        pool.connect('pool1')
+        get_db('pool1')['page'].insert_one({'title': 'Home'})
+        pool.connect('pool1', 'other')
+        assert 'pool1' in pool
+        assert pool.host('pool1') == 'other'
+        assert get_db('pool1')['page'].count_documents({}) == 0
+
+    def test_reconnect_while_in_use(self, app, pool):
+        """The alias stays defined while it is moved between hosts."""
+        pool.connect('pool1')
+        stop = Event()
+        errors = list()
+
+        def use():
+            while not stop.is_set():
+                try:
+                    get_db('pool1')
+                except Exception as e:
+                    errors.append(e)
+                    return
+
+        threads = [Thread(target=use) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for n in range(500):
+            pool.connect('pool1', 'other' if n % 2 else None)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+
+    def test_disconnect(self, pool):
+        pool.connect('pool1', 'other')
+        client = get_connection('pool1')
+        pool.disconnect('pool1')
+        assert 'pool1' not in pool
+        pool.connect('pool2', 'other')
+        # the client of the host is kept
+        assert get_connection('pool2') is client
+
+
+class TestPoolStats:
+    """Pool events counted by server."""
+
+    def event(self, **kwargs):
+        return SimpleNamespace(address=('db', 27017), **kwargs)
+
+    def test_counts(self):
+        stats = PoolStats()
+        stats.pool_created(self.event(options={'maxPoolSize': 10}))
+        for _ in range(3):
+            stats.connection_created(self.event())
+            stats.connection_checked_out(self.event())
+        stats.connection_checked_in(self.event())
+        stats.connection_check_out_failed(self.event())
+        stats.connection_closed(self.event())
+        pool, = stats.snapshot()
+        assert pool['address'] == 'db:27017'
+        assert pool['max_size'] == 10
+        assert (pool['open'], pool['in_use'], pool['peak_in_use']) == (2, 2, 3)
+        assert (pool['created'], pool['closed'], pool['failed_checkouts']) == (3, 1, 1)
+
+    def test_closed(self):
+        stats = PoolStats()
+        stats.connection_created(self.event())
+        stats.pool_closed(self.event())
+        assert stats.snapshot() == []
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Pure render and live preview tests."""
+import pytest
+
+from pw.extensions import markdown
+from pw.models import WikiPage, using_db_alias
+
+MARKDOWN = '# Title\n\nSee [[Home]] and [[Not yet]].\n'
+
+
+@pytest.mark.usefixtures('current_user')
+class TestPureRender:
+    """Rendering without writing to the database."""
+
+    def test_pure(self):
+        wiki_page = WikiPage(title='Page')
+        rendered = markdown(wiki_page, MARKDOWN, pure=True)
+        assert [new_page.title for new_page in rendered.new_pages] == ['Not yet']
+        assert WikiPage.objects(title='Not yet').count() == 0
+
+    def test_same_html(self):
+        """A pure render shows what saving would."""
+        pure = markdown(WikiPage(title='Page'), MARKDOWN, pure=True)
+        saved = markdown(WikiPage(title='Page'), MARKDOWN)
+        assert WikiPage.objects(title='Not yet').count() == 1
+        new_id = str(saved.new_pages[0].id)
+        assert pure.html.replace(str(pure.new_pages[0].id), new_id) == saved.html
+        assert pure.toc == saved.toc
+
+
+class TestPreview:
+    """The preview endpoint of the editor."""
+
+    def test_preview(self, logged_in, wiki_group):
+        res = logged_in.post('/{}/preview'.format(wiki_group.db_name), dict(md=MARKDOWN))
+        assert res.json['new_pages'] == ['Not yet']
+        assert 'Title' in res.json['toc']
+        assert '<h1' in res.json['html']
+        with using_db_alias(wiki_group.db_name):
+            assert WikiPage.objects(title='Not yet').count() == 0
+
+    def test_login_required(self, testapp, wiki_group):
+        res = testapp.post('/{}/preview'.format(wiki_group.db_name), dict(md=MARKDOWN))
+        assert res.status_code == 302
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Reads from secondaries and read-your-writes."""
+from contextlib import contextmanager
+
+import pytest
+from pymongo.read_preferences import SecondaryPreferred
+
+from pw import blueprints
+from pw.blueprints import _read_preference
+from pw.models import WikiPage, read_preference, using_db_alias, using_read_preference
+
+
+@pytest.fixture
+def preferences(app, monkeypatch):
+    """The read preferences the views used, by path."""
+    app.config['READ_PREFERENCE'] = 'secondaryPreferred'
+    used = list()
+    original = blueprints.using_read_preference
+
+    @contextmanager
+    def recording(preference):
+        with original(preference):
+            used.append(preference.mode)
+            yield
+    monkeypatch.setattr(blueprints, 'using_read_preference', recording)
+    return used
+
+
+class TestReadPreference:
+    """Read preferences from the settings."""
+
+    def test_primary(self, app):
+        app.config['READ_PREFERENCE'] = None
+        assert _read_preference('wiki.page') is None
+        app.config['READ_PREFERENCE'] = 'primary'
+        assert _read_preference('wiki.page') is None
+
+    def test_per_endpoint(self, app):
+        app.config['READ_PREFERENCE'] = 'secondaryPreferred'
+        app.config['READ_PREFERENCES'] = {'wiki.search': 'primary'}
+        assert _read_preference('wiki.page') == SecondaryPreferred()
+        assert _read_preference('wiki.search') is None
+
+    def test_max_staleness(self, app):
+        app.config['READ_PREFERENCE'] = 'secondary'
+        app.config['READ_MAX_STALENESS_SECONDS'] = 120
+        assert _read_preference('wiki.page').max_staleness == 120
+
+    def test_collection(self, wiki_group):
+        with using_read_preference(SecondaryPreferred()):
+            assert WikiPage._get_collection().read_preference == SecondaryPreferred()
+            assert WikiPage.objects.count() == 1
+        assert read_preference.get() is None
+
+
+class TestViews:
+    """Read-only views on the secondaries unless the user just wrote."""
+
+    def test_secondary_reads(self, logged_in, wiki_group, preferences):
+        with using_db_alias(wiki_group.db_name):
+            home = WikiPage.objects.get(title='Home')
+        logged_in.get('/{}/page/{}'.format(wiki_group.db_name, home.id))
+        assert preferences == [SecondaryPreferred().mode]
+        # the editor reads from the primary
+        logged_in.get('/{}/edit/{}'.format(wiki_group.db_name, home.id))
+        assert len(preferences) == 1
+
+    def test_read_your_writes(self, app, logged_in, wiki_group, preferences):
+        with using_db_alias(wiki_group.db_name):
+            home = WikiPage.objects.get(title='Home')
+        logged_in.post('/{}/edit/{}'.format(wiki_group.db_name, home.id),
+                       dict(textArea='Changed', current_version=1))
+        logged_in.get('/{}/page/{}'.format(wiki_group.db_name, home.id))
+        assert preferences == []
+
+        app.config['READ_YOUR_WRITES_SECONDS'] = 0
+        logged_in.get('/{}/page/{}'.format(wiki_group.db_name, home.id))
+        assert len(preferences) == 1
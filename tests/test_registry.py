@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Wiki group registry tests."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pw.extensions import mongo_pool, wiki_groups
+from pw.registry import WikiGroupRegistry
+
+from tests.factories import WikiGroupFactory
+
+
+@pytest.mark.usefixtures('db')
+class TestRegistry:
+    """Active groups cached for WIKI_GROUP_TTL seconds."""
+
+    @pytest.fixture
+    def registry(self, app):
+        _registry = WikiGroupRegistry()
+        _registry.reload()
+        return _registry
+
+    def test_active(self, registry):
+        wiki_group = WikiGroupFactory.create()
+        inactive = WikiGroupFactory.create(active=False)
+        registry.invalidate()
+        assert wiki_group.db_name in registry
+        assert inactive.db_name not in registry
+        assert [g.name for g in registry.active()] == [wiki_group.name]
+        assert wiki_group.db_name in mongo_pool
+
+    def test_cached(self, app, registry):
+        app.config['WIKI_GROUP_TTL'] = 60
+        wiki_group = WikiGroupFactory.create()
+        assert wiki_group.db_name not in registry
+        registry.invalidate()
+        assert wiki_group.db_name in registry
+
+    def test_ttl(self, app, registry):
+        app.config['WIKI_GROUP_TTL'] = 60
+        wiki_group = WikiGroupFactory.create()
+        # as loaded by another process a while ago
+        registry._loaded_at = time.time() - 61
+        assert wiki_group.db_name in registry
+
+    def test_deactivated(self, app, registry):
+        app.config['WIKI_GROUP_TTL'] = 60
+        wiki_group = WikiGroupFactory.create()
+        registry.invalidate()
+        assert wiki_group.db_name in registry
+        wiki_group.update(active=False)
+        registry.invalidate()
+        assert wiki_group.db_name not in registry
+
+    def test_single_reload(self, app, registry, monkeypatch):
+        """Threads finding the registry expired reload it once."""
+        app.config['WIKI_GROUP_TTL'] = 60
+        reloads = list()
+        reload = WikiGroupRegistry._reload
+
+        def _reload(self):
+            reloads.append(1)
+            time.sleep(0.05)
+            reload(self)
+        monkeypatch.setattr(WikiGroupRegistry, '_reload', _reload)
+        registry.invalidate()
+
+        def check():
+            with app.app_context():
+                return 'missing' in registry
+        with ThreadPoolExecutor(8) as executor:
+            assert not any(executor.map(lambda _: check(), range(8)))
+        assert len(reloads) == 1
+
+    def test_frozen(self, registry):
+        wiki_group = WikiGroupFactory.create(frozen=True)
+        registry.invalidate()
+        assert registry.is_frozen(wiki_group.db_name)
+        assert not registry.is_frozen('missing')
+
+
+class TestRequests:
+    """Requests checked against the registry."""
+
+    def test_unknown_group(self, testapp, wiki_group):
+        assert testapp.get('/missing/home', expect_errors=True).status_code == 404
+
+    def test_deactivated_group(self, testapp, wiki_group):
+        wiki_group.update(active=False)
+        wiki_groups.invalidate()
+        res = testapp.get('/{}/home'.format(wiki_group.db_name), expect_errors=True)
+        assert res.status_code == 404
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Page links stored by id, across renames."""
+import pytest
+
+from pw.markdown import denormalize_links, normalize_links, resolve_titles
+from pw.models import WikiPage, WikiPageVersion, using_db_alias
+
+from tests.factories import WikiPageFactory
+
+
+@pytest.mark.usefixtures('wiki_group')
+class TestLinks:
+    """Titles converted to ids and back."""
+
+    def test_normalize(self):
+        target = WikiPageFactory.create(title='Target')
+        md = normalize_links('[[Target]], [[Missing]] and [[#{}]]'.format(target.id))
+        assert md == '[[#{0}]], [[Missing]] and [[#{0}]]'.format(target.id)
+
+    def test_denormalize(self):
+        target = WikiPageFactory.create(title='Target')
+        md = '[[#{}]] and [[#{}]]'.format(target.id, '0' * 24)
+        # links to deleted pages stay as they are
+        assert denormalize_links(md) == '[[Target]] and [[#{}]]'.format('0' * 24)
+
+    def test_resolve_titles(self):
+        target = WikiPageFactory.create(title='Target')
+        html = '<a class="wiki-page" href="/group/page/{}">Old title</a>'.format(target.id)
+        assert resolve_titles(html, None) == [html.replace('Old title', 'Target'), None]
+
+
+class TestRename:
+    """A rename changes the page only."""
+
+    @pytest.fixture
+    def pages(self, wiki_group):
+        with using_db_alias(wiki_group.db_name):
+            target = WikiPageFactory.create(title='Target')
+            source = WikiPageFactory.create(title='Source')
+        return source, target
+
+    def url(self, wiki_group, view, wiki_page):
+        return '/{}/{}/{}'.format(wiki_group.db_name, view, wiki_page.id)
+
+    def test_rename(self, logged_in, wiki_group, pages):
+        source, target = pages
+        logged_in.post(self.url(wiki_group, 'edit', source),
+                       dict(textArea='See [[Target]].', current_version=1))
+        with using_db_alias(wiki_group.db_name):
+            source.reload()
+        assert source.md == 'See [[#{}]].'.format(target.id)
+
+        res = logged_in.post(self.url(wiki_group, 'rename', target),
+                             dict(new_title='Renamed'))
+        assert res.status_code == 302
+        with using_db_alias(wiki_group.db_name):
+            assert WikiPage.objects.get(id=source.id).md == source.md
+
+        res = logged_in.get(self.url(wiki_group, 'page', source))
+        assert '>Renamed</a>' in res
+        assert '>Target</a>' not in res
+        res = logged_in.get(self.url(wiki_group, 'edit', source))
+        assert 'See [[Renamed]].' in res
+
+    def test_new_page_link(self, logged_in, wiki_group, pages):
+        """Links to the pages created by an edit are stored by id too."""
+        source, _ = pages
+        logged_in.post(self.url(wiki_group, 'edit', source),
+                       dict(textArea='[[Brand new]]', current_version=1))
+        with using_db_alias(wiki_group.db_name):
+            new_page = WikiPage.objects.get(title='Brand new')
+            assert WikiPage.objects.get(id=source.id).md == '[[#{}]]'.format(new_page.id)
+
+
+@pytest.mark.usefixtures('db')
+class TestMigrateLinks:
+    """`flask migrate-links`"""
+
+    def test_migrate(self, app, wiki_group):
+        target = WikiPageFactory.create(title='Target')
+        source = WikiPageFactory.create(title='Source', md='[[Target]] [[Missing]]')
+        WikiPageVersion(page=source, version=1, diff='+[[Target]]\n').save()
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['migrate-links', '-g', wiki_group.db_name])
+        assert result.exit_code == 0, result.output
+        assert '1 pages updated' in result.output
+        source.reload()
+        assert source.md == '[[#{}]] [[Missing]]'.format(target.id)
+        assert WikiPageVersion.objects.get(page=source).diff == '+[[#{}]]\n'.format(target.id)
+
+        result = runner.invoke(args=['migrate-links', '-g', wiki_group.db_name])
+        assert '0 pages updated' in result.output
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Render cache tests."""
+import pytest
+
+from pw.markdown import WikiMarkdown
+from pw.models import WikiPage
+
+from tests.factories import WikiPageFactory
+
+
+@pytest.mark.usefixtures('current_user')
+class TestRenderCache:
+    """Renders reused until a page they link to changes."""
+
+    @pytest.fixture
+    def engine(self, wiki_group):
+        WikiPageFactory.create(title='Target')
+        WikiPageFactory.create(title='Other')
+        return WikiMarkdown()
+
+    def stats(self, engine, wiki_group):
+        return engine.cache._caches.stats(wiki_group.db_name)
+
+    def render(self, engine, md):
+        return engine(WikiPage(title='Page'), md)
+
+    def test_hit(self, engine, wiki_group):
+        first = self.render(engine, '[[Target]]')
+        second = self.render(engine, '[[Target]]')
+        assert second.html == first.html
+        assert self.stats(engine, wiki_group)['hits'] == 1
+
+    def test_invalidate_page(self, engine, wiki_group):
+        target = WikiPage.objects.get(title='Target')
+        link = '[[#{}]]'.format(target.id)
+        assert '>Target</a>' in self.render(engine, link).html
+        self.render(engine, '[[Other]]')
+        target.update(title='Renamed')
+        engine.cache.invalidate_page(wiki_group.db_name, target.id)
+
+        assert '>Renamed</a>' in self.render(engine, link).html
+        self.render(engine, '[[Other]]')
+        # only the render linking to the renamed page was dropped
+        assert self.stats(engine, wiki_group)['hits'] == 1
+
+    def test_invalidate_file(self, engine, wiki_group):
+        self.render(engine, '[file:1]')
+        self.render(engine, '[file:2]')
+        engine.cache.invalidate_file(wiki_group.db_name, '1')
+        self.render(engine, '[file:1]')
+        self.render(engine, '[file:2]')
+        assert self.stats(engine, wiki_group)['hits'] == 1
+
+    def test_pure_not_cached(self, engine, wiki_group):
+        engine(WikiPage(title='Page'), '[[Target]]', pure=True)
+        engine(WikiPage(title='Page'), '[[Target]]', pure=True)
+        stats = self.stats(engine, wiki_group)
+        assert (stats['size'], stats['hits'], stats['misses']) == (0, 0, 0)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Group database routing tests."""
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+import pytest
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
+
+from pw.models import WikiPage, db_alias, use_db_alias, using_db_alias
+
+from tests.factories import PASSWORD, WikiPageFactory, WikiUserFactory
+
+
+class TestDbAlias:
+    """Group documents read and written in the database of the context."""
+
+    def test_separate(self, wiki_group, other_group):
+        with using_db_alias(other_group.db_name):
+            WikiPageFactory.create(title='Other')
+        with using_db_alias(wiki_group.db_name):
+            assert WikiPage.objects(title='Other').count() == 0
+        with using_db_alias(other_group.db_name):
+            assert WikiPage.objects(title='Other').count() == 1
+
+    def test_reset(self, wiki_group, other_group):
+        with pytest.raises(ZeroDivisionError):
+            with using_db_alias(other_group.db_name):
+                1 / 0
+        assert db_alias.get() == wiki_group.db_name
+
+    def test_token(self, wiki_group, other_group):
+        token = use_db_alias(other_group.db_name)
+        assert db_alias.get() == other_group.db_name
+        db_alias.reset(token)
+        assert db_alias.get() == wiki_group.db_name
+
+    def test_threads(self, app, wiki_group, other_group):
+        """Threads working on different groups do not interfere."""
+        with using_db_alias(other_group.db_name):
+            WikiPageFactory.create(title='Other')
+        names = [wiki_group.db_name, other_group.db_name] * 20
+
+        def titles(name):
+            with app.app_context(), using_db_alias(name):
+                return db_alias.get(), sorted(WikiPage.objects.distinct('title'))
+
+        with ThreadPoolExecutor(8) as executor:
+            futures = [executor.submit(copy_context().run, titles, name) for name in names]
+            assert [future.result() for future in futures] == [
+                (name, ['Home'] if name == wiki_group.db_name else ['Home', 'Other'])
+                for name in names]
+
+
+class TestRequests:
+    """The group of a request taken from its url."""
+
+    def test_group_database(self, testapp, wiki_group, other_group):
+        with using_db_alias(other_group.db_name):
+            user = WikiUserFactory.create()
+            wiki_page = WikiPageFactory.create(title='Only in other')
+        testapp.post('/{}/login'.format(other_group.db_name),
+                     dict(username=user.name, password=PASSWORD))
+        res = testapp.get('/{}/page/{}'.format(other_group.db_name, wiki_page.id))
+        assert 'Only in other' in res
+        res = testapp.get('/{}/page/{}'.format(wiki_group.db_name, wiki_page.id),
+                          expect_errors=True)
+        assert res.status_code != 200
+
+    def test_default_after_request(self, testapp, wiki_group):
+        with using_db_alias(DEFAULT_CONNECTION_NAME):
+            testapp.get('/{}/home'.format(wiki_group.db_name), expect_errors=True)
+            assert db_alias.get() == DEFAULT_CONNECTION_NAME
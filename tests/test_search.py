@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Search index tests."""
+from datetime import datetime
+
+import pytest
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
+from pymongo.read_preferences import SecondaryPreferred
+
+from pw.models import WikiComment, WikiPage, read_preference, using_read_preference
+from pw.search import SearchIndex, SearchIndexes
+
+
+def add(index, page_id, title, md='', comments=()):
+    index.add(page_id, title, md, list(comments), datetime(2020, 1, 1))
+
+
+class TestSearchIndex:
+    """BM25 scoring, additions and removals."""
+
+    def test_add(self):
+        index = SearchIndex()
+        add(index, 'a', 'Apple', 'apples are red')
+        add(index, 'b', 'Banana', 'bananas are yellow')
+        assert index.search('red') == (['a'], 1)
+        assert index.search('are')[1] == 2
+
+    def test_title_weighs_more(self):
+        index = SearchIndex()
+        add(index, 'a', 'Other', 'kiwi')
+        add(index, 'b', 'Kiwi', 'other')
+        assert index.search('kiwi')[0] == ['b', 'a']
+
+    def test_comments(self):
+        index = SearchIndex()
+        add(index, 'a', 'Page', comments=['about plums'])
+        assert index.search('plums') == (['a'], 1)
+
+    def test_replace(self):
+        index = SearchIndex()
+        add(index, 'a', 'Page', 'old words')
+        add(index, 'a', 'Page', 'new words')
+        assert index.search('old') == ([], 0)
+        assert index.search('new') == (['a'], 1)
+        assert index.live_count == 1
+
+    def test_remove(self):
+        index = SearchIndex()
+        add(index, 'a', 'Page', 'words')
+        add(index, 'b', 'Other', 'words')
+        index.remove('a')
+        index.remove('missing')
+        assert index.search('words') == (['b'], 1)
+        assert index.live_count == 1
+        assert index.dead_count == 1
+
+    def test_phrase_and_prefix(self):
+        index = SearchIndex()
+        add(index, 'a', 'Page', 'quick brown fox')
+        add(index, 'b', 'Other', 'brown quick fox')
+        assert index.search('"quick brown"') == (['a'], 1)
+        assert index.search('qui*')[1] == 2
+
+    def test_compact(self):
+        index = SearchIndex()
+        for i in range(10):
+            add(index, str(i), 'Page {}'.format(i), 'text {}'.format(i % 2))
+        for i in range(0, 10, 2):
+            index.remove(str(i))
+        index.compact()
+        assert index.dead_count == 0
+        # dead pages no longer count in the idf
+        fresh = SearchIndex()
+        for i in range(1, 10, 2):
+            add(fresh, str(i), 'Page {}'.format(i), 'text {}'.format(i % 2))
+        assert (index.search('text', with_scores=True) ==
+                fresh.search('text', with_scores=True))
+        add(index, '10', 'Page 10', 'text 0')
+        assert index.search('text')[1] == 6
+
+    def test_save_and_load(self, tmpdir):
+        index = SearchIndex()
+        add(index, 'a', 'Apple', 'apples are red')
+        add(index, 'b', 'Banana', 'bananas are yellow')
+        index.remove('b')
+        path = str(tmpdir.join('group.idx'))
+        index.save(path)
+        loaded = SearchIndex.load(path)
+        assert loaded.search('red') == (['a'], 1)
+        assert loaded.search('yellow') == ([], 0)
+
+
+@pytest.mark.usefixtures('db')
+class TestSearchIndexes:
+    """Keeping the index of a group in sync with its pages."""
+
+    @pytest.fixture
+    def indexes(self, app, tmpdir):
+        app.config['SEARCH_INDEX_PATH'] = str(tmpdir)
+        app.config['SEARCH_INDEX_SYNC'] = 3600
+        return SearchIndexes()
+
+    def search(self, indexes, query):
+        return indexes.search(DEFAULT_CONNECTION_NAME, query)
+
+    def test_sync(self, indexes):
+        wiki_page = WikiPage(title='Page', md='first text').save()
+        assert self.search(indexes, 'first') == ([str(wiki_page.id)], 1)
+
+    def test_refresh_changed_page(self, indexes):
+        wiki_page = WikiPage(title='Page', md='first text').save()
+        self.search(indexes, 'first')
+        wiki_page.update(md='second text',
+                         comments=[WikiComment(id='c', md='a comment')])
+        indexes.refresh(DEFAULT_CONNECTION_NAME, wiki_page.id)
+        assert self.search(indexes, 'first') == ([], 0)
+        assert self.search(indexes, 'second') == ([str(wiki_page.id)], 1)
+        assert self.search(indexes, 'comment') == ([str(wiki_page.id)], 1)
+
+    def test_sync_touched_page(self, indexes):
+        """Pages changed by other processes are found by `touched_on`."""
+        wiki_page = WikiPage(title='Page', md='first text').save()
+        self.search(indexes, 'first')
+        wiki_page.update(md='second text', touched_on=datetime.now())
+        indexes.sync(DEFAULT_CONNECTION_NAME)
+        assert self.search(indexes, 'second') == ([str(wiki_page.id)], 1)
+
+    def test_refresh_deleted_page(self, indexes):
+        wiki_page = WikiPage(title='Page', md='text').save()
+        self.search(indexes, 'text')
+        wiki_page.delete()
+        indexes.refresh(DEFAULT_CONNECTION_NAME, wiki_page.id)
+        assert self.search(indexes, 'text') == ([], 0)
+
+    def test_rebuild(self, indexes):
+        WikiPage(title='One', md='text').save()
+        WikiPage(title='Two', md='text').save()
+        assert indexes.rebuild(DEFAULT_CONNECTION_NAME) == 2
+        assert SearchIndexes().search(DEFAULT_CONNECTION_NAME, 'text')[1] == 2
+
+    def test_sync_from_primary(self, indexes, monkeypatch):
+        """Searches from views reading the secondaries still sync from the
+        primary."""
+        wiki_page = WikiPage(title='Page', md='text').save()
+        preferences = list()
+        get_collection = WikiPage._get_collection.__func__
+
+        def _get_collection(cls):
+            preferences.append(read_preference.get())
+            return get_collection(cls)
+        monkeypatch.setattr(WikiPage, '_get_collection', classmethod(_get_collection))
+        indexes.refresh(DEFAULT_CONNECTION_NAME, wiki_page.id)
+        with using_read_preference(SecondaryPreferred()):
+            assert self.search(indexes, 'text') == ([str(wiki_page.id)], 1)
+        assert preferences and set(preferences) == {None}
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Sidebar cache tests."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from pw.cache import ExpiringGroupCache
+from pw.diff import make_patch
+from pw.models import WikiPage
+
+from tests.factories import WikiPageFactory
+
+
+class Loader:
+    """Counts its calls."""
+
+    def __init__(self, value=None):
+        self.calls = 0
+        self.value = value
+
+    def __call__(self):
+        self.calls += 1
+        return self.value if self.value is not None else self.calls
+
+
+@pytest.mark.usefixtures('app')
+class TestExpiringGroupCache:
+    """One value per group, kept for a while."""
+
+    def test_cached(self, app):
+        app.config['TEST_TTL'] = 60
+        cache = ExpiringGroupCache('TEST_TTL')
+        load = Loader()
+        assert cache.get('a', load) == 1
+        assert cache.get('a', load) == 1
+        assert cache.get('b', load) == 2
+
+    def test_expired(self, app):
+        app.config['TEST_TTL'] = 0
+        cache = ExpiringGroupCache('TEST_TTL')
+        load = Loader()
+        cache.get('a', load)
+        assert cache.get('a', load) == 2
+
+    def test_pop(self, app):
+        app.config['TEST_TTL'] = 60
+        cache = ExpiringGroupCache('TEST_TTL')
+        load = Loader()
+        cache.get('a', load)
+        cache.pop('a')
+        assert cache.get('a', load) == 2
+
+    def test_popped_while_loading(self, app):
+        """A value loaded before the change it misses is not kept."""
+        app.config['TEST_TTL'] = 60
+        cache = ExpiringGroupCache('TEST_TTL')
+
+        def load():
+            cache.pop('a')
+            return 'stale'
+        assert cache.get('a', load) == 'stale'
+        assert cache.get('a', Loader('fresh')) == 'fresh'
+
+
+@pytest.mark.usefixtures('current_user')
+class TestSidebar:
+    """Key pages and latest changes of the group."""
+
+    def test_sidebar(self, app, wiki_group):
+        app.config['SIDEBAR_CACHE_TTL'] = 60
+        WikiPageFactory.create(title='Key', keypage=1)
+        keypages, changes = WikiPage.sidebar()
+        assert [wiki_page.title for wiki_page in keypages] == ['Key']
+        assert changes[0].title == 'Key'
+
+        WikiPageFactory.create(title='Not seen yet')
+        assert WikiPage.sidebar()[1][0].title == 'Key'
+
+    def test_edit(self, app, wiki_group):
+        app.config['SIDEBAR_CACHE_TTL'] = 60
+        an_hour_ago = datetime.now() - timedelta(hours=1)
+        WikiPage.objects(title='Home').update(modified_on=an_hour_ago - timedelta(minutes=1))
+        wiki_page = WikiPageFactory.create(title='Edited', modified_on=an_hour_ago)
+        WikiPageFactory.create(title='Newer', modified_on=an_hour_ago + timedelta(minutes=1))
+        assert [p.title for p in WikiPage.sidebar()[1]] == ['Newer', 'Edited', 'Home']
+        wiki_page.update_db(make_patch('', 'text'), 'text', '', update_refs=False)
+        assert [p.title for p in WikiPage.sidebar()[1]] == ['Edited', 'Newer', 'Home']
+
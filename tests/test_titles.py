@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Title autocomplete tests."""
+import pytest
+
+from pw.models import WikiPage, using_db_alias
+from pw.search import TitleIndex
+
+from tests.factories import WikiPageFactory
+
+
+class TestTitleIndex:
+    """Titles completed from the start of any of their words."""
+
+    def test_complete(self):
+        index = TitleIndex()
+        index.load([('a', 'Pie chart'), ('b', 'Apple pie'), ('c', 'Pear')])
+        assert [title for _, title in index.complete('pie')] == ['Pie chart', 'Apple pie']
+        assert index.complete('cha') == [('a', 'Pie chart')]
+        assert index.complete('pe') == [('c', 'Pear')]
+
+    def test_rename_and_remove(self):
+        index = TitleIndex()
+        index.add('a', 'Pie chart')
+        index.add('a', 'Bar chart')
+        assert index.complete('pie') == []
+        assert index.complete('bar') == [('a', 'Bar chart')]
+        index.remove('a')
+        assert index.complete('chart') == []
+
+
+class TestCompleteTitles:
+    """The completion endpoint of the editor."""
+
+    @pytest.fixture
+    def pages(self, app, wiki_group):
+        app.config['SEARCH_INDEX_SYNC'] = 3600
+        with using_db_alias(wiki_group.db_name):
+            return [WikiPageFactory.create(title=title)
+                    for title in ('Pie chart', 'Apple pie', 'Pear')]
+
+    def complete(self, testapp, wiki_group, q):
+        res = testapp.get('/{}/titles/complete'.format(wiki_group.db_name), dict(q=q))
+        return sorted(result['title'] for result in res.json)
+
+    def test_complete(self, logged_in, wiki_group, pages):
+        assert self.complete(logged_in, wiki_group, 'pie') == ['Apple pie', 'Pie chart']
+        res = logged_in.get('/{}/titles/complete'.format(wiki_group.db_name),
+                            dict(q='pear'))
+        assert res.json == [dict(id=str(pages[2].id), title='Pear')]
+
+    def test_rename(self, logged_in, wiki_group, pages):
+        self.complete(logged_in, wiki_group, 'pie')
+        logged_in.post('/{}/rename/{}'.format(wiki_group.db_name, pages[0].id),
+                       dict(new_title='Bar chart'))
+        assert self.complete(logged_in, wiki_group, 'pie') == ['Apple pie']
+        assert self.complete(logged_in, wiki_group, 'chart') == ['Bar chart']
+
+    def test_delete(self, logged_in, wiki_group, pages):
+        self.complete(logged_in, wiki_group, 'pie')
+        with using_db_alias(wiki_group.db_name):
+            pages[1].delete()
+            assert WikiPage.objects(title='Apple pie').count() == 0
+        assert self.complete(logged_in, wiki_group, 'pie') == ['Pie chart']
+
+    def test_login_required(self, testapp, wiki_group):
+        res = testapp.get('/{}/titles/complete'.format(wiki_group.db_name), dict(q='p'))
+        assert res.status_code == 302
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Page version tests."""
+import pytest
+
+from pw.diff import make_patch
+from pw.models import WikiPageVersion
+
+from tests.factories import WikiPageFactory
+
+
+def edit(wiki_page, md):
+    """Save `md` as the next version of `wiki_page` and reload it."""
+    wiki_page.update_db(make_patch(wiki_page.md, md), md, '', update_refs=False)
+    wiki_page.reload()
+
+
+def text(version):
+    return ''.join('line {}{}\n'.format(i, '*' * (i == version % 10)) for i in range(10))
+
+
+@pytest.mark.usefixtures('current_user')
+class TestSnapshots:
+    """Versions rebuilt from the nearest snapshot."""
+
+    @pytest.fixture
+    def wiki_page(self, app):
+        app.config['HISTORY_SNAPSHOT_INTERVAL'] = 4
+        _wiki_page = WikiPageFactory.create(md=text(1))
+        for version in range(2, 15):
+            edit(_wiki_page, text(version))
+        return _wiki_page
+
+    def test_get_md(self, wiki_page):
+        assert wiki_page.current_version == 14
+        for version in range(1, 15):
+            assert wiki_page.get_md(version) == text(version)
+
+    def test_snapshots(self, wiki_page):
+        snapshots = WikiPageVersion.objects(page=wiki_page, snapshot__exists=True)
+        assert sorted(pv.version for pv in snapshots) == [4, 8, 12]
+        for pv in snapshots:
+            assert pv.get_snapshot() == text(pv.version)
+
+    def test_without_snapshots(self, app, wiki_page):
+        app.config['HISTORY_SNAPSHOT_INTERVAL'] = 0
+        assert wiki_page.get_md(1) == text(1)
+
+    def test_dropped_version(self, wiki_page):
+        wiki_page.first_version = 5
+        with pytest.raises(ValueError):
+            wiki_page.get_md(4)
+
+    def test_no_snapshot_at_interval(self, app):
+        app.config['HISTORY_SNAPSHOT_INTERVAL'] = 0
+        wiki_page = WikiPageFactory.create(md=text(1))
+        for version in range(2, 6):
+            edit(wiki_page, text(version))
+        assert WikiPageVersion.objects(page=wiki_page, snapshot__exists=True).count() == 0
+        assert wiki_page.get_md(2) == text(2)